@@ -0,0 +1,430 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# eqcatalogueTool is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# eqcatalogueTool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with eqcatalogueTool. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Base class of the engines storing the catalogue in a sqlite database,
+through sqlalchemy. The engines differ in the way they store the
+position of the measures and in the sql of the spatial filters.
+
+A file database can be read while it is written: with `readers` set,
+the database is journaled in WAL mode and, besides the connection
+used to write, the engine keeps a bounded pool of read-only
+connections. The thread that created the engine writes through its
+session, any other thread gets its own session on a reader
+connection (s. :attr:`BaseEngine.session`) and sees the data
+committed by the writer.
+
+e.g.::
+  cat = CatalogueDatabase(filename='my-catalogue.db', readers=4)
+"""
+
+import os
+import threading
+from datetime import datetime
+import sqlalchemy
+from sqlalchemy import orm
+from sqlalchemy.events import event as sqlevent
+from eqcatalogue.log import logger
+
+
+LOG = logger(__name__)
+
+MEASURE_TABLE = 'catalogue_magnitudemeasure'
+
+# the sql of the longitude and of the latitude of the WKT point
+# 'POINT(longitude latitude)', as written by
+# :func:`~eqcatalogue.importers.writer.position_wkt`
+WKT_LONGITUDE = "CAST(substr(%s, 7, instr(%s, ' ') - 7) AS REAL)"
+WKT_LATITUDE = ("CAST(substr(%s, instr(%s, ' ') + 1, "
+                "length(%s) - instr(%s, ' ') - 1) AS REAL)")
+
+ERR_MEMORY_READERS = 'An in-memory catalogue can not have reader connections'
+
+
+def execute_pragmas(dbapi_connection, pragmas):
+    """
+    Execute the `pragmas` on `dbapi_connection` in autocommit mode:
+    some versions of pysqlite begin a transaction before any statement
+    other than a SELECT, while some pragmas can not be changed inside
+    a transaction. A pending transaction is committed first.
+    """
+    isolation_level = dbapi_connection.isolation_level
+    dbapi_connection.isolation_level = None
+    try:
+        for pragma in pragmas:
+            dbapi_connection.execute(pragma)
+    finally:
+        dbapi_connection.isolation_level = isolation_level
+
+
+class BaseEngine(object):
+    """
+    The engine object responsible to map models object to a sqlite
+    database table. Derived classes define the sqlite module
+    (`DBAPI`), the columns storing the position of the measures (s.
+    :meth:`_position_columns`) and the spatial filters. The longitude
+    and the latitude of the measures are always stored in two plain
+    columns.
+
+    The sql of the position used by the importers and by the
+    serializers is given by:
+
+    :attribute POSITION_VALUES: the columns a position is stored
+      into, with the sql expressions of their values given the
+      parameter of the WKT of the position (s.
+      :func:`~eqcatalogue.importers.writer.insert_statement`)
+    :attribute LONGITUDE_SQL: the sql expression of the longitude of
+      a stored measure
+    :attribute LATITUDE_SQL: the sql expression of its latitude
+    """
+    DEFAULT_FILENAME = "eqcatalogue.db"
+    DBAPI = None
+    POSITION_VALUES = (('longitude', WKT_LONGITUDE),
+                       ('latitude', WKT_LATITUDE))
+    LONGITUDE_SQL = '%s.longitude' % MEASURE_TABLE
+    LATITUDE_SQL = '%s.latitude' % MEASURE_TABLE
+
+    # the pragmas set on the writer connection before importing,
+    # trading durability for speed (s.
+    # :func:`~eqcatalogue.importers.base.prepare_session`)
+    IMPORT_PRAGMAS = ("PRAGMA synchronous=OFF",
+                      "PRAGMA count_changes=OFF",
+                      "PRAGMA journal_mode=MEMORY",
+                      "PRAGMA temp_store=OFF")
+
+    # in WAL mode the journal is kept, so that the readers still see
+    # the last committed data during an import
+    WAL_IMPORT_PRAGMAS = ("PRAGMA synchronous=OFF",
+                          "PRAGMA count_changes=OFF",
+                          "PRAGMA temp_store=OFF")
+
+    def __init__(self, memory=False, filename=None, drop=False,
+                 readers=None):
+        """Setup a sqlalchemy connection to sqlite with the proper
+        metadata.
+
+        :param memory: if True the catalogue will use an in-memory
+        database, otherwise a file-based database is used
+
+        :param filename: the filename of the database used. Unused if
+        `memory` is True
+
+        :param drop: drop the content of the database
+
+        :param readers: the number of read-only connections kept for
+        the threads other than the writer one. If given, the database
+        is journaled in WAL mode. Unused if `memory` is True
+        """
+
+        if memory and readers:
+            raise ValueError(ERR_MEMORY_READERS)
+        self.wal = bool(readers)
+        self.to_be_initialized = drop
+        if memory:
+            # set echo=True in debugging
+            self._engine = sqlalchemy.create_engine(
+                'sqlite://', module=self.DBAPI)
+            self.to_be_initialized = True
+        else:
+            filename = filename or self.DEFAULT_FILENAME
+            if not os.path.exists(filename):
+                self.to_be_initialized = True
+            self._engine = sqlalchemy.create_engine(
+                'sqlite:///%s' % filename,
+                module=self.DBAPI,
+                poolclass=sqlalchemy.pool.QueuePool,
+                pool_size=1)
+        self._session = None
+        self._read_sessions = None
+        self._metadata = None
+        self._writer_thread = threading.current_thread()
+        self._setup_engine(self._engine)
+        sqlevent.listen(self._engine, "first_connect", self._connect)
+        sqlevent.listen(self._engine, "connect", self._setup_writer)
+        self._engine.connect()
+        orm.clear_mappers()
+        self._create_schema_magnitudemeasure()
+        self._create_schema_importjournal()
+
+        if self.to_be_initialized:
+            self.recreate()
+        else:
+            # databases created by previous versions may lack some
+            # of the tables or columns, an interrupted bulk load may
+            # have left the measure table without its indexes
+            self._metadata.create_all(self._engine)
+            self._upgrade_schema()
+            self.create_indexes()
+
+        if readers:
+            # reader connections are handed over between threads
+            readers_engine = sqlalchemy.create_engine(
+                'sqlite:///%s' % filename,
+                module=self.DBAPI,
+                poolclass=sqlalchemy.pool.QueuePool,
+                pool_size=readers, max_overflow=0,
+                connect_args={'check_same_thread': False})
+            self._setup_engine(readers_engine)
+            sqlevent.listen(readers_engine, "connect", self._setup_reader)
+            self._read_sessions = orm.scoped_session(
+                orm.sessionmaker(bind=readers_engine, autoflush=False))
+
+    @property
+    def session(self):
+        """
+        The session of the current thread: the writer session in the
+        thread that created the engine (or if there are no reader
+        connections), a session on a reader connection otherwise. A
+        reader thread should close its session when it is done, so
+        that its connection returns to the pool.
+        """
+        if (self._read_sessions is None or
+                threading.current_thread() is self._writer_thread):
+            return self._session
+        return self._read_sessions()
+
+    @property
+    def import_pragmas(self):
+        """
+        The pragmas set on the writer connection before importing
+        """
+        if self.wal:
+            return self.WAL_IMPORT_PRAGMAS
+        return self.IMPORT_PRAGMAS
+
+    def prepare_import(self):
+        """
+        Set the :attr:`import_pragmas` on the writer connection
+        """
+        execute_pragmas(self._session.connection().connection.connection,
+                        self.import_pragmas)
+
+    def recreate(self):
+        """
+        Reset the database (both data and metadata)
+        """
+        self._metadata.drop_all()
+        self._metadata.create_all(self._engine)
+
+    @property
+    def _measure_indexes(self):
+        """
+        The secondary indexes of the measure table. The index backing
+        the unique constraint is not included, as it is needed to
+        detect the measures already stored.
+        """
+        return self._metadata.tables[MEASURE_TABLE].indexes
+
+    def _existing_indexes(self):
+        """
+        Returns the names of the indexes of the measure table that
+        exist in the database
+        """
+        return set(row[1] for row in self.session.execute(
+            "PRAGMA index_list(%s)" % MEASURE_TABLE))
+
+    def drop_indexes(self):
+        """
+        Drop the secondary indexes of the measure table, so that rows
+        can be inserted without maintaining them (s.
+        :meth:`create_indexes`)
+        """
+        existing = self._existing_indexes()
+        for index in self._measure_indexes:
+            if index.name in existing:
+                self.session.execute(sqlalchemy.schema.DropIndex(index))
+        LOG.debug("Measure indexes dropped")
+
+    def create_indexes(self):
+        """
+        Create the secondary indexes of the measure table that do not
+        exist, each one in a single pass over the table, and refresh
+        the statistics used by the query planner
+        """
+        existing = self._existing_indexes()
+        missing = [index for index in self._measure_indexes
+                   if index.name not in existing]
+        for index in missing:
+            self.session.execute(sqlalchemy.schema.CreateIndex(index))
+        if missing:
+            self.session.execute("ANALYZE %s" % MEASURE_TABLE)
+            LOG.debug("Measure indexes created: %s",
+                      sorted(index.name for index in missing))
+        self.session.commit()
+
+    def _upgrade_schema(self):
+        """
+        Add to the measure table of a database created by a previous
+        version the columns it lacks. Derived classes may implement
+        it.
+        """
+
+    def _position_columns(self):
+        """
+        Returns the columns storing the position of a measure. It
+        should be implemented by derived classes
+        """
+        raise NotImplementedError
+
+    def _map_magnitudemeasure(self, measure):
+        """
+        Map :class:`~eqcatalogue.models.MagnitudeMeasure` to the
+        `measure` table, whose position is stored in the columns
+        returned by :meth:`_position_columns`. It should be
+        implemented by derived classes
+        """
+        raise NotImplementedError
+
+    def _create_schema_magnitudemeasure(self):
+        """
+        Create and contains the model definition. We used
+        non-declarative model mapping, as we need to define models at
+        runtime (not at module import time), once the connection to
+        the database has been set up (s. #_connect method)"""
+
+        columns = [
+            sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True),
+            sqlalchemy.Column('created_at',
+                              sqlalchemy.DateTime, default=datetime.now()),
+
+            sqlalchemy.Column('event_source',
+                              sqlalchemy.String(255),
+                              nullable=False,
+                              index=True),
+
+            sqlalchemy.Column('event_key',
+                              sqlalchemy.String(), nullable=False, index=True),
+            sqlalchemy.Column('event_name',
+                              sqlalchemy.String(), nullable=True),
+
+            sqlalchemy.Column('agency',
+                              sqlalchemy.String(), nullable=False, index=True),
+
+            sqlalchemy.Column('origin_key',
+                              sqlalchemy.String(), nullable=False, index=True),
+
+            sqlalchemy.Column('time', sqlalchemy.DateTime,
+                              nullable=False, index=True),
+            sqlalchemy.Column('time_error', sqlalchemy.Float(), nullable=True),
+            sqlalchemy.Column('time_rms', sqlalchemy.Float(), nullable=True)]
+        columns.extend(self._position_columns())
+        columns.extend([
+            sqlalchemy.Column('semi_minor_90error',
+                              sqlalchemy.Float(),
+                              nullable=True),
+            sqlalchemy.Column('semi_major_90error',
+                              sqlalchemy.Float(), nullable=True),
+            sqlalchemy.Column('depth', sqlalchemy.Float(),
+                              nullable=True, index=True),
+            sqlalchemy.Column('depth_error',
+                              sqlalchemy.Float(), nullable=True),
+            sqlalchemy.Column('azimuth_error',
+                              sqlalchemy.Float(),
+                              nullable=True),
+            sqlalchemy.Column('scale', sqlalchemy.String(), index=True),
+            sqlalchemy.Column('value', sqlalchemy.Float(), index=True),
+            sqlalchemy.Column('standard_error',
+                              sqlalchemy.Float(),
+                              nullable=True,
+                              index=True)])
+        measure = sqlalchemy.Table(MEASURE_TABLE, self._metadata, *columns)
+
+        sqlalchemy.schema.UniqueConstraint(
+            measure.c.event_source,
+            measure.c.event_key,
+            measure.c.origin_key,
+            measure.c.time,
+            measure.c.agency,
+            measure.c.scale)
+        self._map_magnitudemeasure(measure)
+
+    def _create_schema_importjournal(self):
+        """
+        Create the table used to keep track of the progress of the
+        imports (s. :class:`eqcatalogue.importers.journal.ImportJournal`)
+        """
+        sqlalchemy.Table(
+            'catalogue_importjournal', self._metadata,
+            sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True),
+            sqlalchemy.Column('fingerprint',
+                              sqlalchemy.String(40), nullable=False),
+            sqlalchemy.Column('importer',
+                              sqlalchemy.String(255), nullable=False),
+            sqlalchemy.Column('filename', sqlalchemy.String()),
+            sqlalchemy.Column('status',
+                              sqlalchemy.String(16), nullable=False),
+            sqlalchemy.Column('byte_offset',
+                              sqlalchemy.Integer, nullable=False),
+            sqlalchemy.Column('line_num',
+                              sqlalchemy.Integer, nullable=False),
+            sqlalchemy.Column('event_source', sqlalchemy.String()),
+            sqlalchemy.Column('measures',
+                              sqlalchemy.Integer, nullable=False),
+            sqlalchemy.Column('errors',
+                              sqlalchemy.Integer, nullable=False),
+            sqlalchemy.Column('updated_at', sqlalchemy.DateTime),
+            sqlalchemy.schema.UniqueConstraint('fingerprint', 'importer'))
+
+    def within_polygon(self, polygon):
+        """
+        Returns the sql clause selecting the measures within the WKT
+        `polygon`. It should be implemented by derived classes
+        """
+        raise NotImplementedError
+
+    def within_distance(self, point, distance):
+        """
+        Returns the sql clause selecting the measures within
+        `distance` meters from the WKT `point`. It should be
+        implemented by derived classes
+        """
+        raise NotImplementedError
+
+    def _connect(self, dbapi_connection, _connection_rec=None):
+        """Create the session and the metadata on the first
+        connection. Event handler triggered by sqlalchemy"""
+
+        self._session = orm.sessionmaker(bind=self._engine)()
+        self._metadata = sqlalchemy.MetaData(self._engine)
+
+    def _setup_engine(self, engine):
+        """
+        Set up a new sqlalchemy `engine`, either the writer or the
+        readers one, before it is connected. Derived classes may
+        extend it.
+        """
+
+    def _setup_connection(self, dbapi_connection):
+        """
+        Set up a new connection, either the writer or a reader one.
+        Derived classes may extend it.
+        """
+
+    def _setup_writer(self, dbapi_connection, _connection_rec=None):
+        """Set up a writer connection, switching the database to WAL
+        mode if needed (before any transaction is begun). Event
+        handler triggered by sqlalchemy"""
+
+        if self.wal:
+            execute_pragmas(dbapi_connection, ["PRAGMA journal_mode=WAL"])
+        self._setup_connection(dbapi_connection)
+
+    def _setup_reader(self, dbapi_connection, _connection_rec=None):
+        """Set up a read-only connection. Event handler triggered by
+        sqlalchemy"""
+
+        self._setup_connection(dbapi_connection)
+        dbapi_connection.execute("PRAGMA query_only=ON")
+
@@ -0,0 +1,775 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# eqcataloguetool is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EqCatalogueTool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with eqcataloguetool. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Engine for eqcatalogue tool keeping the measures in memory as numpy
+column arrays. There is no sql, no orm mapping and no geometry: the
+filtering criteria are evaluated as boolean masks over the columns
+(s. :meth:`eqcatalogue.filtering.Criteria.mask`) and measure objects
+are built only for the measures iterated over.
+
+e.g.::
+  cat = CatalogueDatabase(engine='eqcatalogue.datastores.columnar')
+  cat.load_file('isc.txt', 'isf_bulletin')
+  measures = C(scale='mb') & C(magnitude__gt=5)
+"""
+
+import weakref
+
+import numpy as np
+import geoalchemy
+from shapely import wkt
+from sqlalchemy import orm
+
+from eqcatalogue.log import logger
+from eqcatalogue.models import BaseMeasure, MagnitudeMeasure, EARTH_RADIUS
+from eqcatalogue.importers.metrics import ImportMetrics
+from eqcatalogue.importers.writer import ROW_FIELDS
+
+
+LOG = logger(__name__)
+
+# number of measure objects built at once while iterating over a query
+HYDRATE_SIZE = 1000
+
+# number of units parsed at once while loading a file
+BATCH_SIZE = 10000
+
+FLOAT_FIELDS = ('latitude', 'longitude', 'depth', 'value', 'standard_error',
+                'time_error', 'time_rms', 'semi_major_90error',
+                'semi_minor_90error', 'depth_error', 'azimuth_error')
+
+# fields encoded as the codes of a `Dictionary`
+CODED_FIELDS = ('agency', 'scale')
+
+TEXT_FIELDS = ('event_source', 'event_key', 'event_name', 'origin_key')
+
+# the fields of the unique constraint of the measures (as in the
+# spatialite engine)
+UNIQUE_FIELDS = ('event_source', 'event_key', 'origin_key', 'time',
+                 'agency', 'scale')
+
+ERR_NO_SQL = 'The columnar engine does not support sql (%s)'
+ERR_ENTITY = 'The columnar engine can only query MagnitudeMeasure, not %s'
+ERR_NO_RESUME = ('The columnar engine keeps no import journal, '
+                 'an import can not be resumed')
+
+_POSITION = ROW_FIELDS.index('position')
+
+
+def to_seconds(times):
+    """
+    Returns the float64 seconds from the epoch of `times` (datetime
+    objects, datetime64 or strings formatted as in the catalogue db)
+    """
+    return np.asarray(times, dtype='M8[us]').astype(np.int64) / 1e6
+
+
+def to_datetimes(seconds):
+    """
+    Returns the list of the datetime objects of the float64 seconds
+    from the epoch `seconds`
+    """
+    return np.round(np.asarray(seconds) * 1e6).astype(
+        np.int64).astype('M8[us]').tolist()
+
+
+def _floats(values):
+    """
+    Returns the float64 array of `values`, with NaN in place of None
+    """
+    return np.array([np.nan if value is None else value
+                     for value in values], dtype=float)
+
+
+def _optional(values):
+    """
+    Returns the list of the float64 `values`, with None in place of
+    NaN
+    """
+    return np.where(np.isnan(values), None, values).tolist()
+
+
+def _parse_position(position):
+    """
+    Returns the longitude and the latitude of the WKT point
+    `position` (as written by
+    :func:`~eqcatalogue.importers.writer.position_wkt`)
+    """
+    longitude, latitude = position[position.index('(') + 1:-1].split()
+    return float(longitude), float(latitude)
+
+
+def _in_ring(x, y, ring):
+    """
+    Returns the mask of the points (`x`, `y`) inside the closed
+    `ring` (a sequence of coordinates), by the even-odd rule
+    """
+    inside = np.zeros(len(x), dtype=bool)
+    ring = list(ring)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for (x1, y1), (x2, y2) in zip(ring[:-1], ring[1:]):
+            crossing = (y1 > y) != (y2 > y)
+            inside ^= crossing & (x < x1 + (y - y1) * (x2 - x1) / (y2 - y1))
+    return inside
+
+
+class Dictionary(object):
+    """
+    The dictionary encoding a column of strings as int32 codes, in the
+    order the strings are first seen
+    """
+
+    def __init__(self):
+        self.names = []
+        self._codes = {}
+
+    def code(self, name):
+        """
+        Returns the code of `name`, None if it is unknown
+        """
+        return self._codes.get(name)
+
+    def encode(self, names):
+        """
+        Returns the array of the codes of `names`, adding the unknown
+        ones to the dictionary
+        """
+        codes = self._codes
+        result = np.empty(len(names), dtype=np.int32)
+        for i, name in enumerate(names):
+            code = codes.get(name)
+            if code is None:
+                code = codes[name] = len(self.names)
+                self.names.append(name)
+            result[i] = code
+        return result
+
+    def decode(self, codes):
+        """
+        Returns the list of the names of `codes`
+        """
+        names = self.names
+        return [names[code] for code in codes.tolist()]
+
+
+class MeasureColumns(object):
+    """
+    The measures of the catalogue as numpy columns: float64 times (in
+    seconds from the epoch), coordinates and values, with NaN in place
+    of the missing ones, dictionary encoded agencies and scales
+    (s. `agencies` and `scales`) and object arrays for the other
+    strings. Columns are accessed by name, e.g. ``columns['value']``.
+
+    Measures violating the unique constraint replace the existing
+    ones, which are marked as dead in the `alive` column. The columns
+    and the sorted indexes on time and scale are rebuilt lazily, at
+    the first query following an insertion.
+
+    As the identity map of a sqlalchemy session, the measure objects
+    in use are kept by id, so that a measure is always represented by
+    the same object.
+    """
+
+    def __init__(self):
+        self.agencies = Dictionary()
+        self.scales = Dictionary()
+        self._chunks = []
+        self._dead = []
+        # hash of the unique key -> position of the measure
+        self._keys = {}
+        # id -> measure object in use
+        self._identity = weakref.WeakValueDictionary()
+        self._size = 0
+        self._columns = None
+        self._time_order = None
+        self._sorted_times = None
+        self._scale_order = None
+        self._scale_bounds = None
+
+    @property
+    def size(self):
+        """
+        The number of measures stored, dead ones included
+        """
+        return self._size
+
+    def insert_rows(self, rows):
+        """
+        Insert the measure `rows`, ordered as
+        :data:`~eqcatalogue.importers.writer.ROW_FIELDS`. Returns the
+        number of measures replaced.
+        """
+        if not rows:
+            return 0
+        values = dict(zip(ROW_FIELDS, zip(*rows)))
+        coordinates = [_parse_position(row[_POSITION]) for row in rows]
+        values['longitude'], values['latitude'] = zip(*coordinates)
+        return self._insert(values, len(rows))
+
+    def _insert(self, values, size):
+        """
+        Insert `size` measures, given as a dictionary of the sequences
+        of their values
+        """
+        chunk = {'id': np.arange(self._size + 1, self._size + size + 1),
+                 'time': to_seconds(values['time']),
+                 'agency': self.agencies.encode(values['agency']),
+                 'scale': self.scales.encode(values['scale'])}
+        for field in FLOAT_FIELDS:
+            chunk[field] = _floats(values[field])
+        for field in TEXT_FIELDS:
+            chunk[field] = np.array(values[field], dtype=object)
+
+        replaced = 0
+        keys = zip(*[chunk['time'].tolist() if field == 'time'
+                     else values[field] for field in UNIQUE_FIELDS])
+        for position, key in enumerate(keys, self._size):
+            key = hash(key)
+            stored = self._keys.get(key)
+            if stored is not None:
+                self._dead.append(stored)
+                replaced += 1
+            self._keys[key] = position
+
+        self._chunks.append(chunk)
+        self._size += size
+        self._columns = None
+        return replaced
+
+    def insert_measures(self, measures):
+        """
+        Insert the :class:`~eqcatalogue.models.MagnitudeMeasure`
+        objects `measures`, setting their ids
+        """
+        values = dict((field, [getattr(measure, field)
+                               for measure in measures])
+                      for field in ROW_FIELDS if field != 'position')
+        values['longitude'], values['latitude'] = zip(*[
+            measure.position_as_tuple() for measure in measures])
+        first_id = self._size + 1
+        self._insert(values, len(measures))
+        for measure_id, measure in enumerate(measures, first_id):
+            measure.id = measure_id
+            self._identity[measure_id] = measure
+
+    def clear(self):
+        """
+        Remove all the measures
+        """
+        self.__init__()
+
+    def _consolidate(self):
+        """
+        Concatenate the inserted chunks and build the sorted indexes
+        """
+        if len(self._chunks) > 1:
+            self._chunks = [dict(
+                (field, np.concatenate([chunk[field]
+                                        for chunk in self._chunks]))
+                for field in self._chunks[0])]
+        columns = dict(self._chunks[0]) if self._chunks else dict(
+            (field, np.empty(0)) for field in
+            ('id', 'time') + FLOAT_FIELDS + CODED_FIELDS + TEXT_FIELDS)
+        alive = np.ones(self._size, dtype=bool)
+        alive[self._dead] = False
+        columns['alive'] = alive
+
+        self._time_order = np.argsort(columns['time'], kind='mergesort')
+        self._sorted_times = columns['time'][self._time_order]
+        scales = columns['scale'].astype(np.int32)
+        self._scale_order = np.argsort(scales, kind='mergesort')
+        self._scale_bounds = np.searchsorted(
+            scales[self._scale_order], np.arange(len(self.scales.names) + 1))
+        self._columns = columns
+
+    def _consolidated(self):
+        """
+        Returns the dictionary of the columns, consolidated if needed
+        """
+        if self._columns is None:
+            self._consolidate()
+        return self._columns
+
+    def __getitem__(self, field):
+        return self._consolidated()[field]
+
+    def dictionary(self, field):
+        """
+        Returns the :class:`Dictionary` of the coded `field`
+        """
+        return {'agency': self.agencies, 'scale': self.scales}[field]
+
+    def _empty_mask(self):
+        return np.zeros(self._size, dtype=bool)
+
+    def before(self, time):
+        """
+        Returns the mask of the measures before `time`, by the sorted
+        index on time
+        """
+        self._consolidated()
+        mask = self._empty_mask()
+        mask[self._time_order[:np.searchsorted(
+            self._sorted_times, to_seconds(time), 'left')]] = True
+        return mask
+
+    def after(self, time):
+        """
+        Returns the mask of the measures after `time`, by the sorted
+        index on time
+        """
+        self._consolidated()
+        mask = self._empty_mask()
+        mask[self._time_order[np.searchsorted(
+            self._sorted_times, to_seconds(time), 'right'):]] = True
+        return mask
+
+    def greater(self, field, value):
+        """
+        Returns the mask of the measures whose `field` is greater than
+        `value` (missing values are not)
+        """
+        with np.errstate(invalid='ignore'):
+            return self[field] > value
+
+    def lower(self, field, value):
+        """
+        Returns the mask of the measures whose `field` is lower than
+        `value` (missing values are not)
+        """
+        with np.errstate(invalid='ignore'):
+            return self[field] < value
+
+    def with_scales(self, scales):
+        """
+        Returns the mask of the measures of one of `scales`, by the
+        sorted index on scale
+        """
+        self._consolidated()
+        mask = self._empty_mask()
+        for scale in scales:
+            code = self.scales.code(scale)
+            if code is not None:
+                mask[self._scale_order[self._scale_bounds[code]:
+                                       self._scale_bounds[code + 1]]] = True
+        return mask
+
+    def with_agencies(self, agencies):
+        """
+        Returns the mask of the measures of one of `agencies`
+        """
+        codes = [self.agencies.code(agency) for agency in agencies]
+        return np.in1d(self['agency'],
+                       [code for code in codes if code is not None])
+
+    def within(self, polygon):
+        """
+        Returns the mask of the measures within the WKT `polygon`. The
+        measures in its bounding box are tested against its rings.
+        """
+        polygon = wkt.loads(polygon)
+        x, y = self['longitude'], self['latitude']
+        min_x, min_y, max_x, max_y = polygon.bounds
+        candidates = np.flatnonzero(
+            (x > min_x) & (x < max_x) & (y > min_y) & (y < max_y))
+        x, y = x[candidates], y[candidates]
+        inside = _in_ring(x, y, polygon.exterior.coords)
+        for interior in polygon.interiors:
+            inside &= ~_in_ring(x, y, interior.coords)
+        mask = self._empty_mask()
+        mask[candidates[inside]] = True
+        return mask
+
+    def within_distance(self, point, distance):
+        """
+        Returns the mask of the measures within `distance` meters
+        from the WKT `point`, by the haversine formula
+        """
+        point = wkt.loads(point)
+        lon1, lat1 = np.radians(point.x), np.radians(point.y)
+        lon2, lat2 = np.radians(self['longitude']), np.radians(
+            self['latitude'])
+        aval = (np.sin((lat2 - lat1) / 2.) ** 2 + np.cos(lat1) *
+                np.cos(lat2) * np.sin((lon2 - lon1) / 2.) ** 2)
+        return 2 * EARTH_RADIUS * np.arcsin(
+            np.sqrt(np.minimum(aval, 1.))) <= distance
+
+    def time_bounds(self):
+        """
+        Returns the minimum and maximum time of the measures alive
+        """
+        times = self['time'][self['alive']]
+        if not len(times):
+            return None, None
+        return tuple(to_datetimes([times.min(), times.max()]))
+
+    def measures(self, positions):
+        """
+        Returns the list of the measure objects at `positions`: the
+        :class:`~eqcatalogue.models.MagnitudeMeasure` objects added to
+        the session or the :class:`ColumnarMeasure` objects read from
+        the columns. Only the measures not in use are built.
+        """
+        identity = self._identity
+        measures = [identity.get(measure_id)
+                    for measure_id in self['id'][positions].tolist()]
+        missing = [i for i, measure in enumerate(measures) if measure is None]
+        if missing:
+            for i, measure in zip(missing,
+                                  self._hydrate(positions[missing])):
+                measures[i] = identity[measure.id] = measure
+        return measures
+
+    def _hydrate(self, positions):
+        """
+        Returns the list of the new :class:`ColumnarMeasure` objects
+        of the measures at `positions`
+        """
+        columns = dict((field, self[field][positions])
+                       for field in ('id', 'time') + FLOAT_FIELDS +
+                       CODED_FIELDS + TEXT_FIELDS)
+        times = to_datetimes(columns['time'])
+        agencies = self.agencies.decode(columns['agency'])
+        scales = self.scales.decode(columns['scale'])
+        floats = dict((field, _optional(columns[field]))
+                      for field in FLOAT_FIELDS)
+        texts = dict((field, columns[field].tolist())
+                     for field in TEXT_FIELDS)
+
+        return [ColumnarMeasure(*values) for values in zip(
+            columns['id'].tolist(), times, agencies, scales,
+            floats['value'], floats['standard_error'],
+            texts['event_source'], texts['event_key'],
+            texts['event_name'], texts['origin_key'],
+            floats['longitude'], floats['latitude'], floats['depth'],
+            floats['depth_error'], floats['time_error'],
+            floats['time_rms'], floats['semi_major_90error'],
+            floats['semi_minor_90error'], floats['azimuth_error'])]
+
+
+class ColumnarMeasure(BaseMeasure):
+    """
+    A measure read from the columns. It has the attributes of a
+    :class:`~eqcatalogue.models.MagnitudeMeasure` in slots, without
+    an instance dictionary, and builds its `position` only when
+    accessed, so that millions of measures can be hydrated.
+    """
+    __slots__ = ('id', 'time', 'agency', 'scale', 'value',
+                 'standard_error', 'event_source', 'event_key',
+                 'event_name', 'origin_key', 'longitude', 'latitude',
+                 'depth', 'depth_error', 'time_error', 'time_rms',
+                 'semi_major_90error', 'semi_minor_90error',
+                 'azimuth_error', '__weakref__')
+
+    def __init__(self, measure_id, time, agency, scale, value,
+                 standard_error, event_source, event_key, event_name,
+                 origin_key, longitude, latitude, depth, depth_error,
+                 time_error, time_rms, semi_major_90error,
+                 semi_minor_90error, azimuth_error):
+        self.id = measure_id
+        self.time = time
+        self.agency = agency
+        self.scale = scale
+        self.value = value
+        self.standard_error = standard_error
+        self.event_source = event_source
+        self.event_key = event_key
+        self.event_name = event_name
+        self.origin_key = origin_key
+        self.longitude = longitude
+        self.latitude = latitude
+        self.depth = depth
+        self.depth_error = depth_error
+        self.time_error = time_error
+        self.time_rms = time_rms
+        self.semi_major_90error = semi_major_90error
+        self.semi_minor_90error = semi_minor_90error
+        self.azimuth_error = azimuth_error
+
+    @property
+    def position(self):
+        """
+        The geoalchemy point of the measure
+        """
+        return Engine.position_from_latlng(self.latitude, self.longitude)
+
+
+class MeasureQuery(object):
+    """
+    A query over the measures of `columns` (a :class:`MeasureColumns`)
+    at `positions` (all the measures alive if None). It provides the
+    part of the sqlalchemy Query interface used by
+    :class:`~eqcatalogue.filtering.Criteria`, the measures satisfying
+    a criteria being selected by :meth:`where`.
+    """
+
+    def __init__(self, columns, positions=None):
+        self.columns = columns
+        self._positions = positions
+
+    @property
+    def positions(self):
+        """
+        The positions of the measures of the query in the columns
+        """
+        if self._positions is None:
+            return np.flatnonzero(self.columns['alive'])
+        return self._positions
+
+    def where(self, mask_fn):
+        """
+        Returns the query of the measures for which the mask returned
+        by `mask_fn` (called with the columns) is True
+        """
+        mask = mask_fn(self.columns)
+        return MeasureQuery(self.columns,
+                            self.positions[mask[self.positions]])
+
+    def union(self, query):
+        return MeasureQuery(self.columns,
+                            np.union1d(self.positions, query.positions))
+
+    def order_by(self, *fields):
+        """
+        Returns the query ordered by `fields`, given by name, with an
+        optional table prefix (e.g. 'catalogue_magnitudemeasure.id')
+        """
+        keys = []
+        for field in reversed(fields):
+            field = str(field).split('.')[-1]
+            values = self.columns[field][self.positions]
+            if field in CODED_FIELDS:
+                # codes are ordered as their names
+                names = self.columns.dictionary(field).names
+                if names:
+                    values = np.argsort(np.argsort(names))[values]
+            keys.append(values)
+        if not keys:
+            return self
+        return MeasureQuery(self.columns,
+                            self.positions[np.lexsort(keys)])
+
+    def distinct(self):
+        return self
+
+    def yield_per(self, _count):
+        return self
+
+    def count(self):
+        return len(self.positions)
+
+    def all(self):
+        return list(self)
+
+    def first(self):
+        measures = self[:1]
+        return measures[0] if measures else None
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.columns.measures(self.positions[item])
+        return self.columns.measures(self.positions[[item]])[0]
+
+    def __iter__(self):
+        for start in xrange(0, len(self.positions), HYDRATE_SIZE):
+            for measure in self.columns.measures(
+                    self.positions[start:start + HYDRATE_SIZE]):
+                yield measure
+
+    def __contains__(self, measure):
+        return measure.id in set(
+            self.columns['id'][self.positions].tolist())
+
+
+class ColumnarSession(object):
+    """
+    The session of the columnar engine: it queries and adds
+    :class:`~eqcatalogue.models.MagnitudeMeasure` objects. The added
+    measures are inserted at the next flush or commit. Changes can
+    not be rolled back once inserted.
+    """
+
+    def __init__(self, columns):
+        self._columns = columns
+        self._pending = []
+        self.autocommit = False
+        self.autoflush = False
+
+    def query(self, entity):
+        if entity is not MagnitudeMeasure:
+            raise NotImplementedError(ERR_ENTITY % entity)
+        self.flush()
+        return MeasureQuery(self._columns)
+
+    def add(self, measure):
+        self._pending.append(measure)
+
+    def add_all(self, measures):
+        self._pending.extend(measures)
+
+    def flush(self):
+        if self._pending:
+            measures, self._pending = self._pending, []
+            self._columns.insert_measures(measures)
+
+    def commit(self):
+        self.flush()
+
+    def rollback(self):
+        self._pending = []
+
+    def close(self):
+        self._pending = []
+
+    def execute(self, statement, *_args, **_kwargs):
+        raise NotImplementedError(ERR_NO_SQL % statement)
+
+    def connection(self):
+        raise NotImplementedError(ERR_NO_SQL % 'connection')
+
+
+class ColumnarLoad(object):
+    """
+    Keeps track of the measures inserted into the columnar engine by a
+    load, with the attributes used to build its summary (s.
+    :func:`~eqcatalogue.importers.base.writer_summary`)
+    """
+
+    skipped = 0
+    changed = 0
+
+    def __init__(self, columns):
+        self._columns = columns
+        self.written = 0
+        self.replaced = 0
+        self.created = {'event_source': set(), 'agency': set(),
+                        'origin_key': set()}
+        self._stored = None
+
+    def insert(self, rows):
+        """
+        Insert the measure `rows` (s. :meth:`MeasureColumns.insert_rows`)
+        """
+        if self._stored is None:
+            self._stored = dict(
+                (field, set(self._stored_values(field)))
+                for field in self.created)
+        for field, created in self.created.items():
+            index = ROW_FIELDS.index(field)
+            created.update(row[index] for row in rows
+                           if row[index] not in self._stored[field])
+        self.replaced += self._columns.insert_rows(rows)
+        self.written += len(rows)
+
+    def _stored_values(self, field):
+        """
+        Returns the values of `field` of the measures stored before
+        the load
+        """
+        columns = self._columns
+        if not columns.size:
+            return []
+        values = columns[field][columns['alive']]
+        if field in CODED_FIELDS:
+            return columns.dictionary(field).decode(np.unique(values))
+        return np.unique(values.astype(object)).tolist()
+
+    @property
+    def created_measures(self):
+        return self.written - self.replaced
+
+
+class Engine(object):
+    """
+    The engine keeping the measures in memory as numpy columns (s.
+    :class:`MeasureColumns`). The catalogue is always in-memory: the
+    `memory`, `filename` and `drop` parameters are accepted for
+    compatibility with the spatialite engine and ignored.
+    """
+
+    columnar = True
+
+    def __init__(self, memory=True, filename=None, drop=False):
+        # the measures are plain objects, not mapped to a table
+        orm.clear_mappers()
+        self.columns = MeasureColumns()
+        self.session = ColumnarSession(self.columns)
+
+    def recreate(self):
+        """
+        Remove all the measures
+        """
+        self.session.rollback()
+        self.columns.clear()
+
+    def drop_indexes(self):
+        """
+        The sorted indexes are rebuilt at the first query following an
+        insertion, so there is nothing to drop
+        """
+
+    def create_indexes(self):
+        """
+        The sorted indexes are rebuilt lazily (s.
+        :meth:`drop_indexes`)
+        """
+
+    @staticmethod
+    def position_from_latlng(latitude, longitude):
+        """
+        Given a `latitude` and a `longitude` returns a geoalchemy
+        object, as the spatialite engine does
+        """
+        return geoalchemy.WKTSpatialElement(
+            'POINT(%s %s)' % (longitude, latitude))
+
+    def loader(self):
+        """
+        Returns a :class:`ColumnarLoad` inserting measure rows
+        """
+        self.session.flush()
+        return ColumnarLoad(self.columns)
+
+    def load_stream(self, importer, stream, batch_size=None, resume=False,
+                    **kwargs):
+        """
+        Parse `stream` by the `importer` class (s.
+        :meth:`~eqcatalogue.importers.base.BaseImporter.parse_stream`,
+        which is passed `kwargs`) and insert the parsed measures, in
+        batches of `batch_size` units. The catalogue lives in memory
+        and keeps no import journal, so `resume` is not supported.
+
+        :returns: a tuple (summary of the stored catalogue data, import
+          metrics)
+        """
+        from eqcatalogue.importers.base import writer_summary
+
+        if resume:
+            raise NotImplementedError(ERR_NO_RESUME)
+        metrics = ImportMetrics()
+        metrics.start()
+        load = self.loader()
+        for rows, errors, lines, byte_count in importer.parse_stream(
+                stream, batch_size or BATCH_SIZE, **kwargs):
+            for line_num, line_type in errors:
+                LOG.warn(importer.PARSING_ERROR % line_num)
+                metrics.add_error(line_type)
+            metrics.lines += lines
+            metrics.bytes += byte_count
+            load.insert(rows)
+            metrics.add_batch(len(rows))
+        metrics.stop()
+        return writer_summary(load), metrics
@@ -18,14 +18,15 @@ Engine for eqcatalogue tool using spatialite database and geoalchemy
 as ORM wrapper
 """
 
-import os
-from datetime import datetime
 from pysqlite2 import dbapi2 as sqlite
 import sqlalchemy
 from sqlalchemy import orm
 from sqlalchemy.events import event as sqlevent
 import geoalchemy
-from eqcatalogue.models import MagnitudeMeasure
+from geoalchemy.geometry import SpatialAttribute, SpatialComparator
+from eqcatalogue.models import MagnitudeMeasure, position_coordinates
+from eqcatalogue.datastores.base import (BaseEngine, MEASURE_TABLE,
+                                         WKT_LONGITUDE, WKT_LATITUDE)
 from eqcatalogue.log import logger
 
 
@@ -35,122 +36,51 @@ DYLIB_LIBRARY = "libspatialite.dylib"
 SO_LIBRARY = "libspatialite.so.3"
 
 
-class Engine(object):
+def _set_coordinates(measure, position, oldvalue, initiator):
     """
-    The engine object responsible to map models object to spatialite
-    database table.
+    Keep the `longitude` and the `latitude` of `measure` in sync with
+    its new `position`
     """
-    DEFAULT_FILENAME = "eqcatalogue.db"
-
-    def __init__(self, memory=False, filename=None, drop=False):
-        """Setup a sqlalchemy connection to spatialite with the proper
-        metadata.
+    measure.longitude, measure.latitude = position_coordinates(position)
 
-        :param memory: if True the catalogue will use an in-memory
-        database, otherwise a file-based database is used
 
-        :param filename: the filename of the database used. Unused if
-        `memory` is True
-
-        :param drop: drop the content of the database
-        """
-
-        self.to_be_initialized = drop
-        if memory:
-            # set echo=True in debugging
-            self._engine = sqlalchemy.create_engine('sqlite://', module=sqlite)
-            self.to_be_initialized = True
-        else:
-            filename = filename or self.DEFAULT_FILENAME
-            if not os.path.exists(filename):
-                self.to_be_initialized = True
-            self._engine = sqlalchemy.create_engine(
-                'sqlite:///%s' % filename,
-                module=sqlite,
-                poolclass=sqlalchemy.pool.QueuePool,
-                pool_size=1)
-        self.session = None
-        self._metadata = None
-        sqlevent.listen(self._engine, "first_connect", self._connect)
-        self._engine.connect()
-        orm.clear_mappers()
-        self._create_schema_magnitudemeasure()
-
-        if self.to_be_initialized:
-            self.recreate()
-
-    def recreate(self):
-        """
-        Reset the database (both data and metadata)
+class Engine(BaseEngine):
+    """
+    The engine object responsible to map models object to spatialite
+    database table. The position of a measure is stored in a
+    geometry column, used by the spatial filters, and its coordinates
+    in the `longitude` and `latitude` columns, read without decoding
+    the geometry.
+    """
+    DBAPI = sqlite
+    POSITION_VALUES = (('position', 'GeomFromText(%s, 4326)'),
+                       ('longitude', WKT_LONGITUDE),
+                       ('latitude', WKT_LATITUDE))
+
+    def _position_columns(self):
+        return [geoalchemy.GeometryExtensionColumn(
+            'position', geoalchemy.Point(2, srid=4326), nullable=False),
+                sqlalchemy.Column('longitude', sqlalchemy.Float(),
+                                  nullable=False),
+                sqlalchemy.Column('latitude', sqlalchemy.Float(),
+                                  nullable=False)]
+
+    def _map_magnitudemeasure(self, measure):
         """
-        self._metadata.drop_all()
-        self._metadata.create_all(self._engine)
-
-    def _create_schema_magnitudemeasure(self):
+        Map the measures through geoalchemy. Only at runtime we can
+        load the spatialite extension and then the spatialite
+        metadata needed by geoalchemy to build the orm (s. #_connect
+        method).
+
+        The geometry is deferred, as geoalchemy.GeometryColumn would
+        map it but for the `deferred` flag: it is loaded only when
+        `position` is accessed.
         """
-        Create and contains the model definition. We used
-        non-declarative model mapping, as we need to define models at
-        runtime (not at module import time). Actually, only at runtime
-        we can load the spatialite extension and then the spatialite
-        metadata needed by geoalchemy to build the orm (s. #_setup
-        method)"""
-
-        measure = sqlalchemy.Table(
-            'catalogue_magnitudemeasure', self._metadata,
-            sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True),
-            sqlalchemy.Column('created_at',
-                              sqlalchemy.DateTime, default=datetime.now()),
-
-            sqlalchemy.Column('event_source',
-                              sqlalchemy.String(255),
-                              nullable=False,
-                              index=True),
-
-            sqlalchemy.Column('event_key',
-                              sqlalchemy.String(), nullable=False, index=True),
-            sqlalchemy.Column('event_name',
-                              sqlalchemy.String(), nullable=True),
-
-            sqlalchemy.Column('agency',
-                              sqlalchemy.String(), nullable=False, index=True),
-
-            sqlalchemy.Column('origin_key',
-                              sqlalchemy.String(), nullable=False, index=True),
-
-            sqlalchemy.Column('time', sqlalchemy.DateTime,
-                              nullable=False, index=True),
-            sqlalchemy.Column('time_error', sqlalchemy.Float(), nullable=True),
-            sqlalchemy.Column('time_rms', sqlalchemy.Float(), nullable=True),
-            geoalchemy.GeometryExtensionColumn(
-                'position', geoalchemy.Point(2, srid=4326), nullable=False),
-            sqlalchemy.Column('semi_minor_90error',
-                              sqlalchemy.Float(),
-                              nullable=True),
-            sqlalchemy.Column('semi_major_90error',
-                              sqlalchemy.Float(), nullable=True),
-            sqlalchemy.Column('depth', sqlalchemy.Float(),
-                              nullable=True, index=True),
-            sqlalchemy.Column('depth_error',
-                              sqlalchemy.Float(), nullable=True),
-            sqlalchemy.Column('azimuth_error',
-                              sqlalchemy.Float(),
-                              nullable=True),
-            sqlalchemy.Column('scale', sqlalchemy.String(), index=True),
-            sqlalchemy.Column('value', sqlalchemy.Float(), index=True),
-            sqlalchemy.Column('standard_error',
-                              sqlalchemy.Float(),
-                              nullable=True,
-                              index=True))
-
-        sqlalchemy.schema.UniqueConstraint(
-            measure.c.event_source,
-            measure.c.event_key,
-            measure.c.origin_key,
-            measure.c.time,
-            measure.c.agency,
-            measure.c.scale)
         orm.Mapper(MagnitudeMeasure, measure, properties={
-            'position': geoalchemy.GeometryColumn(measure.c.position)})
+            'position': orm.column_property(
+                measure.c.position, extension=SpatialAttribute(),
+                comparator_factory=SpatialComparator, deferred=True)})
+        sqlevent.listen(MagnitudeMeasure.position, 'set', _set_coordinates)
         geoalchemy.GeometryDDL(measure)
 
     @staticmethod
@@ -163,14 +93,37 @@ class Engine(object):
             'POINT(%s %s)' % (longitude, latitude))
         return position
 
-    def _connect(self, dbapi_connection, _connection_rec=None):
-        """Enable load extension on connect. Event handler triggered
-        by sqlalchemy"""
+    def within_polygon(self, polygon):
+        return MagnitudeMeasure.position.within(polygon)
+
+    def within_distance(self, point, distance):
+        return sqlalchemy.text(
+            "PtDistWithin(%s.position, GeomFromText('%s', 4326), %s)" % (
+                MEASURE_TABLE, point, distance))
+
+    def _upgrade_schema(self):
+        """
+        Add the `longitude` and `latitude` columns to a measure table
+        created by a previous version, filling them from the geometry
+        """
+        columns = [row[1] for row in self.session.execute(
+            "PRAGMA table_info(%s)" % MEASURE_TABLE)]
+        if 'longitude' in columns:
+            return
+        for column in ('longitude', 'latitude'):
+            self.session.execute(
+                "ALTER TABLE %s ADD COLUMN %s FLOAT" % (MEASURE_TABLE, column))
+        self.session.execute(
+            "UPDATE %s SET longitude = X(position), latitude = Y(position)"
+            % MEASURE_TABLE)
+        self.session.commit()
+        LOG.info("Measure coordinates added to the catalogue")
+
+    def _setup_connection(self, dbapi_connection):
+        """Enable load extension on connect"""
 
         dbapi_connection.enable_load_extension(True)
         _load_extension(dbapi_connection)
-        self.session = orm.sessionmaker(bind=self._engine)()
-        self._metadata = sqlalchemy.MetaData(self._engine)
 
 
 def _initialize_spatialite_db(connection):
@@ -0,0 +1,306 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# eqcatalogueTool is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# eqcatalogueTool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with eqcatalogueTool. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Engine for eqcatalogue tool using the sqlite module of the standard
+library, without any spatial extension. The position of a measure is
+stored as its longitude and latitude, indexed by an R*Tree virtual
+table: the spatial filters select the measures in the bounding box of
+the area through the R*Tree, then test them exactly by sql functions
+written in python.
+
+e.g.::
+  cat = CatalogueDatabase(engine='eqcatalogue.datastores.sqlite',
+                          filename='my-catalogue.db')
+"""
+
+import math
+import sqlite3
+import sqlalchemy
+from sqlalchemy import orm
+from sqlalchemy.events import event as sqlevent
+import geoalchemy
+from shapely import wkt
+
+from eqcatalogue.models import MagnitudeMeasure, EARTH_RADIUS
+from eqcatalogue.datastores.base import BaseEngine, MEASURE_TABLE
+from eqcatalogue.log import logger
+
+
+LOG = logger(__name__)
+
+# the R*Tree indexing the position of the measures
+POSITION_INDEX = 'catalogue_measureposition'
+
+# the trigger adding the position of a new measure to the R*Tree. It is
+# dropped during bulk loads (s. `Engine.drop_indexes`)
+INDEX_TRIGGER = 'catalogue_index_position'
+
+POSITION_INDEX_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS %(index)s USING rtree("
+    "id, min_longitude, max_longitude, min_latitude, max_latitude)",
+    "CREATE TRIGGER IF NOT EXISTS catalogue_update_position "
+    "AFTER UPDATE OF longitude, latitude ON %(table)s BEGIN "
+    "INSERT OR REPLACE INTO %(index)s VALUES(NEW.id, "
+    "NEW.longitude, NEW.longitude, NEW.latitude, NEW.latitude); END",
+    "CREATE TRIGGER IF NOT EXISTS catalogue_delete_position "
+    "AFTER DELETE ON %(table)s BEGIN "
+    "DELETE FROM %(index)s WHERE id = OLD.id; END")
+
+INDEX_TRIGGER_DDL = (
+    "CREATE TRIGGER IF NOT EXISTS %(trigger)s "
+    "AFTER INSERT ON %(table)s BEGIN "
+    "INSERT OR REPLACE INTO %(index)s VALUES(NEW.id, "
+    "NEW.longitude, NEW.longitude, NEW.latitude, NEW.latitude); END")
+
+FILL_POSITION_INDEX = (
+    "DELETE FROM %(index)s",
+    "INSERT INTO %(index)s SELECT id, longitude, longitude, latitude, "
+    "latitude FROM %(table)s")
+
+NAMES = dict(table=MEASURE_TABLE, index=POSITION_INDEX,
+             trigger=INDEX_TRIGGER)
+
+# number of polygons whose rings are kept parsed by `_rings`
+RINGS_CACHE_SIZE = 64
+
+_RINGS = {}
+
+
+def _rings(polygon):
+    """
+    Returns the list of the rings (lists of coordinates) of the WKT
+    `polygon`, the exterior one first
+    """
+    rings = _RINGS.get(polygon)
+    if rings is None:
+        if len(_RINGS) >= RINGS_CACHE_SIZE:
+            _RINGS.clear()
+        shape = wkt.loads(polygon)
+        rings = [list(shape.exterior.coords)] + [
+            list(interior.coords) for interior in shape.interiors]
+        _RINGS[polygon] = rings
+    return rings
+
+
+def _in_ring(x, y, ring):
+    """
+    Returns True if the point (`x`, `y`) is inside the closed `ring`,
+    by the even-odd rule
+    """
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring[:-1], ring[1:]):
+        if ((y1 > y) != (y2 > y) and
+                x < x1 + (y - y1) * (x2 - x1) / (y2 - y1)):
+            inside = not inside
+    return inside
+
+
+def within(longitude, latitude, polygon):
+    """
+    Returns True if the point at `longitude` and `latitude` is inside
+    the WKT `polygon`. It is defined as the sql function
+    `catalogue_within`.
+    """
+    rings = _rings(polygon)
+    return (_in_ring(longitude, latitude, rings[0]) and
+            not any(_in_ring(longitude, latitude, interior)
+                    for interior in rings[1:]))
+
+
+def distance(longitude1, latitude1, longitude2, latitude2):
+    """
+    Returns the distance in meters between two points, by the
+    haversine formula. It is defined as the sql function
+    `catalogue_distance`.
+    """
+    lon1, lat1, lon2, lat2 = [math.radians(coordinate) for coordinate in (
+        longitude1, latitude1, longitude2, latitude2)]
+    aval = (math.sin((lat2 - lat1) / 2.) ** 2 + math.cos(lat1) *
+            math.cos(lat2) * math.sin((lon2 - lon1) / 2.) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(aval, 1.)))
+
+
+def distance_box(longitude, latitude, meters):
+    """
+    Returns the bounding box (min longitude, max longitude, min
+    latitude, max latitude) of the points within `meters` from the
+    point at `longitude` and `latitude`. If the area includes a pole
+    or crosses the antimeridian, the box spans all the longitudes.
+    """
+    angle = meters / EARTH_RADIUS
+    min_latitude = latitude - math.degrees(angle)
+    max_latitude = latitude + math.degrees(angle)
+    if min_latitude <= -90 or max_latitude >= 90:
+        return -180., 180., max(min_latitude, -90.), min(max_latitude, 90.)
+    delta = math.degrees(math.asin(
+        math.sin(angle) / math.cos(math.radians(latitude))))
+    if longitude - delta < -180 or longitude + delta > 180:
+        return -180., 180., min_latitude, max_latitude
+    return longitude - delta, longitude + delta, min_latitude, max_latitude
+
+
+def _box_clause(min_longitude, max_longitude, min_latitude, max_latitude):
+    """
+    Returns the sql clause selecting the measures whose position is in
+    the given box, through the R*Tree
+    """
+    return (
+        "%s.id IN (SELECT id FROM %s WHERE max_longitude >= %r AND "
+        "min_longitude <= %r AND max_latitude >= %r AND min_latitude <= %r)"
+        % (MEASURE_TABLE, POSITION_INDEX, min_longitude, max_longitude,
+           min_latitude, max_latitude))
+
+
+def _begin(connection):
+    """
+    Begin a transaction on the dbapi connection of `connection`, in
+    autocommit mode (s. :meth:`Engine._setup_engine`)
+    """
+    connection.connection.execute("BEGIN")
+
+
+class Position(object):
+    """
+    The `position` of a mapped measure: a geoalchemy WKT element of
+    its `longitude` and `latitude`
+    """
+
+    def __get__(self, measure, owner):
+        if measure is None:
+            return self
+        if measure.longitude is None:
+            return None
+        return Engine.position_from_latlng(measure.latitude,
+                                           measure.longitude)
+
+    def __set__(self, measure, position):
+        if position is None:
+            measure.longitude = measure.latitude = None
+        else:
+            measure.longitude, measure.latitude = position.coords(None)
+
+
+class Engine(BaseEngine):
+    """
+    The engine object responsible to map models object to a table of
+    a plain sqlite database. The position of a measure is stored in
+    the `longitude` and `latitude` columns and indexed by an R*Tree.
+    """
+    DBAPI = sqlite3
+
+    def _position_columns(self):
+        return [sqlalchemy.Column('longitude', sqlalchemy.Float(),
+                                  nullable=False),
+                sqlalchemy.Column('latitude', sqlalchemy.Float(),
+                                  nullable=False)]
+
+    def _map_magnitudemeasure(self, measure):
+        """
+        Map the measures, whose position is set and read through the
+        `longitude` and `latitude` columns. The R*Tree and the
+        triggers maintaining it are created and dropped with the
+        table.
+        """
+        # the synonym only installs the `position` descriptor
+        orm.Mapper(MagnitudeMeasure, measure, properties={
+            'position': orm.synonym('longitude', descriptor=Position())})
+        for statement in POSITION_INDEX_DDL + (INDEX_TRIGGER_DDL,):
+            sqlevent.listen(measure, 'after_create',
+                            sqlalchemy.DDL(statement % NAMES))
+        sqlevent.listen(measure, 'before_drop', sqlalchemy.DDL(
+            "DROP TABLE IF EXISTS %s" % POSITION_INDEX))
+
+    def drop_indexes(self):
+        """
+        Drop the secondary indexes and stop indexing the position of
+        the new measures, which are indexed at once by
+        :meth:`create_indexes`
+        """
+        super(Engine, self).drop_indexes()
+        self.session.execute("DROP TRIGGER IF EXISTS %s" % INDEX_TRIGGER)
+
+    def create_indexes(self):
+        """
+        Create the missing secondary indexes. If the position of the
+        new measures is not being indexed (s. :meth:`drop_indexes`),
+        the R*Tree is filled again in a single pass.
+        """
+        indexing = self.session.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' "
+            "AND name = '%s'" % INDEX_TRIGGER).first()
+        if indexing is None:
+            for statement in FILL_POSITION_INDEX + (INDEX_TRIGGER_DDL,):
+                self.session.execute(statement % NAMES)
+            LOG.debug("Measure positions indexed")
+        super(Engine, self).create_indexes()
+
+    @staticmethod
+    def position_from_latlng(latitude, longitude):
+        """
+        Given a `latitude` and a `longitude` returns a geoalchemy
+        object, as the spatialite engine does
+        """
+        return geoalchemy.WKTSpatialElement(
+            'POINT(%s %s)' % (longitude, latitude))
+
+    def within_polygon(self, polygon):
+        """
+        Select the measures in the bounding box of `polygon`, then
+        test them against its rings (s. :func:`within`)
+        """
+        min_longitude, min_latitude, max_longitude, max_latitude = (
+            wkt.loads(polygon).bounds)
+        return sqlalchemy.text(
+            "%s AND catalogue_within(%s, %s, '%s')" % (
+                _box_clause(min_longitude, max_longitude,
+                            min_latitude, max_latitude),
+                self.LONGITUDE_SQL, self.LATITUDE_SQL, polygon))
+
+    def within_distance(self, point, meters):
+        """
+        Select the measures in the bounding box of the area within
+        `meters` from `point` (s. :func:`distance_box`), then test
+        their distance (s. :func:`distance`)
+        """
+        point = wkt.loads(point)
+        return sqlalchemy.text(
+            "%s AND catalogue_distance(%s, %s, %r, %r) <= %r" % (
+                _box_clause(*distance_box(point.x, point.y, meters)),
+                self.LONGITUDE_SQL, self.LATITUDE_SQL, point.x, point.y,
+                float(meters)))
+
+    def _setup_engine(self, engine):
+        """
+        The sqlite module of the standard library commits before it
+        runs a SAVEPOINT, RELEASE or PRAGMA statement, so the savepoint
+        of the event being imported (s.
+        :class:`~eqcatalogue.importers.writer.MeasureWriter`) would be
+        lost. The connections are in autocommit mode and the
+        transactions are begun explicitly.
+        """
+        sqlevent.listen(engine, 'begin', _begin)
+
+    def _setup_connection(self, dbapi_connection):
+        """
+        Define the sql functions of the spatial filters. Replacing a
+        measure deletes it, so the delete triggers must fire on
+        replace too. Transactions are begun by sqlalchemy (s.
+        :meth:`_setup_engine`).
+        """
+        dbapi_connection.isolation_level = None
+        dbapi_connection.create_function('catalogue_within', 3, within)
+        dbapi_connection.create_function('catalogue_distance', 4, distance)
+        dbapi_connection.execute("PRAGMA recursive_triggers = ON")
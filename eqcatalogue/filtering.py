@@ -18,6 +18,8 @@ Module :mod:`eqcatalogue.filtering` defines the abstract class
 :class:`Criteria` and its derived classes.
 """
 
+import numpy as np
+
 import eqcatalogue.models as db
 from eqcatalogue import exceptions
 
@@ -36,18 +38,46 @@ class Criteria(object):
 
     def __init__(self):
         self._cat = db.CatalogueDatabase()
-        self._session = self._cat.session
-        self.default_queryset = self._session.query(db.MagnitudeMeasure)
+
+    @property
+    def default_queryset(self):
+        """
+        The query of all the measures, in the session of the current
+        thread (s. :attr:`eqcatalogue.models.CatalogueDatabase.session`)
+        """
+        return self._cat.session.query(db.MagnitudeMeasure)
 
     def filter(self, queryset=None):
         """
         Returns all the measures that satistify the criteria from a
         given set of measures. If `queryset` is empty all the measures
-        in the catalogue are considered
+        in the catalogue are considered. In a columnar catalogue (s.
+        :mod:`eqcatalogue.datastores.columnar`) the measures are
+        selected by :meth:`mask`.
         """
         queryset = queryset or self.default_queryset
+        if self._cat.columnar:
+            return queryset.where(self.mask)
+        return self._filter(queryset)
+
+    def _filter(self, queryset):
+        """
+        Returns the sql query of the measures of `queryset` that
+        satisfy the criteria. It should be implemented by derived
+        classes
+        """
         return queryset
 
+    def mask(self, columns):
+        """
+        Returns the boolean mask of the measures of a columnar
+        catalogue (s.
+        :class:`~eqcatalogue.datastores.columnar.MeasureColumns`)
+        that satisfy the criteria. It should be implemented by
+        derived classes
+        """
+        return np.ones(columns.size, dtype=bool)
+
     def all(self, order_field='catalogue_magnitudemeasure.id'):
         """
         Returns all the measures that satisfies the criteria in a list
@@ -124,14 +154,16 @@ class CombinedCriteria(Criteria):
         self.criteria1 = criteria1
         self.criteria2 = criteria2
 
-    def filter(self, queryset=None):
-        queryset = queryset or self.default_queryset
+    def _filter(self, queryset):
         return self.criteria1.filter(self.criteria2.filter(queryset))
 
     def predicate(self, measure):
         return (self.criteria1.predicate(measure) and
                 self.criteria2.predicate(measure))
 
+    def mask(self, columns):
+        return self.criteria1.mask(columns) & self.criteria2.mask(columns)
+
     def __repr__(self):
         return "(%s AND %s)" % (self.criteria1, self.criteria2)
 
@@ -145,8 +177,7 @@ class AlternativeCriteria(Criteria):
         self.criteria1 = criteria1
         self.criteria2 = criteria2
 
-    def filter(self, queryset=None):
-        queryset = queryset or self.default_queryset
+    def _filter(self, queryset):
         return (self.criteria1.filter(queryset).union(
                 self.criteria2.filter(queryset)))
 
@@ -154,6 +185,9 @@ class AlternativeCriteria(Criteria):
         return (self.criteria1.predicate(measure) or
                 self.criteria2.predicate(measure))
 
+    def mask(self, columns):
+        return self.criteria1.mask(columns) | self.criteria2.mask(columns)
+
     def __repr__(self):
         return "(%s OR %s)" % (self.criteria1, self.criteria2)
 
@@ -169,13 +203,15 @@ class Before(Criteria):
         super(Before, self).__init__()
         self.time = time
 
-    def filter(self, queryset=None):
-        queryset = queryset or self.default_queryset
+    def _filter(self, queryset):
         return queryset.filter(db.MagnitudeMeasure.time < self.time)
 
     def predicate(self, measure):
         return measure.time < self.time
 
+    def mask(self, columns):
+        return columns.before(self.time)
+
     def __repr__(self):
         return "<before %s>" % self.time
 
@@ -191,13 +227,15 @@ class After(Criteria):
         super(After, self).__init__()
         self.time = time
 
-    def filter(self, queryset=None):
-        queryset = queryset or self.default_queryset
+    def _filter(self, queryset):
         return queryset.filter(db.MagnitudeMeasure.time > self.time)
 
     def predicate(self, measure):
         return measure.time > self.time
 
+    def mask(self, columns):
+        return columns.after(self.time)
+
     def __repr__(self):
         return "<after %s>" % self.time
 
@@ -220,6 +258,9 @@ class TimeBetween(Criteria):
     def predicate(self, measure):
         return self._comb.predicate(measure)
 
+    def mask(self, columns):
+        return self._comb.mask(columns)
+
     def __repr__(self):
         return repr(self._comb)
 
@@ -235,14 +276,16 @@ class WithAgencies(Criteria):
         super(WithAgencies, self).__init__()
         self.agencies = agency_name_list
 
-    def filter(self, queryset=None):
-        queryset = queryset or self.default_queryset
+    def _filter(self, queryset):
         return queryset.filter(
             db.MagnitudeMeasure.agency.in_(self.agencies))
 
     def predicate(self, measure):
         return measure.agency in self.agencies
 
+    def mask(self, columns):
+        return columns.with_agencies(self.agencies)
+
     @classmethod
     def make_with_agency(cls, agency):
         return cls([agency])
@@ -266,14 +309,16 @@ class WithMagnitudeScales(Criteria):
     def make_with_scale(cls, scale):
         return cls([scale])
 
-    def filter(self, queryset=None):
-        queryset = queryset or self.default_queryset
+    def _filter(self, queryset):
         return queryset.filter(
             db.MagnitudeMeasure.scale.in_(self.scales))
 
     def predicate(self, measure):
         return measure.scale in self.scales
 
+    def mask(self, columns):
+        return columns.with_scales(self.scales)
+
     def __repr__(self):
         return "<scale in %s>" % self.scales
 
@@ -289,13 +334,15 @@ class WithMagnitudeGreater(Criteria):
         super(WithMagnitudeGreater, self).__init__()
         self.value = value
 
-    def filter(self, queryset=None):
-        queryset = queryset or self.default_queryset
+    def _filter(self, queryset):
         return queryset.filter(db.MagnitudeMeasure.value > self.value)
 
     def predicate(self, measure):
         return measure.value > self.value
 
+    def mask(self, columns):
+        return columns.greater('value', self.value)
+
     def __repr__(self):
         return "<magnitude > %s>" % self.value
 
@@ -311,13 +358,15 @@ class WithMagnitudeLower(Criteria):
         super(WithMagnitudeLower, self).__init__()
         self.value = value
 
-    def filter(self, queryset=None):
-        queryset = queryset or self.default_queryset
+    def _filter(self, queryset):
         return queryset.filter(db.MagnitudeMeasure.value < self.value)
 
     def predicate(self, measure):
         return measure.value < self.value
 
+    def mask(self, columns):
+        return columns.lower('value', self.value)
+
 
 class WithDepthGreater(Criteria):
     """
@@ -330,13 +379,15 @@ class WithDepthGreater(Criteria):
         super(WithDepthGreater, self).__init__()
         self.value = value
 
-    def filter(self, queryset=None):
-        queryset = queryset or self.default_queryset
+    def _filter(self, queryset):
         return queryset.filter(db.MagnitudeMeasure.depth > self.value)
 
     def predicate(self, measure):
         return measure.depth > self.value
 
+    def mask(self, columns):
+        return columns.greater('depth', self.value)
+
 
 class WithDepthLower(Criteria):
     """
@@ -349,13 +400,15 @@ class WithDepthLower(Criteria):
         super(WithDepthLower, self).__init__()
         self.value = value
 
-    def filter(self, queryset=None):
-        queryset = queryset or self.default_queryset
+    def _filter(self, queryset):
         return queryset.filter(db.MagnitudeMeasure.depth < self.value)
 
     def predicate(self, measure):
         return measure.depth < self.value
 
+    def mask(self, columns):
+        return columns.lower('depth', self.value)
+
 
 class DepthBetween(Criteria):
     """
@@ -376,6 +429,9 @@ class DepthBetween(Criteria):
     def predicate(self, measure):
         return self._comb.predicate(measure)
 
+    def mask(self, columns):
+        return self._comb.mask(columns)
+
 
 class WithinPolygon(Criteria):
     """
@@ -388,10 +444,11 @@ class WithinPolygon(Criteria):
         super(WithinPolygon, self).__init__()
         self.polygon = polygon
 
-    def filter(self, queryset=None):
-        queryset = queryset or self.default_queryset
-        return queryset.filter(
-            db.MagnitudeMeasure.position.within(self.polygon))
+    def _filter(self, queryset):
+        return queryset.filter(self._cat.engine.within_polygon(self.polygon))
+
+    def mask(self, columns):
+        return columns.within(self.polygon)
 
     def __repr__(self):
         return "<within %s>" % self.polygon
@@ -409,11 +466,12 @@ class WithinDistanceFromPoint(Criteria):
         self.point, self.distance = params
         super(WithinDistanceFromPoint, self).__init__()
 
-    def filter(self, queryset=None):
-        queryset = queryset or self.default_queryset
+    def _filter(self, queryset):
         return queryset.filter(
-            "PtDistWithin(catalogue_magnitudemeasure.position, "
-            "GeomFromText('%s', 4326), %s)" % (self.point, self.distance))
+            self._cat.engine.within_distance(self.point, self.distance))
+
+    def mask(self, columns):
+        return columns.within_distance(self.point, self.distance)
 
     def __repr__(self):
         return "<within distance %s from %s>" % (self.distance, self.point)
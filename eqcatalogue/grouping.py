@@ -22,7 +22,7 @@ Module :mod:`eqcatalogue.grouping` defines
 
 import numpy as np
 from collections import defaultdict
-from eqcatalogue.models import MagnitudeMeasure
+from eqcatalogue.models import BaseMeasure
 from eqcatalogue import log
 
 
@@ -149,13 +149,13 @@ class GroupMeasuresBySequentialClustering(object):
         self.time_window = time_window
         self.space_window = space_window
         self.time_distance_fn = (time_distance_fn or
-                                 MagnitudeMeasure.time_distance)
+                                 BaseMeasure.time_distance)
         self.space_distance_fn = (space_distance_fn or
-                                  MagnitudeMeasure.space_distance)
+                                  BaseMeasure.space_distance)
         self.magnitude_window = magnitude_window
         self.magnitude_distance_fn = magnitude_distance_fn
         if self.magnitude_window and not self.magnitude_distance_fn:
-            self.magnitude_distance_fn = MagnitudeMeasure.magnitude_distance
+            self.magnitude_distance_fn = BaseMeasure.magnitude_distance
 
     def group_measures(self, measures):
         """
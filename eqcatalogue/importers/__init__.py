@@ -18,7 +18,9 @@ This package implements the importer (parser and db serializer) for
 the following formats:
 
 ISF Bulletin
+ISC web query (ISF Bulletin in HTML)
 IASPEI
+csv1
 """
 
 from __future__ import absolute_import
@@ -27,7 +29,10 @@ from .base import BaseImporter, store_events
 
 from .iaspei import Importer as Iaspei
 from .isf_bulletin import Importer as V1
-from .csv1 import CsvEqCatalogueReader, Converter
+from .isc_html import Importer as IscHtml
+from .csv1 import Importer as Csv1, CsvEqCatalogueReader, Converter
+from .streams import open_input
 
 __all__ = [x.__name__ for x in (BaseImporter, store_events, Iaspei,
-                                V1, CsvEqCatalogueReader, Converter)]
+                                V1, IscHtml, Csv1, CsvEqCatalogueReader,
+                                Converter, open_input)]
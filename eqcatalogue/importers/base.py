@@ -18,21 +18,59 @@ Module :mod:`eqcatalogue.importers.base` defines base classes for different
 kinds of :class:` earthquake catalogue readers <CatalogueReader>`.
 """
 
-import collections
+import os
 from sqlalchemy import distinct, func
 from eqcatalogue.models import MagnitudeMeasure
+from eqcatalogue.exceptions import InvalidMagnitudeSeq, ParsingFailure
+from eqcatalogue.importers.journal import ImportJournal
+from eqcatalogue.importers.metrics import ImportMetrics
+from eqcatalogue.importers.validation import BATCH_SIZE, ValidationReport
 import abc
 
 
-def store_events(cls, stream, cat, **kwargs):
+def store_events(cls, stream, cat, bulk=False, **kwargs):
     """
      Utility that create an instance of the importer and load the
-     data from `stream`
+     data from `stream`. If `bulk` is True the data are loaded in a
+     :meth:`~eqcatalogue.models.CatalogueDatabase.bulk_load` block.
     """
     importer = cls(stream, cat)
+    if bulk:
+        with cat.bulk_load():
+            return importer.store(**kwargs)
     return importer.store(**kwargs)
 
 
+def prepare_session(cat):
+    """
+    Set up the session of the catalogue db `cat` for importing: the
+    sqlite pragmas of the engine trade durability for speed (s.
+    :meth:`~eqcatalogue.datastores.base.BaseEngine.prepare_import`)
+    and the session is neither flushed nor committed automatically
+    """
+    cat.engine.prepare_import()
+    s = cat.session
+    s.autocommit = False
+    s.autoflush = False
+
+
+def writer_summary(writer):
+    """
+    Returns the import summary (s. :attr:`BaseImporter.summary`) of
+    the measures written by `writer`
+    """
+    created = writer.created
+    summary = {BaseImporter.EVENT_SOURCE: len(created['event_source']),
+               BaseImporter.AGENCY: len(created['agency']),
+               BaseImporter.ORIGIN: len(created['origin_key']),
+               BaseImporter.MEASURE: writer.created_measures,
+               BaseImporter.SKIPPED: writer.skipped,
+               BaseImporter.CHANGED: writer.changed}
+
+    return dict((key, value) for key, value in summary.items()
+                if value > 0)
+
+
 class BaseImporter(object):
     """
     Base class for Importers.
@@ -44,28 +82,71 @@ class BaseImporter(object):
     AGENCY = 'Agencies_Created'
     ORIGIN = 'Origins_Created'
     MEASURE = 'Measures_Created'
+    SKIPPED = 'Measures_Skipped'
+    CHANGED = 'Measures_Changed'
+
+    # the message of the failures found while validating
+    PARSING_ERROR = 'The line %d can not be parsed'
 
     def __init__(self, file_stream, db_catalogue):
         self._file_stream = file_stream
         self._catalogue = db_catalogue
 
-        s = self._catalogue.session
-        s.execute("PRAGMA synchronous=OFF")
-        s.execute("PRAGMA count_changes=OFF")
-        s.execute("PRAGMA journal_mode=OFF")
-        s.execute("PRAGMA temp_store=OFF")
-        s.autocommit = False
-        s.autoflush = False
-
-        self._before = collections.Counter(
-            {self.EVENT_SOURCE: self.counter('event_source'),
-             self.AGENCY: self.counter('agency'),
-             self.ORIGIN: self.counter('origin_key'),
-             self.MEASURE: self.counter('id')})
+        prepare_session(self._catalogue)
 
         self.errors = []
+        self.metrics = ImportMetrics()
+        self._writer = None
+        self._journal = None
+
+    def _open_journal(self, resume=False):
+        """
+        Open the journal of the import if the input stream is a file
+        stored on disk (otherwise the import can not be resumed).
+
+        :param resume: if True and the file has already been
+          (partially) imported, the journal is loaded and returned so
+          that the import can continue from its last checkpoint.
+          Otherwise a new journal is started.
+        """
+        filename = getattr(self._file_stream, 'name', None)
+        if not filename or not os.path.isfile(filename):
+            self._journal = None
+            return None
+
+        self._journal = ImportJournal(self._catalogue,
+                                      os.path.abspath(filename),
+                                      self.__class__.__module__)
+        if not (resume and self._journal.load()):
+            self._journal.start()
+        return self._journal
+
+    def _checkpoint(self, offset, line_num, event_source=None,
+                    completed=False):
+        """
+        Write the pending measures, record in the journal that the
+        import can be resumed at byte `offset` (line `line_num`) and
+        commit. Importers call it at event boundaries, when
+        `self._writer.commit_due` or at the end of the import, when
+        the import metrics are finalized.
+        """
+        self._writer.flush()
+        if self._journal is not None:
+            self._journal.checkpoint(offset, line_num, event_source,
+                                     self._writer.written, len(self.errors),
+                                     completed)
+        self._writer.commit()
+        if completed:
+            self._writer.close()
+            self.metrics.stop()
+        else:
+            self.metrics.notify()
 
     def counter(self, field):
+        """
+        Returns the number of distinct values of `field` stored in
+        the catalogue db. It scans the whole measure table.
+        """
         return self._catalogue.session.query(
             func.count(distinct(getattr(MagnitudeMeasure, field)))).scalar()
 
@@ -76,19 +157,68 @@ class BaseImporter(object):
         into the catalogue db, during the process,
         a summary of inserted items is updated.
 
+        Importers accept a `resume` keyword argument: if True and the
+        input file has already been partially imported, the import
+        continues from the last checkpoint recorded in the journal.
+        They also accept an `on_metrics` callback, called with the
+        import metrics (s. `self.metrics`) at each commit and at the
+        end of the import, and an `append` flag: if True the measures
+        already stored are skipped and the changed ones are replaced
+        (s. :class:`eqcatalogue.importers.writer.MeasureWriter`).
+
         :returns: the summary of the inserted/updated catalogue data
         """
 
+    @classmethod
+    def parse_stream(cls, stream, batch_size):
+        """
+        Parse the input `stream` into measure rows without a catalogue
+        db, so that it can be run in a worker process (s.
+        :mod:`eqcatalogue.importers.batch`).
+
+        :returns: an iterator over tuples (measure rows ordered as
+          :data:`eqcatalogue.importers.writer.ROW_FIELDS`, list of the
+          line numbers and line types of the lines that could not be
+          parsed, number of lines read, number of bytes read). Each
+          tuple holds about `batch_size` units (measures, entries or
+          lines, depending on the format).
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def validate(cls, stream, batch_size=None, processes=None, **kwargs):
+        """
+        Validate the input `stream` in a dry run, i.e. parse it
+        without a catalogue db (s. :meth:`parse_stream`, which is
+        passed `kwargs`). The importers that stop at the first invalid
+        entry (e.g. the IASPEI one) report only that failure.
+        `processes` is used by the importers that can split the input
+        among worker processes, ignored by the others.
+
+        :returns: a
+          :class:`~eqcatalogue.importers.validation.ValidationReport`
+        """
+        report = ValidationReport(getattr(stream, 'name', None))
+        try:
+            for rows, errors, lines, byte_count in cls.parse_stream(
+                    stream, batch_size or BATCH_SIZE, **kwargs):
+                report.add_rows(rows)
+                for line_num, _ in errors:
+                    report.add_failure(cls.PARSING_ERROR % line_num)
+                report.lines += lines
+                report.bytes += byte_count
+        except (ValueError, InvalidMagnitudeSeq, ParsingFailure) as e:
+            report.add_failure(str(e))
+        return report
+
     @property
     def summary(self):
         """
         Returns a dictionary where each key and associated value
         represents the number of entities, stored in the catalogue db.
+        The numbers are tracked by the measure writer while importing,
+        so the cost does not depend on the size of the catalogue db.
         """
-        summary = collections.Counter(
-            {self.EVENT_SOURCE: self.counter('event_source'),
-             self.AGENCY: self.counter('agency'),
-             self.ORIGIN: self.counter('origin_key'),
-             self.MEASURE: self.counter('id')})
-
-        return dict(summary - self._before)
+        if self._writer is None:
+            return {}
+        return writer_summary(self._writer)
@@ -0,0 +1,276 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# eqcataloguetool is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EqCatalogueTool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with eqcataloguetool. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Module :mod:`eqcatalogue.importers.batch` loads many input files, of
+possibly different formats, into a catalogue db at once.
+
+The files are parsed by a pool of worker processes (s.
+:meth:`~eqcatalogue.importers.base.BaseImporter.parse_stream`), which
+send the parsed measure rows through a bounded queue to the current
+process, where a single
+:class:`~eqcatalogue.importers.writer.MeasureWriter` writes them.
+"""
+
+import os
+import glob
+import Queue
+import multiprocessing
+
+from sqlalchemy.exc import IntegrityError
+
+from eqcatalogue.log import logger
+from eqcatalogue.exceptions import InvalidMagnitudeSeq, ParsingFailure
+from eqcatalogue.importers.base import prepare_session, writer_summary
+from eqcatalogue.importers.metrics import ImportMetrics
+from eqcatalogue.importers.streams import open_input
+from eqcatalogue.importers.writer import MeasureWriter
+
+
+LOG = logger(__name__)
+
+ERR_LINE = 'The line %d of %s can not be imported'
+ERR_FILE = 'The import of %s failed: %s'
+
+# the messages sent by the workers, along with the index of a file
+BATCH, DONE, FAILED = range(3)
+
+# seconds waited for a message before checking that the workers are
+# still alive
+POLL_INTERVAL = 1
+
+
+def expand_inputs(patterns):
+    """
+    Returns the names of the files matching the glob `patterns`, in
+    the order of the patterns (sorted for each pattern) and without
+    repetitions. A pattern matching no file is returned as is, so that
+    missing files are reported when opened.
+    """
+    filenames = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or [pattern]
+        for filename in matches:
+            if filename not in filenames:
+                filenames.append(filename)
+    return filenames
+
+
+def parse_files(tasks, results, batch_size):
+    """
+    Parse the files taken from the `tasks` queue, as tuples (index,
+    filename, importer class), until a None task is taken. The parsed
+    rows are put into the `results` queue, as tuples (index, `BATCH`,
+    parsed batch), followed by (index, `DONE`, None) or, if the file
+    can not be parsed, by (index, `FAILED`, error message).
+    """
+    for index, filename, importer in iter(tasks.get, None):
+        try:
+            with open_input(filename) as stream:
+                for batch in importer.parse_stream(stream, batch_size):
+                    results.put((index, BATCH, batch))
+        except (Exception, InvalidMagnitudeSeq, ParsingFailure) as e:
+            # the exceptions of the importers are not Exceptions
+            results.put((index, FAILED, '%s: %s' % (
+                e.__class__.__name__, e)))
+        else:
+            results.put((index, DONE, None))
+
+
+class BatchLoader(object):
+    """
+    Load many input files into the catalogue db `cat`, which is
+    opened once for all of them.
+
+    :param processes: the number of worker processes parsing the files
+      (the default is the number of cpus)
+    :param batch_size: the number of units parsed by a worker before
+      sending them (s. `parse_stream`)
+    :param queue_size: the maximum number of parsed batches waiting to
+      be written. Workers wait when it is reached, so memory usage is
+      bounded
+    :param flush_size, commit_interval, append: s.
+      :class:`~eqcatalogue.importers.writer.MeasureWriter`. Measures
+      violating the unique constraint replace the existing ones
+
+    After loading, `errors` holds the failures of the import,
+    `metrics` the metrics of the whole import and `file_metrics` the
+    ones of each file.
+    """
+
+    DEFAULT_BATCH_SIZE = 10000
+
+    def __init__(self, cat, processes=None, batch_size=None,
+                 queue_size=None, flush_size=None, commit_interval=None,
+                 append=False):
+        self._catalogue = cat
+        self.processes = processes or multiprocessing.cpu_count()
+        self.batch_size = batch_size or self.DEFAULT_BATCH_SIZE
+        self.queue_size = queue_size or 2 * self.processes
+        self._flush_size = flush_size
+        self._commit_interval = commit_interval
+        self._append = append
+        self._writer = None
+        self.errors = []
+        self.metrics = ImportMetrics()
+        self.file_metrics = []
+        self.filenames = []
+
+    def load(self, inputs, on_metrics=None):
+        """
+        Load the `inputs`, a sequence of tuples (filename, importer
+        class). `on_metrics` is called with the metrics of the import
+        at each commit and at the end.
+
+        :returns: the summary of the stored catalogue data (s.
+          :attr:`~eqcatalogue.importers.base.BaseImporter.summary`)
+        """
+        inputs = list(inputs)
+        self.filenames = [filename for filename, _ in inputs]
+        self.file_metrics = [ImportMetrics() for _ in inputs]
+        prepare_session(self._catalogue)
+        self.metrics.start(on_metrics)
+        self._writer = MeasureWriter(
+            self._catalogue, flush_size=self._flush_size,
+            commit_interval=self._commit_interval, metrics=self.metrics,
+            append=self._append, on_discarded=self._batch_discarded)
+
+        tasks = multiprocessing.Queue()
+        results = multiprocessing.Queue(self.queue_size)
+        for index, (filename, importer) in enumerate(inputs):
+            tasks.put((index, filename, importer))
+        workers = [multiprocessing.Process(
+            target=parse_files, args=(tasks, results, self.batch_size))
+            for _ in xrange(min(self.processes, len(inputs)))]
+        for worker in workers:
+            tasks.put(None)
+            worker.daemon = True
+            worker.start()
+
+        try:
+            pending = len(inputs)
+            while pending:
+                index, kind, payload = self._next_result(results, workers)
+                if kind == BATCH:
+                    self._write_batch(index, *payload)
+                else:
+                    pending -= 1
+                    self._complete_file(index, payload)
+            self._writer.flush()
+            self._writer.commit()
+            self._writer.close()
+        except:
+            for worker in workers:
+                worker.terminate()
+            self._writer.rollback()
+            raise
+        finally:
+            for worker in workers:
+                worker.join()
+        self.metrics.stop()
+        return self.summary
+
+    def _next_result(self, results, workers):
+        """
+        Returns the next message of the workers
+        """
+        while True:
+            try:
+                return results.get(timeout=POLL_INTERVAL)
+            except Queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    raise RuntimeError('The parsing workers have died')
+
+    def _write_batch(self, index, rows, errors, lines, byte_count):
+        """
+        Write the `rows` parsed from the file `index`. If they violate
+        a constraint of the db they are discarded and the error is
+        recorded.
+        """
+        file_metrics = self.file_metrics[index]
+        if file_metrics.started is None:
+            file_metrics.start()
+        filename = self.filenames[index]
+        for line_num, line_type in errors:
+            self._add_error(index, line_type, ERR_LINE % (line_num, filename))
+        for metrics in (file_metrics, self.metrics):
+            metrics.lines += lines
+            metrics.bytes += byte_count
+
+        writer = self._writer
+        writer.start_event(index)
+        try:
+            for row in rows:
+                writer.add(row)
+        except IntegrityError as e:
+            if not writer.discard_event():
+                raise
+            self._add_error(index, 'integrity', ERR_FILE % (filename, e))
+        else:
+            file_metrics.add_batch(len(rows))
+        if writer.commit_due:
+            writer.flush()
+            writer.commit()
+            self.metrics.notify()
+
+    def _batch_discarded(self, index, error):
+        """
+        Record the integrity `error` of a batch of the file `index`
+        discarded by the writer after the batch was added
+        """
+        self._add_error(index, 'integrity',
+                        ERR_FILE % (self.filenames[index], error))
+
+    def _complete_file(self, index, failure):
+        """
+        Record the end of the parsing of the file `index`, which
+        failed if `failure` is not None
+        """
+        filename = self.filenames[index]
+        if failure is not None:
+            self._add_error(index, 'file', ERR_FILE % (filename, failure))
+        LOG.info('%s parsed (%s)' % (filename, self.file_metrics[index]))
+        self.file_metrics[index].stop()
+
+    def _add_error(self, index, kind, message):
+        """
+        Record a failure of the import of the file `index`
+        """
+        LOG.warn(message)
+        self.errors.append(ParsingFailure(message))
+        self.file_metrics[index].add_error(kind)
+        self.metrics.add_error(kind)
+
+    @property
+    def summary(self):
+        """
+        The summary of the catalogue data stored by the last load (s.
+        :attr:`~eqcatalogue.importers.base.BaseImporter.summary`)
+        """
+        if self._writer is None:
+            return {}
+        return writer_summary(self._writer)
+
+    def report(self):
+        """
+        Returns the lines of a report of the throughput of the last
+        load, one for each file followed by the total
+        """
+        lines = ['%s: %d lines, %d rows, %d bytes, %d errors' % (
+            os.path.basename(filename), metrics.lines, metrics.rows,
+            metrics.bytes, sum(metrics.errors.values()))
+            for filename, metrics in zip(self.filenames, self.file_metrics)]
+        lines.append('Total: %s' % self.metrics)
+        return lines
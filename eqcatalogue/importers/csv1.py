@@ -14,15 +14,32 @@
 # along with EqCatalogueTool. If not, see <http://www.gnu.org/licenses/>.
 
 """
-Module :mod:`eq_catalogue_tool.reader` defines classes for reading
-different formats of earthquake catalogues.
+Module :mod:`eqcatalogue.importers.csv1` implements the importer of
+the csv1 format, whose columns are given by `CSV_FIELDNAMES`.
 
-This module is obsolete
+The :class:`CsvEqCatalogueReader` and :class:`Converter` classes,
+which read the entries one at a time, are obsolete.
 """
 
+import csv
+import itertools
 from csv import DictReader
 
+import numpy as np
+
+from eqcatalogue.exceptions import ParsingFailure
+from eqcatalogue.importers.base import BaseImporter
+from eqcatalogue.importers.dates import compose_times, format_times
 from eqcatalogue.importers.reader_utils import CSV_FIELDNAMES, TRANSF_MAP
+from eqcatalogue.importers.writer import MeasureWriter, position_wkt
+
+
+ERR_MSG = 'The line %s violates the csv1 format'
+
+# the columns of a csv1 entry, by name
+COLUMNS = dict((name, index) for index, name in enumerate(CSV_FIELDNAMES))
+
+TIME_COMPONENTS = ('year', 'month', 'day', 'hour', 'minute')
 
 
 class CsvEqCatalogueReader(object):
@@ -98,3 +115,246 @@ class Converter(object):
             value = transf(value)
 
         return value
+
+
+def _text(column):
+    """
+    Returns the list of the stripped strings of `column`, with None in
+    place of the empty ones
+    """
+    return [value or None for value in np.char.strip(column).tolist()]
+
+
+def _floats(column):
+    """
+    Convert the string array `column` to floats, with NaN where the
+    field is empty. Returns the values, a mask of the empty fields and
+    a mask of the invalid ones.
+    """
+    column = np.char.strip(column)
+    blank = column == ''
+    invalid = np.zeros(len(column), dtype=bool)
+    try:
+        values = np.where(blank, 'nan', column).astype(float)
+    except ValueError:
+        values = np.empty(len(column))
+        for i, item in enumerate(column.tolist()):
+            try:
+                values[i] = float(item) if item else np.nan
+            except ValueError:
+                values[i] = np.nan
+                invalid[i] = True
+    return values, blank, invalid
+
+
+def _nullable(values):
+    """
+    Returns the list of the python values of the array `values`, with
+    None in place of NaN
+    """
+    return [None if value != value else value for value in values.tolist()]
+
+
+def decode_block(fields):
+    """
+    Convert the 2d string array `fields` (a row for each entry, a
+    column for each field in `CSV_FIELDNAMES`) into measure rows.
+    Every column is converted at once.
+
+    The measure agency is the magnitude agency or, if missing, the
+    solution agency; the origin key is the origin id or, if missing,
+    the solution key.
+
+    :returns: the list of the measure rows (without their event
+      source, s. :data:`eqcatalogue.importers.writer.ROW_FIELDS`) and
+      a mask of the entries that can not be converted
+    """
+    def column(name):
+        return fields[:, COLUMNS[name]]
+
+    floats, invalid = {}, np.zeros(len(fields), dtype=bool)
+    for name in ('second', 'timeError', 'time_rms', 'Latitude',
+                 'Longitude', 'semiMajor90', 'semiMinor90', 'errorAzimuth',
+                 'depth', 'depthError', 'magnitude',
+                 'magnitudeError') + TIME_COMPONENTS:
+        floats[name], blank, bad = _floats(column(name))
+        invalid |= bad
+        if name in ('second', 'Latitude', 'Longitude',
+                    'magnitude') + TIME_COMPONENTS:
+            invalid |= blank
+
+    components = []
+    for name in TIME_COMPONENTS:
+        values = np.where(invalid, 0, floats[name])
+        invalid |= values != np.floor(values)
+        components.append(values.astype(int))
+    microseconds = np.round(
+        np.where(invalid, 0, floats['second']) * 1000000).astype(int)
+    times, bad = compose_times(*(components + [microseconds]))
+    invalid |= bad
+
+    event_keys = _text(column('eventKey'))
+    agencies = [magnitude_agency or agency for magnitude_agency, agency
+                in zip(_text(column('mag_agency')),
+                       _text(column('solutionAgency')))]
+    origin_keys = [origin_id or solution_key for origin_id, solution_key
+                   in zip(_text(column('originID')),
+                          _text(column('solutionKey')))]
+    scales = _text(column('mag_type'))
+    invalid |= np.array([None in required for required in zip(
+        event_keys, agencies, origin_keys, scales)], dtype=bool)
+
+    positions = [position_wkt(latitude, longitude)
+                 for latitude, longitude in zip(
+                     floats['Latitude'].tolist(),
+                     floats['Longitude'].tolist())]
+
+    # measure rows ordered as writer.ROW_FIELDS, but the event source
+    rows = zip(event_keys, itertools.repeat(None), agencies, origin_keys,
+               scales, floats['magnitude'].tolist(),
+               _nullable(floats['magnitudeError']),
+               format_times(times),
+               _nullable(floats['timeError']),
+               _nullable(floats['time_rms']),
+               _nullable(floats['semiMajor90']),
+               _nullable(floats['semiMinor90']),
+               positions,
+               _nullable(floats['depth']),
+               _nullable(floats['depthError']),
+               _nullable(floats['errorAzimuth']))
+    return rows, invalid
+
+
+def convert_block(block, line_num):
+    """
+    Convert the entries in the lines of `block`, the first of which
+    is the line following `line_num`. Blank lines are ignored. Only
+    the lines holding quotes are split by the csv module.
+
+    :returns: the measure rows (without their event source) and the
+      line numbers of the entries that can not be converted
+    """
+    entries, entry_lines, errors = [], [], []
+    for i, line in enumerate(block, line_num + 1):
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        if '"' in line:
+            entry = next(csv.reader([line]))
+        else:
+            entry = line.split(',')
+        if len(entry) != len(CSV_FIELDNAMES):
+            errors.append(i)
+            continue
+        entries.append(entry)
+        entry_lines.append(i)
+    if not entries:
+        return [], errors
+
+    rows, invalid = decode_block(np.array(entries))
+    errors.extend(entry_lines[i] for i in np.flatnonzero(invalid).tolist())
+    return ([row for bad, row in zip(invalid.tolist(), rows) if not bad],
+            errors)
+
+
+class Importer(BaseImporter):
+    """
+    Implements the Importer for the csv1 format.
+
+    The file is read in blocks of lines, each one split into an array
+    of fields and converted column by column (s. :func:`decode_block`)
+    before its measures are written into the catalogue db.
+    """
+
+    DEFAULT_EVENT_SOURCE = 'CSV1'
+    DEFAULT_BLOCK_SIZE = 65536
+
+    PARSING_ERROR = ERR_MSG
+
+    def store(self, event_source=None, block_size=None, flush_size=None,
+              commit_interval=None, resume=False, on_metrics=None,
+              append=False):
+        """
+        Read and parse from the input stream the data and insert them
+        into the catalogue db, a summary of entities stored is returned.
+
+        :param event_source: the event source of the measures (the
+          default is `DEFAULT_EVENT_SOURCE`)
+        :param block_size: the number of lines converted at once
+
+        Measures are written in batches of `flush_size` rows and
+        committed every `commit_interval` rows (s.
+        :class:`~eqcatalogue.importers.writer.MeasureWriter`). If
+        `resume` is True, a partially imported file is imported from
+        the last committed block. `on_metrics` is called with the
+        import metrics at each commit and at the end of the import.
+        Entries that can not be converted are skipped and recorded in
+        `self.errors`. If `append` is True, the entries already stored
+        are skipped and the changed ones are replaced.
+        """
+        event_source = event_source or self.DEFAULT_EVENT_SOURCE
+        block_size = block_size or self.DEFAULT_BLOCK_SIZE
+        self.metrics.start(on_metrics)
+        writer = self._writer = MeasureWriter(self._catalogue,
+                                              flush_size=flush_size,
+                                              commit_interval=commit_interval,
+                                              metrics=self.metrics,
+                                              append=append)
+
+        journal = self._open_journal(resume)
+        offset, line_num = 0, 0
+        if journal is not None:
+            if journal.completed:
+                self.metrics.stop()
+                return self.summary
+            offset, line_num = journal.offset, journal.line_num
+        if offset:
+            self._file_stream.seek(offset)
+
+        lines = iter(self._file_stream)
+        while True:
+            block = list(itertools.islice(lines, block_size))
+            if not block:
+                break
+            rows, errors = convert_block(block, line_num)
+            for error_line_num in errors:
+                self._add_error(error_line_num)
+            for row in rows:
+                writer.add((event_source,) + row)
+            line_num += len(block)
+            block_bytes = sum(len(line) for line in block)
+            offset += block_bytes
+            self.metrics.lines += len(block)
+            self.metrics.bytes += block_bytes
+            if writer.commit_due:
+                self._checkpoint(offset, line_num)
+
+        self._checkpoint(offset, line_num, completed=True)
+
+        return self.summary
+
+    @classmethod
+    def parse_stream(cls, stream, batch_size, event_source=None):
+        """
+        Parse the lines of `stream`, `batch_size` at a time, without a
+        catalogue db (s. :meth:`BaseImporter.parse_stream`)
+        """
+        event_source = event_source or cls.DEFAULT_EVENT_SOURCE
+        lines = iter(stream)
+        line_num = 0
+        while True:
+            block = list(itertools.islice(lines, batch_size))
+            if not block:
+                break
+            rows, errors = convert_block(block, line_num)
+            line_num += len(block)
+            yield ([(event_source,) + row for row in rows],
+                   [(error_line_num, 'entry') for error_line_num in errors],
+                   len(block), sum(len(line) for line in block))
+
+    def _add_error(self, line_num):
+        """
+        Record that the entry at `line_num` can not be converted
+        """
+        self.errors.append(ParsingFailure(ERR_MSG % line_num))
+        self.metrics.add_error('entry')
@@ -0,0 +1,182 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# eqcataloguetool is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EqCatalogueTool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with eqcataloguetool. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Module :mod:`eqcatalogue.importers.dates` decodes the dates and times
+read by the importers in bulk, i.e. a whole column of them at once
+with numpy, instead of calling `datetime.strptime` for each one.
+
+Times are decoded into arrays of `datetime64[us]`, which can be
+formatted (s. :func:`format_times`) as the importers write them into
+the catalogue db.
+"""
+
+import numpy as np
+
+
+# YYYY-MM-DD
+DATE_LENGTH = 10
+
+# HH:MM:SS.ffffff
+TIME_LENGTH = 15
+
+DATE_SEPARATORS = ((4, '-/'), (7, '-/'))
+TIME_SEPARATORS = ((2, ':'), (5, ':'))
+
+MICROSECOND_DIGITS = 6
+
+
+def _chars(strings, length):
+    """
+    Returns the 2d array of the characters of `strings`, padded with
+    null characters (or truncated) to `length`, and a mask of the
+    strings longer than `length`
+    """
+    strings = np.asarray(strings, dtype=str)
+    too_long = np.char.str_len(strings) > length
+    chars = strings.astype('S%d' % length).view(np.uint8)
+    return chars.reshape(len(strings), length), too_long
+
+
+def _number(chars, start, stop):
+    """
+    Returns the integers written in the columns from `start` to `stop`
+    of the 2d array of characters `chars` and a mask of the rows with
+    non digit characters
+    """
+    digits = chars[:, start:stop].astype(int) - ord('0')
+    invalid = ((digits < 0) | (digits > 9)).any(axis=1)
+    powers = 10 ** np.arange(stop - start - 1, -1, -1)
+    return digits.dot(powers), invalid
+
+
+def _separated(chars, separators):
+    """
+    Returns a mask of the rows of the 2d array of characters `chars`
+    not having the expected `separators`, a sequence of (column,
+    allowed characters)
+    """
+    invalid = np.zeros(len(chars), dtype=bool)
+    for column, allowed in separators:
+        invalid |= ~np.in1d(chars[:, column],
+                            np.frombuffer(allowed, dtype=np.uint8))
+    return invalid
+
+
+def decode_dates(dates):
+    """
+    Decode the dates `dates` written as YYYY-MM-DD (or YYYY/MM/DD).
+    Returns the arrays of years, months and days and a mask of the
+    dates that can not be decoded.
+    """
+    chars, invalid = _chars(dates, DATE_LENGTH)
+    invalid |= _separated(chars, DATE_SEPARATORS)
+    components = []
+    for start, stop in ((0, 4), (5, 7), (8, 10)):
+        values, bad = _number(chars, start, stop)
+        components.append(values)
+        invalid |= bad
+    return components + [invalid]
+
+
+def decode_clock_times(times):
+    """
+    Decode the times of the day `times` written as HH:MM:SS, with an
+    optional fraction of second (HH:MM:SS.f up to HH:MM:SS.ffffff).
+    Returns the arrays of hours, minutes and microseconds from the
+    start of the minute and a mask of the times that can not be
+    decoded. A leap second (e.g. 23:59:60.00) is accepted: its
+    microseconds overflow the minute and are carried into the next
+    one by :func:`compose_times`.
+    """
+    chars, invalid = _chars(times, TIME_LENGTH)
+    invalid |= _separated(chars, TIME_SEPARATORS)
+    hour, bad = _number(chars, 0, 2)
+    invalid |= bad
+    minute, bad = _number(chars, 3, 5)
+    invalid |= bad
+    second, bad = _number(chars, 6, 8)
+    invalid |= bad
+
+    # the fraction of second is right padded with zeros, so that
+    # e.g. ".05" is read as 050000 microseconds
+    has_fraction = chars[:, 8] == ord('.')
+    invalid |= ~has_fraction & (chars[:, 8] != 0)
+    fraction = chars[:, 9:].copy()
+    fraction[fraction == 0] = ord('0')
+    fraction[~has_fraction] = ord('0')
+    microsecond, bad = _number(fraction, 0, MICROSECOND_DIGITS)
+    invalid |= bad
+    invalid |= second > 60
+    return hour, minute, second * 1000000 + microsecond, invalid
+
+
+def compose_times(year, month, day, hour, minute, microseconds):
+    """
+    Build the datetime64 array of the times given by the integer
+    arrays of their components (`microseconds` is the number of
+    microseconds from the start of the minute, up to the end of a leap
+    second, which is carried into the next minute). Returns the times
+    and a mask of the invalid combinations, whose times are
+    meaningless.
+    """
+    invalid = ((year < 1) | (year > 9999) | (month < 1) | (month > 12) |
+               (day < 1) | (hour < 0) | (hour > 23) | (minute < 0) |
+               (minute > 59) | (microseconds < 0) |
+               (microseconds >= 61000000))
+    # avoid overflows while computing the invalid dates
+    year = np.where(invalid, 1970, year)
+    month = np.where(invalid, 1, month)
+    day = np.where(invalid, 1, day)
+    hour = np.where(invalid, 0, hour)
+    minute = np.where(invalid, 0, minute)
+    microseconds = np.where(invalid, 0, microseconds)
+
+    months = ((year - 1970).astype('M8[Y]').astype('M8[M]') +
+              (month - 1).astype('m8[M]'))
+    month_length = ((months + 1).astype('M8[D]') -
+                    months.astype('M8[D]')).astype(int)
+    invalid |= day > month_length
+
+    times = (months.astype('M8[D]') + (day - 1).astype('m8[D]')).astype(
+        'M8[us]')
+    times += ((hour * 3600 + minute * 60) * 1000000 +
+              microseconds).astype('m8[us]')
+    return times, invalid
+
+
+def decode_times(dates, times):
+    """
+    Decode the times given by the dates `dates` (s.
+    :func:`decode_dates`) and the times of the day `times` (s.
+    :func:`decode_clock_times`). Returns the datetime64 array of the
+    times and a mask of the ones that can not be decoded.
+    """
+    year, month, day, invalid = decode_dates(dates)
+    hour, minute, microseconds, bad = decode_clock_times(times)
+    times, bad_times = compose_times(year, month, day, hour, minute,
+                                     microseconds)
+    return times, invalid | bad | bad_times
+
+
+def format_times(times):
+    """
+    Returns the list of the string representations of the datetime64
+    array `times`, as the ones given by
+    :func:`eqcatalogue.importers.writer.format_time`
+    """
+    return np.char.replace(
+        np.datetime_as_string(times.astype('M8[us]'), unit='us'),
+        'T', ' ').tolist()
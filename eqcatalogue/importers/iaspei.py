@@ -13,12 +13,35 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with eqcataloguetool. If not, see <http://www.gnu.org/licenses/>.
 
-from datetime import datetime
+import itertools
 
-from eqcatalogue import models as catalogue
 from eqcatalogue.exceptions import InvalidMagnitudeSeq
 
 from eqcatalogue.importers.base import BaseImporter
+from eqcatalogue.importers.dates import decode_times, format_times
+from eqcatalogue.importers.writer import MeasureWriter, position_wkt
+
+
+EVENT_SOURCE = 'IASPEI'
+
+
+def read_entries(stream, header, offset=0):
+    """
+    Returns an iterator over the entries parsed in the csv file
+    `stream`, starting at byte `offset`, each one with the byte offset
+    of the line following it. The header is skipped only when reading
+    from the beginning of the file.
+    """
+    if offset:
+        stream.seek(offset)
+    lines = iter(stream)
+    if header and not offset:
+        #skip the header line
+        offset += len(next(lines, ''))
+
+    for line in lines:
+        offset += len(line)
+        yield [item.strip() for item in line.split(',')], offset
 
 
 class Importer(BaseImporter):
@@ -34,78 +57,169 @@ class Importer(BaseImporter):
     ERR_MAG_GROUP = ('Each Magnitude should be defined by '
                      '3 Values: Author, Type and Value')
 
+    ERR_TIME = 'Invalid date/time at line %d: %s %s'
+
+    ERR_MAG_GROUP_LINE = ERR_MAG_GROUP + ' (line %d)'
+
+    # number of entries whose times are decoded at once
+    BATCH_SIZE = 4096
+
     def _parse_csv(self, header):
         """
-        Returns a list of entries parsed in the csv file
-        if the header is present in the csv it is skipped
-        in the result.
+        Returns an iterator over the entries parsed in the csv file.
+        If the header is present in the csv it is skipped in the
+        result. Lines are read one at a time, so the file is never
+        loaded in memory.
+
         :param header:
             A flag which states if the header is in the csv file.
         """
+        for entry, _ in self._read_entries(header):
+            yield entry
 
-        entries = []
-        for line in self._file_stream:
-            entries.append([item.strip() for item in line.split(',')])
-        if header:
-            #skip the header line
-            entries = entries[1:]
-
-        return entries
+    def _read_entries(self, header, offset=0):
+        """
+        Returns an iterator over the entries parsed in the csv file,
+        starting at byte `offset` (s. :func:`read_entries`)
+        """
+        return read_entries(self._file_stream, header, offset)
 
-    def _check_magnitude_group(self, mag_group):
+    @classmethod
+    def _check_magnitude_group(cls, mag_group, line_num=None):
         """
         Check that for each magnitude in the sequence
         Author, Type and Value have been defined.
+        The error message reports `line_num`, if given.
         """
         if len(mag_group) % 3 != 0:
-            raise InvalidMagnitudeSeq(self.ERR_MAG_GROUP)
+            raise InvalidMagnitudeSeq(
+                cls.ERR_MAG_GROUP if line_num is None
+                else cls.ERR_MAG_GROUP_LINE % line_num)
 
-    def store(self, header=True):
+    @classmethod
+    def convert_entries(cls, batch, line_num, event_source=EVENT_SOURCE):
         """
-        Read and parse from the input stream the data and insert them
-        into the catalogue db, a summary of entities stored is returned.
+        Convert a `batch` of entries, as given by :func:`read_entries`,
+        the first of which is at the line following `line_num`. The
+        times of the whole batch are decoded at once.
+
+        :returns: an iterator over tuples (line number, byte offset of
+          the following line, measure rows) for each entry
+        :raises InvalidMagnitudeSeq: if the magnitudes of an entry are
+          not well defined
+        :raises ValueError: if the date or time of an entry can not be
+          decoded
         """
-
-        event_source = 'IASPEI'
-
-        for entry in self._parse_csv(header):
-            self._check_magnitude_group(entry[self.MAG_GR_INDEX:])
-
-            # Time String Creation
-            microsec = int(float(entry[self.TIME_INDEX][8:]) * 10000)
-            time = ''.join([entry[self.TIME_INDEX][:9], str(microsec)])
-            date_time = '/'.join(
-                [entry[self.DATE_INDEX], time])
-
-            if entry[self.DEPTH_INDEX]:
-                depth = float(entry[self.DEPTH_INDEX])
+        times, invalid = decode_times(
+            [entry[cls.DATE_INDEX] for entry, _ in batch],
+            [entry[cls.TIME_INDEX] for entry, _ in batch])
+        times = format_times(times)
+
+        for (entry, next_offset), time, bad_time in zip(
+                batch, times, invalid.tolist()):
+            line_num += 1
+            cls._check_magnitude_group(entry[cls.MAG_GR_INDEX:], line_num)
+            if bad_time:
+                raise ValueError(cls.ERR_TIME % (
+                    line_num, entry[cls.DATE_INDEX], entry[cls.TIME_INDEX]))
+
+            if entry[cls.DEPTH_INDEX]:
+                depth = float(entry[cls.DEPTH_INDEX])
             else:
                 depth = None
 
-            origin = {'time': datetime.strptime(
-                date_time, '%Y-%m-%d/%H:%M:%S.%f'),
-                'position': self._catalogue.position_from_latlng(
-                    entry[self.LAT_INDEX], entry[self.LON_INDEX]),
-                'depth': depth,
-                'origin_key': entry[self.EVENTID_INDEX]}
-
-            magnitude_group = entry[self.MAG_GR_INDEX:]
-
-            for mag_group_start in xrange(
-                    0, len(magnitude_group), self.MAG_MEASURE_ITEMS):
-                agency = magnitude_group[mag_group_start]
-
-                params = {
-                    'event_key': entry[self.EVENTID_INDEX],
-                    'event_source': event_source,
-                    'agency': agency,
-                    'scale': magnitude_group[mag_group_start + 1],
-                    'value': magnitude_group[mag_group_start + 2],
-                }
-                params.update(origin)
-                self._catalogue.session.add(
-                    catalogue.MagnitudeMeasure(**params))
-
-        self._catalogue.session.commit()
+            # origin fields ordered as writer.ORIGIN_FIELDS
+            origin = (time, None, None, None, None,
+                      position_wkt(entry[cls.LAT_INDEX],
+                                   entry[cls.LON_INDEX]),
+                      depth, None, None)
+            event_key = entry[cls.EVENTID_INDEX]
+
+            magnitude_group = entry[cls.MAG_GR_INDEX:]
+            rows = [(event_source, event_key, None,
+                     magnitude_group[mag_group_start],
+                     event_key,
+                     magnitude_group[mag_group_start + 1],
+                     magnitude_group[mag_group_start + 2],
+                     None) + origin
+                    for mag_group_start in xrange(
+                        0, len(magnitude_group), cls.MAG_MEASURE_ITEMS)]
+            yield line_num, next_offset, rows
+
+    @classmethod
+    def parse_stream(cls, stream, batch_size, header=True):
+        """
+        Parse the entries of `stream` without a catalogue db (s.
+        :meth:`BaseImporter.parse_stream`). An invalid entry stops
+        the parsing.
+        """
+        entries = read_entries(stream, header)
+        offset, line_num = 0, 1 if header else 0
+        while True:
+            batch = list(itertools.islice(entries, batch_size))
+            if not batch:
+                break
+            rows = []
+            for line_num, next_offset, entry_rows in cls.convert_entries(
+                    batch, line_num):
+                rows.extend(entry_rows)
+            yield rows, [], len(batch), next_offset - offset
+            offset = next_offset
+
+    def store(self, header=True, flush_size=None, commit_interval=None,
+              resume=False, on_metrics=None, append=False):
+        """
+        Read and parse from the input stream the data and insert them
+        into the catalogue db, a summary of entities stored is returned.
+
+        Measures are written in batches of `flush_size` rows and
+        committed every `commit_interval` rows (s.
+        :class:`~eqcatalogue.importers.writer.MeasureWriter`), so
+        memory usage does not depend on the size of the file. If
+        `resume` is True, a partially imported file is imported from
+        the last committed entry. `on_metrics` is called with the
+        import metrics at each commit and at the end of the import.
+        If `append` is True, the entries already stored are skipped
+        and the changed ones are replaced.
+
+        The times of the entries are decoded `BATCH_SIZE` entries at a
+        time (s. :func:`eqcatalogue.importers.dates.decode_times`).
+        """
+
+        self.metrics.start(on_metrics)
+        writer = self._writer = MeasureWriter(self._catalogue,
+                                              flush_size=flush_size,
+                                              commit_interval=commit_interval,
+                                              replace=False,
+                                              metrics=self.metrics,
+                                              append=append)
+
+        journal = self._open_journal(resume)
+        offset, line_num = 0, 0
+        if journal is not None:
+            if journal.completed:
+                self.metrics.stop()
+                return self.summary
+            offset, line_num = journal.offset, journal.line_num
+        if header and not offset:
+            line_num = 1
+
+        entries = self._read_entries(header, offset)
+        while True:
+            batch = list(itertools.islice(entries, self.BATCH_SIZE))
+            if not batch:
+                break
+            for line_num, next_offset, rows in self.convert_entries(
+                    batch, line_num):
+                self.metrics.lines += 1
+                self.metrics.bytes += next_offset - offset
+                offset = next_offset
+                for row in rows:
+                    writer.add(row)
+
+                if writer.commit_due:
+                    self._checkpoint(offset, line_num)
+
+        self._checkpoint(offset, line_num, completed=True)
 
         return self.summary
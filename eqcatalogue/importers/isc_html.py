@@ -0,0 +1,142 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# eqcataloguetool is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EqCatalogueTool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with eqcataloguetool. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Module :mod:`eqcatalogue.importers.isc_html` implements the importer
+of the HTML pages returned by the ISC web queries, which hold an ISF
+bulletin in a `<pre>` element.
+"""
+
+import re
+import htmlentitydefs
+
+from eqcatalogue.importers import isf_bulletin
+
+
+PRE_START_REGEXP = re.compile(r'<pre\b[^>]*>', re.IGNORECASE)
+PRE_END_REGEXP = re.compile(r'</pre\s*>', re.IGNORECASE)
+TAG_REGEXP = re.compile(r'<[^>]*>')
+ENTITY_REGEXP = re.compile(r'&(#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z]+);')
+
+
+def _entity(match):
+    """
+    Returns the text of the character entity matched by `match`, or
+    the entity itself if it is unknown
+    """
+    name = match.group(1)
+    if name.startswith('#'):
+        if name[1] in 'xX':
+            code = int(name[2:], 16)
+        else:
+            code = int(name[1:])
+    elif name in htmlentitydefs.name2codepoint:
+        code = htmlentitydefs.name2codepoint[name]
+    else:
+        return match.group(0)
+    return unichr(code).encode('utf-8')
+
+
+def unescape(text):
+    """
+    Returns `text` with its character entities (e.g. &amp;) replaced
+    """
+    if '&' not in text:
+        return text
+    return ENTITY_REGEXP.sub(_entity, text)
+
+
+class PreformattedText(object):
+    """
+    A read-only file-like object iterating over the text of the
+    `<pre>` elements of the HTML page read from `stream`, one line at
+    a time, so that the page is never loaded in memory. The markup
+    inside the elements (e.g. web links) is removed and the character
+    entities are replaced.
+
+    Each line of the page gives a line, blank if it is outside the
+    `<pre>` elements, so that the line numbers of the text are the
+    ones of the page.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def __iter__(self):
+        inside = False
+        for line in self._stream:
+            line = line.rstrip('\r\n')
+            parts = []
+            position = 0
+            while True:
+                if not inside:
+                    start = PRE_START_REGEXP.search(line, position)
+                    if start is None:
+                        break
+                    position, inside = start.end(), True
+                end = PRE_END_REGEXP.search(line, position)
+                parts.append(line[position:end.start() if end else None])
+                if end is None:
+                    break
+                position, inside = end.end(), False
+            text = ''.join(parts)
+            if '<' in text:
+                text = TAG_REGEXP.sub('', text)
+            yield unescape(text) + '\n'
+
+    def close(self):
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class Importer(isf_bulletin.Importer):
+    """
+    Import the ISF bulletin held by an HTML page of the ISC web
+    queries (s. :data:`eqcatalogue.importers.isf_bulletin.CATALOG_URL`),
+    which is fed to the ISF parser while the page is read, without an
+    intermediate file. Pages generated with the "Output web links"
+    option are supported as well.
+
+    As the page is read as a stream, the import can not be resumed and
+    it is always sequential (i.e. the `processes` and `memory_map`
+    options of :meth:`store` are ignored).
+    """
+
+    def __init__(self, stream, cat):
+        super(Importer, self).__init__(PreformattedText(stream), cat)
+
+    @classmethod
+    def parse_stream(cls, stream, batch_size, allow_junk=True):
+        """
+        Parse the bulletin held by the page `stream` without a
+        catalogue db (s. :func:`isf_bulletin.parse_bulletin`)
+        """
+        return isf_bulletin.parse_bulletin(PreformattedText(stream),
+                                           batch_size, allow_junk)
+
+    @classmethod
+    def validate(cls, stream, batch_size=None, allow_junk=True,
+                 processes=None, chunk_size=None):
+        """
+        Validate the bulletin held by the page `stream` without a
+        catalogue db. The page is always parsed sequentially.
+        """
+        return super(isf_bulletin.Importer, cls).validate(
+            stream, batch_size, allow_junk=allow_junk)
@@ -19,20 +19,33 @@ events from catalogue saved in the ISF Format
 http://www.isc.ac.uk/standards/isf/
 """
 
+import os
 import re
 import datetime
+import collections
+import time
+import multiprocessing
+import numpy as np
 from sqlalchemy.exc import IntegrityError
 
-from eqcatalogue import models as catalogue
-
 from eqcatalogue.log import logger
 from eqcatalogue.importers import BaseImporter
+from eqcatalogue.importers.writer import (
+    MeasureWriter, RowBuffer, position_wkt)
+from eqcatalogue.importers.streams import detect_codec
+from eqcatalogue.importers.validation import ValidationReport
+from eqcatalogue.importers.isf_records import (
+    BulletinRecords, ORIGIN_RECORD, MEASURE_RECORD, ORIGIN_RECORD_DTYPE,
+    MEASURE_RECORD_DTYPE, decode_origins, decode_measures)
 from eqcatalogue.exceptions import ParsingFailure
 
 
 LOG = logger(__name__)
 CATALOG_URL = 'http://www.isc.ac.uk/cgi-bin/web-db-v4'
 
+# number of lines between two progress messages
+LOG_INTERVAL = 250000
+
 ANALYSIS_TYPES = {'a': 'automatic',
                   'm': 'manual',
                   'g': 'guess'}
@@ -68,6 +81,28 @@ EVENT_TYPES = {
 
 UNKNOWN_EVENT_TYPE_DESCRIPTION = "unknown event type"
 
+ORIGIN_BLOCK_LENGTH = 136
+MEASURE_BLOCK_LENGTH = 38
+
+ORIGIN_HEADER_REGEXP = re.compile('^%s$' % r'\s+'.join([
+    "Date", "Time", "Err", "RMS", "Latitude", "Longitude", "Smaj", "Smin",
+    "Az", "Depth", "Err", "Ndef", "Nst[a]*", "Gap", "mdist", "Mdist", "Qual",
+    "Author", "OrigID"]))
+
+MEASURE_HEADER_REGEXP = re.compile('^%s$' % r'\s+'.join([
+    "Magnitude", "Err", "Nsta", "Author", "OrigID"]))
+
+COMMENT_REGEXP = re.compile(r'^\([^\)].+\)')
+
+# the region name of an event is optional
+EVENT_REGEXP = re.compile(
+    r'^Event\s+(?P<source_event_id>\w{0,9})(?: (?P<name>.{0,65}))?$')
+
+UK_SCALE_REGEXP = re.compile(
+    r'^(?P<val>-*[0-9]+\.[0-9]+)\s+(?P<error>[0-9]+\.[0-9]+)*\s+'
+    r'(?P<stations>[0-9]+)*\s+(?P<agency>[\w;]+)'
+    r'\s+(?P<origin>\w+)$')
+
 ERR_MSG = ('The line %s violates the format, please check the related format'
            ' documentation at: http://www.isc.ac.uk/standards/isf/')
 
@@ -85,21 +120,14 @@ class UnexpectedLine(BaseException):
 
 class BaseState(object):
     """
-    The base state object. A state stores the catalogue db instance
+    The base state object. A state stores the parser context (where
+    the origins of the current event and the measure writer are kept)
     and calculate the next state based on the current event
     """
 
     def __init__(self, context=None):
-        self._catalogue = None
         self.context = context
 
-    def setup(self, cat):
-        """
-        Save the catalogue `cat` to allow further data insert
-        operation
-        """
-        self._catalogue = cat
-
     def is_start(self):
         """
         Return true if the state can be a starting state
@@ -172,14 +200,15 @@ class EventState(BaseState):
     def match(cls, line):
         """Return True if line match a proper regexp, that triggers an
         event that makes the fsm jump to an EventState"""
-        event_regexp = re.compile(
-            r'^Event\s+(?P<source_event_id>\w{0,9}) (?P<name>.{0,65})$')
-        return event_regexp.match(line)
+        return EVENT_REGEXP.match(line)
 
     def process_line(self, line):
         result = self.__class__.match(line).groupdict()
         source_event_id, name = result['source_event_id'], result['name']
         self.context['current_event'] = (source_event_id, name)
+        # the measures of an event refer only to the origins of the
+        # same event, so the origins of the previous one are released
+        self.context['origins'].clear()
 
 
 class OriginHeaderState(BaseState):
@@ -245,10 +274,7 @@ class OriginBlockState(BaseState):
                 time_error = None
         time_rms = None if not line[30:35].strip() else float(line[30:35])
 
-        position = self._catalogue.position_from_latlng(float(line[36:44]),
-                                                        float(line[45:54]))
-        position = "GeomFromText('POINT(%s %s)', 4326)" % (
-            float(line[45:54]), float(line[36:44]))
+        position = position_wkt(float(line[36:44]), float(line[45:54]))
         fixed_position = line[54] == 'f'
         errors = (line[55:60].strip(), line[61:66].strip())
         if fixed_position or not errors[0]:
@@ -272,11 +298,19 @@ class OriginBlockState(BaseState):
         else:
             depth_error = float(line[78:82])
 
-        self.context['origins'][line[128:136].strip()] = dict(
-            time=time, time_error=time_error, time_rms=time_rms,
-            position=position, semi_major_90error=semi_major_90error,
-            semi_minor_90error=semi_minor_90error, depth=depth,
-            depth_error=depth_error, azimuth_error=azimuth_error)
+        # the origin is stored as a tuple ordered as ORIGIN_FIELDS, so
+        # that it can be appended as it is to each measure row
+        self.context['origins'][line[128:136].strip()] = (
+            time, time_error, time_rms, semi_major_90error,
+            semi_minor_90error, position, depth, depth_error, azimuth_error)
+
+    def process_record(self, record):
+        """
+        Save an origin already decoded as a tuple (origin key, origin)
+        (s. :func:`eqcatalogue.importers.isf_records.decode_origins`)
+        """
+        key, origin = record
+        self.context['origins'][key] = origin
 
 
 class MeasureBlockState(BaseState):
@@ -308,29 +342,23 @@ class MeasureBlockState(BaseState):
         self._save_measure(
             agency_name, scale, value, standard_error, origin_source_key)
 
+    def process_record(self, record):
+        """
+        Save a measure already decoded as a tuple (agency, scale,
+        value, standard error, origin key) (s.
+        :func:`eqcatalogue.importers.isf_records.decode_measures`)
+        """
+        self._save_measure(*record)
+
     def _save_measure(self,
                       agency_name, scale, value, standard_error,
                       origin_source_key):
-        params = dict(event_source=self.context['current_event_source'],
-                      event_key=self.context['current_event'][0],
-                      event_name=self.context['current_event'][1],
-                      agency=agency_name,
-                      scale=scale,
-                      value=value,
-                      standard_error=standard_error,
-                      origin_key=origin_source_key)
-        params.update(self.context['origins'][origin_source_key])
-
-        self._catalogue.session.execute("""
-INSERT OR REPLACE INTO catalogue_magnitudemeasure(
-created_at, scale, value, standard_error, event_source,
-event_key, event_name, agency, origin_key, time, time_error, time_rms,
-semi_major_90error, semi_minor_90error, position, depth, depth_error,
-azimuth_error)
-VALUES(datetime(), :scale, :value, :standard_error, :event_source,
-:event_key, :event_name, :agency, :origin_key, :time, :time_error, :time_rms,
-:semi_major_90error, :semi_minor_90error, %s,
-:depth, :depth_error, :azimuth_error)""" % params['position'], params)
+        row = (self.context['current_event_source'],
+               self.context['current_event'][0],
+               self.context['current_event'][1],
+               agency_name, origin_source_key, scale, value, standard_error)
+        self.context['writer'].add(
+            row + self.context['origins'][origin_source_key])
 
 
 class MeasureUKScaleBlockState(MeasureBlockState):
@@ -345,10 +373,7 @@ class MeasureUKScaleBlockState(MeasureBlockState):
         Use a regular expression to parse measure block with an
         unknown scale. Returns true if the line matches the pattern
         """
-        pat = (r'^(?P<val>-*[0-9]+\.[0-9]+)\s+(?P<error>[0-9]+\.[0-9]+)*\s+'
-               r'(?P<stations>[0-9]+)*\s+(?P<agency>[\w;]+)'
-               r'\s+(?P<origin>\w+)$')
-        return re.compile(pat).match(line)
+        return UK_SCALE_REGEXP.match(line)
 
     def process_line(self, line):
         scale = 'Muk'
@@ -362,6 +387,349 @@ class MeasureUKScaleBlockState(MeasureBlockState):
             standard_error=data.get('error'))
 
 
+class LineClassifier(object):
+    """
+    Detect the line type of the (stripped) lines of an ISF bulletin
+    and keep a count of the lines found for each line type.
+
+    Most of the lines of a bulletin are origin and measure blocks, so
+    the classifier dispatches on the first character of the line and
+    on its length; a regular expression is only tried on the lines
+    having the proper prefix.
+    """
+
+    EXACT_LINES = {'ISC Bulletin': 'catalogue_header',
+                   'STOP': 'stop'}
+
+    # first character -> sequence of (prefix, regexp, line_type)
+    PREFIX_TABLE = {
+        '(': (('(', COMMENT_REGEXP, 'comment'),),
+        'D': (('Date', ORIGIN_HEADER_REGEXP, 'origin_header'),),
+        'M': (('Magnitude', MEASURE_HEADER_REGEXP, 'measure_header'),),
+        'E': (('Event', EVENT_REGEXP, 'event_header'),)}
+
+    BLOCK_LENGTHS = {ORIGIN_BLOCK_LENGTH: 'origin_block',
+                     MEASURE_BLOCK_LENGTH: 'measure_block'}
+
+    UK_SCALE_CHARS = frozenset('-0123456789')
+
+    def __init__(self):
+        self.counts = collections.Counter()
+
+    def classify(self, line, started):
+        """
+        Returns the line_type of `line`. Origin and measure blocks
+        are recognized only if the catalogue header has been
+        `started`
+        """
+        line_type = self._classify(line, started)
+        self.counts[line_type] += 1
+        return line_type
+
+    def _classify(self, line, started):
+        if not line:
+            return 'comment'
+
+        line_type = self.EXACT_LINES.get(line)
+        if line_type is not None:
+            return line_type
+
+        first = line[0]
+        for prefix, regexp, line_type in self.PREFIX_TABLE.get(first, ()):
+            if line.startswith(prefix) and regexp.match(line):
+                return line_type
+
+        if started:
+            line_type = self.BLOCK_LENGTHS.get(len(line))
+            if line_type is not None:
+                return line_type
+
+        if first in self.UK_SCALE_CHARS and UK_SCALE_REGEXP.match(line):
+            return 'measure_unknown_scale_block'
+        return 'junk'
+
+
+class BulletinParser(object):
+    """
+    Drive the FSM over the lines of an ISF bulletin. The measure rows
+    built by the states are passed to `writer`, an object with an
+    `add` method (e.g. a
+    :class:`~eqcatalogue.importers.writer.MeasureWriter`).
+
+    :param writer: the object the parsed measure rows are added to
+    :param allow_junk: allow unexpected lines before the catalogue
+      header
+    :param event_source: if given, the parser starts as if the
+      catalogue header `event_source` has already been read. Used to
+      parse a bulletin starting from an event header
+    :param metrics: the
+      :class:`~eqcatalogue.importers.metrics.ImportMetrics` where the
+      time spent classifying lines is accounted
+    """
+
+    def __init__(self, writer=None, allow_junk=True, event_source=None,
+                 metrics=None):
+        self.allow_junk = allow_junk
+        self._metrics = metrics
+        # the type of the last line that could not be parsed
+        self.error_line_type = None
+        self.context = dict(origins={},
+                            current_event=None,
+                            current_event_source=event_source,
+                            writer=writer)
+        # we save the initial state, because it also acts like a
+        # rollback state
+        self._initial = StartState()
+        self._initial.context = self.context
+        if event_source is not None:
+            self._initial.started = True
+        self._state = self._initial
+        self._classifier = LineClassifier()
+
+    @property
+    def counts(self):
+        """
+        The number of lines read for each line type
+        """
+        return self._classifier.counts
+
+    @property
+    def event_source(self):
+        """
+        The event source (catalogue header) in effect
+        """
+        return self.context['current_event_source']
+
+    @property
+    def started(self):
+        """
+        True if the catalogue header has been read, i.e. if origin
+        and measure blocks are expected
+        """
+        return not self._state.is_start()
+
+    def reset(self):
+        """
+        Reset the FSM to its initial state, so that the lines up to
+        the next event header are rejected
+        """
+        self._state = self._initial
+
+    def feed(self, line_num, line):
+        """
+        Parse `line` (found at `line_num`) and returns its line_type.
+
+        :raises ParsingFailure: if the line is not expected in the
+          current state. The FSM is reset to its initial state.
+        """
+        line = line.strip()
+
+        # line_type acts as "event" in the traditional fsm jargon.
+        # Here we use line_type do not confuse with seismic event
+        started = time.time()
+        line_type = self._classifier.classify(
+            line, not self._state.is_start())
+        if self._metrics is not None:
+            self._metrics.times['classify'] += time.time() - started
+
+        # skip comments and exit condition
+        if line_type == "comment" or line_type == "stop":
+            return line_type
+
+        try:
+            next_state = self._state.transition_rule(line_type)
+            self._state = next_state
+            next_state.process_line(line)
+        except (UnexpectedLine, ValueError):
+            current = self._state
+            if (current.is_start() and line_type == 'junk' and
+                    self.allow_junk):
+                return line_type
+            LOG.warn('Unexpected line at linenum %d' % line_num)
+            self._state = self._initial
+            self.error_line_type = line_type
+            raise ParsingFailure(ERR_MSG % line_num)
+        return line_type
+
+    def feed_record(self, line_num, line_type, record):
+        """
+        Like :meth:`feed`, for an origin or measure block (as given
+        by `line_type`) at `line_num` already decoded into `record`.
+        """
+        self._classifier.counts[line_type] += 1
+        try:
+            self._state = self._state.transition_rule(line_type)
+        except UnexpectedLine:
+            LOG.warn('Unexpected line at linenum %d' % line_num)
+            self._state = self._initial
+            self.error_line_type = line_type
+            raise ParsingFailure(ERR_MSG % line_num)
+        self._state.process_record(record)
+        return line_type
+
+
+def shard_bulletin(filename, chunk_size, start=0, line_num=1,
+                   event_source=None):
+    """
+    Split the bulletin stored in `filename` into chunks of about
+    `chunk_size` bytes, each one (but the first) starting at an event
+    header line. Reading starts at byte `start`, that is the beginning
+    of the line `line_num`, with `event_source` as the current event
+    source, and stops at the STOP line.
+
+    :returns: an iterator over tuples (start offset, end offset, line
+      number of the first line, event source in effect at the start)
+    """
+    start_line_num, start_event_source = line_num, event_source
+    offset = start
+    with open(filename, 'rb') as stream:
+        stream.seek(start)
+        for line_num, line in enumerate(stream, start=line_num):
+            if (line.startswith('Event') and offset - start >= chunk_size
+                    and EVENT_REGEXP.match(line.strip())):
+                yield start, offset, start_line_num, start_event_source
+                start, start_line_num = offset, line_num
+                start_event_source = event_source
+            offset += len(line)
+            if line.startswith('ISC') or line.startswith('STOP'):
+                stripped = line.strip()
+                if stripped == 'STOP':
+                    break
+                elif LineClassifier.EXACT_LINES.get(stripped):
+                    event_source = stripped
+    yield start, offset, start_line_num, start_event_source
+
+
+def parse_chunk(filename, start, end, line_num, event_source,
+                allow_junk=True):
+    """
+    Parse the lines of the bulletin stored in `filename` between the
+    byte offsets `start` and `end`. The first line is numbered
+    `line_num`. It does not need a catalogue db, so it can be run in
+    a worker process. When a line can not be parsed, the measures of
+    the event block holding it are discarded.
+
+    :returns: a tuple with the list of the parsed measure rows, the
+      list of the line numbers and line types of the lines that could
+      not be parsed,
+      the count of lines for each line type, the number of the last
+      line read, the event source in effect at the end of the chunk
+      and the list of the event blocks, as tuples (index of their
+      first row, line number of their header)
+    """
+    with open(filename, 'rb') as stream:
+        stream.seek(start)
+        lines = stream.read(end - start).split('\n')
+    if lines and not lines[-1]:
+        lines.pop()
+
+    rows = RowBuffer()
+    parser = BulletinParser(rows, allow_junk, event_source)
+    errors = []
+    events = []
+    event_start = 0
+    last_line_num = line_num - 1
+    for last_line_num, line in enumerate(lines, start=line_num):
+        try:
+            line_type = parser.feed(last_line_num, line)
+        except ParsingFailure:
+            errors.append((last_line_num, parser.error_line_type))
+            del rows[event_start:]
+            continue
+        if line_type == 'event_header':
+            event_start = len(rows)
+            events.append((event_start, last_line_num))
+        elif line_type == 'stop':
+            break
+    return (list(rows), errors, dict(parser.counts), last_line_num,
+            parser.event_source, events)
+
+
+def _parse_chunk(args):
+    """
+    Unpack `args` and call :func:`parse_chunk` (used by the process
+    pool)
+    """
+    return parse_chunk(*args)
+
+
+def validate_chunk(filename, start, end, line_num, event_source,
+                   allow_junk=True):
+    """
+    Parse a chunk of the bulletin stored in `filename` (s.
+    :func:`parse_chunk`) and returns its
+    :class:`~eqcatalogue.importers.validation.ValidationReport`, so
+    that a worker process does not send back the parsed rows
+    """
+    rows, errors, _, last_line_num, _, _ = parse_chunk(
+        filename, start, end, line_num, event_source, allow_junk)
+    report = ValidationReport(filename)
+    report.add_rows(rows)
+    for error_line_num, _ in errors:
+        report.add_failure(ERR_MSG % error_line_num)
+    report.lines = last_line_num - line_num + 1
+    report.bytes = end - start
+    return report
+
+
+def _validate_chunk(args):
+    """
+    Unpack `args` and call :func:`validate_chunk` (used by the
+    process pool)
+    """
+    return validate_chunk(*args)
+
+
+def parse_bulletin(lines, batch_size, allow_junk=True):
+    """
+    Parse the `lines` of a bulletin. Like :func:`parse_chunk`, it does
+    not need a catalogue db and the measures of an event block holding
+    a line that can not be parsed are discarded.
+
+    :returns: an iterator over tuples (measure rows, line numbers and
+      line types of the lines that could not be parsed, number of
+      lines read, number of bytes read). A tuple is yielded at the
+      first event header following `batch_size` measures and at the
+      end of the bulletin, so batches hold whole event blocks.
+    """
+    rows = RowBuffer()
+    parser = BulletinParser(rows, allow_junk)
+    errors = []
+    event_start = 0
+    line_count, byte_count = 0, 0
+    for line_num, line in enumerate(lines, start=1):
+        line_count += 1
+        byte_count += len(line)
+        try:
+            line_type = parser.feed(line_num, line)
+        except ParsingFailure:
+            errors.append((line_num, parser.error_line_type))
+            del rows[event_start:]
+            continue
+        if line_type == 'event_header':
+            if event_start >= batch_size:
+                yield rows[:event_start], errors, line_count, byte_count
+                del rows[:event_start]
+                errors, line_count, byte_count = [], 0, 0
+            event_start = len(rows)
+        elif line_type == 'stop':
+            break
+    yield list(rows), errors, line_count, byte_count
+
+
+def _bulletin_file(stream):
+    """
+    Returns the name of the file read by `stream` if it is an
+    uncompressed file stored on disk (that can be split into chunks
+    or memory-mapped), None otherwise
+    """
+    filename = getattr(stream, 'name', None)
+    if (filename and os.path.isfile(filename)
+            and detect_codec(filename) is None):
+        return filename
+    return None
+
+
 class Importer(BaseImporter):
     """
     Import data into a CatalogueDatabase from stream objects.
@@ -376,6 +744,14 @@ class Importer(BaseImporter):
     links" is unchecked
     """
 
+    DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+    PARSING_ERROR = ERR_MSG
+
+    # number of bytes whose records are decoded at once in
+    # memory-mapped mode
+    RECORDS_WINDOW_SIZE = BulletinRecords.WINDOW_SIZE
+
     def __init__(self, stream, cat):
         """
         Initialize the importer.
@@ -388,108 +764,376 @@ class Importer(BaseImporter):
           The catalogue database used to import the data
         :type cat: CatalogueDatabase
         """
-        super(self.__class__, self).__init__(stream, cat)
-        # we save the initial state, because it also acts like a
-        # rollback state
-        self._initial = StartState()
-        self._state = None
-        self._transition(self._initial)
+        super(Importer, self).__init__(stream, cat)
+        self._parser = BulletinParser()
+        self._writer = None
+        # the line number of the header of the current event block
+        self._event_line_num = None
 
-    def store(self, allow_junk=True, on_line_read=None):
+    @classmethod
+    def parse_stream(cls, stream, batch_size, allow_junk=True):
+        """
+        Parse the bulletin `stream` without a catalogue db (s.
+        :func:`parse_bulletin`)
+        """
+        return parse_bulletin(stream, batch_size, allow_junk)
+
+    @classmethod
+    def validate(cls, stream, batch_size=None, allow_junk=True,
+                 processes=None, chunk_size=None):
+        """
+        Validate the bulletin `stream` without a catalogue db (s.
+        :meth:`BaseImporter.validate`). If `processes` is greater than
+        one and the stream is an uncompressed file stored on disk, its
+        chunks of about `chunk_size` bytes are parsed by a pool of
+        `processes` worker processes, as in :meth:`store`: each worker
+        reports only the failures and the distinct entities of its
+        chunk and at most two chunks per worker are pending at a time.
+        """
+        filename = _bulletin_file(stream)
+        if (processes or 1) <= 1 or filename is None:
+            return super(Importer, cls).validate(stream, batch_size,
+                                                 allow_junk=allow_junk)
+
+        report = ValidationReport(filename)
+        pool = multiprocessing.Pool(processes)
+        pending = collections.deque()
+        try:
+            for chunk in shard_bulletin(filename,
+                                        chunk_size or cls.DEFAULT_CHUNK_SIZE):
+                pending.append(pool.apply_async(
+                    _validate_chunk, ((filename,) + chunk + (allow_junk,),)))
+                if len(pending) >= 2 * processes:
+                    report.merge(pending.popleft().get())
+            while pending:
+                report.merge(pending.popleft().get())
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+        return report
+
+    def store(self, allow_junk=True, on_line_read=None,
+              flush_size=None, commit_interval=None,
+              processes=None, chunk_size=None, resume=False,
+              memory_map=False, on_metrics=None, append=False):
         """
         Read and parse from the input stream the data and insert them
         into the catalogue db. If `allow_junk` is True, it allows
-        unexpected line inputs at the beginning of the file
+        unexpected line inputs at the beginning of the file.
+
+        Measures are buffered and written `flush_size` at a time, the
+        transaction is committed at the first event header after
+        `commit_interval` measures (s.
+        :class:`~eqcatalogue.importers.writer.MeasureWriter`). Each
+        commit records a checkpoint in the import journal: if
+        `resume` is True, the import of a file already partially
+        imported continues from its last checkpoint.
+
+        If `processes` is greater than one and the stream is an
+        uncompressed file stored on disk, the bulletin is split at
+        event header lines into chunks of about `chunk_size` bytes
+        that are parsed by a pool of `processes` worker processes,
+        while the current
+        process writes the parsed measures. As in the sequential mode,
+        a line that can not be parsed or a measure violating a
+        constraint discards only the measures of its event.
+
+        If `memory_map` is True and the stream is an uncompressed file
+        stored on disk, the file is memory-mapped and its origin and
+        measure blocks are decoded in bulk (s.
+        :mod:`eqcatalogue.importers.isf_records`).
+
+        If `append` is True, the measures already stored are skipped
+        and the changed ones are replaced.
+
+        The throughput of the import is measured in `self.metrics`;
+        `on_metrics` is called with it at each commit and at the end
+        of the import.
         """
-        for line_num, line in enumerate(self._file_stream, start=1):
+        self.metrics.start(on_metrics)
+        self._writer = MeasureWriter(self._catalogue,
+                                     flush_size=flush_size,
+                                     commit_interval=commit_interval,
+                                     metrics=self.metrics, append=append,
+                                     on_discarded=self._event_discarded)
+
+        journal = self._open_journal(resume)
+        offset, line_num, event_source = 0, 0, None
+        if journal is not None:
+            if journal.completed:
+                LOG.info('%s has already been imported', journal.filename)
+                self.metrics.stop()
+                return
+            offset, line_num = journal.offset, journal.line_num
+            event_source = journal.event_source
+        self._parser = BulletinParser(self._writer, allow_junk, event_source,
+                                      self.metrics)
+
+        filename = _bulletin_file(self._file_stream)
+        on_disk = filename is not None
+        if (processes or 1) > 1 and on_disk:
+            self._store_parallel(filename, processes, allow_junk,
+                                 on_line_read,
+                                 chunk_size or self.DEFAULT_CHUNK_SIZE,
+                                 offset, line_num)
+            return
+        if memory_map and on_disk:
+            self._store_records(filename, on_line_read, offset, line_num)
+            return
+
+        if offset:
+            self._file_stream.seek(offset)
+        for line_num, line in enumerate(self._file_stream,
+                                        start=line_num + 1):
             if on_line_read is not None:
                 on_line_read(self, line_num)
-            line = line.strip()
+            try:
+                line_type = self._parser.feed(line_num, line)
+            except IntegrityError:
+                self._integrity_error(line_num)
+                line_type = None
+            except ParsingFailure:
+                self._add_error(line_num)
+                line_type = None
+            if line_type == 'event_header':
+                self._next_event(offset, line_num)
+            offset += len(line)
+            self.metrics.lines += 1
+            self.metrics.bytes += len(line)
+            if line_type == "stop":
+                break
+            if line_num % LOG_INTERVAL == 0:
+                LOG.info('%dk lines processed' % (line_num / 1000))
+        self._complete(offset, line_num)
 
-            # line_type acts as "event" in the traditional fsm jargon.
-            # Here we use line_type do not confuse with seismic event
-            line_type = self._detect_line_type(line)
+    def _store_records(self, filename, on_line_read, offset, line_num):
+        """
+        Parse the memory-mapped bulletin `filename`, starting after
+        `line_num` lines (i.e. at byte `offset`). The origin and
+        measure blocks are decoded a window of about
+        `RECORDS_WINDOW_SIZE` bytes at a time; the other lines (and
+        the blocks that do not strictly follow the fixed-width layout)
+        are parsed one by one.
+        """
+        parser = self._parser
+        line_types = {ORIGIN_RECORD: 'origin_block',
+                      MEASURE_RECORD: 'measure_block'}
+        decoders = ((ORIGIN_RECORD, ORIGIN_RECORD_DTYPE, decode_origins),
+                    (MEASURE_RECORD, MEASURE_RECORD_DTYPE, decode_measures))
+        with BulletinRecords(filename) as bulletin:
+            stopped = False
+            for window in bulletin.windows(offset, self.RECORDS_WINDOW_SIZE):
+                records = {}
+                for kind, dtype, decode in decoders:
+                    indices = np.flatnonzero(window.kinds == kind)
+                    records[kind] = iter(
+                        decode(window.records(indices, dtype)))
+
+                for index, kind in enumerate(window.kinds.tolist()):
+                    line_num += 1
+                    if on_line_read is not None:
+                        on_line_read(self, line_num)
+                    record = next(records[kind]) if kind else None
+                    try:
+                        if record is not None and parser.started:
+                            line_type = parser.feed_record(
+                                line_num, line_types[kind], record)
+                        else:
+                            line_type = parser.feed(
+                                line_num, window.line(index))
+                    except IntegrityError:
+                        self._integrity_error(line_num)
+                        line_type = None
+                    except ParsingFailure:
+                        self._add_error(line_num)
+                        line_type = None
+                    if line_type == 'event_header':
+                        self._next_event(int(window.starts[index]),
+                                         line_num)
+                    line_end = min(int(window.ends[index]) + 1,
+                                   len(bulletin))
+                    self.metrics.lines += 1
+                    self.metrics.bytes += line_end - offset
+                    offset = line_end
+                    if line_type == "stop":
+                        stopped = True
+                        break
+                    if line_num % LOG_INTERVAL == 0:
+                        LOG.info('%dk lines processed' % (line_num / 1000))
+                if stopped:
+                    break
+        self._complete(offset, line_num)
+
+    def _store_parallel(self, filename, processes, allow_junk,
+                        on_line_read, chunk_size, offset, line_num):
+        """
+        Parse the chunks of `filename` (starting at byte `offset`,
+        after `line_num` lines) in a pool of `processes` workers and
+        write the resulting measures in the order they appear in the
+        file. At most two chunks per worker are pending at a time, so
+        memory stays bounded.
+        """
+        pool = multiprocessing.Pool(processes)
+        pending = collections.deque()
+        try:
+            for chunk in shard_bulletin(filename, chunk_size, offset,
+                                        line_num + 1,
+                                        self._parser.event_source):
+                pending.append((chunk, pool.apply_async(
+                    _parse_chunk, ((filename,) + chunk + (allow_junk,),))))
+                if len(pending) >= 2 * processes:
+                    offset, line_num = self._write_chunk(
+                        pending.popleft(), on_line_read)
+            while pending:
+                offset, line_num = self._write_chunk(
+                    pending.popleft(), on_line_read)
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+        self._complete(offset, line_num)
 
-            # skip comments and exit condition
-            if line_type == "comment":
-                continue
-            elif line_type == "stop":
-                break
+    def _write_chunk(self, pending, on_line_read):
+        """
+        Write the measures of a parsed chunk, one event block at a
+        time, and collect its errors. As in the sequential mode, an
+        integrity error discards only the measures of the event being
+        written. Returns the byte offset of the end of the chunk and
+        the number of its last line.
+        """
+        chunk, result = pending
+        rows, errors, counts, line_num, event_source, events = result.get()
+        for error_line_num, line_type in errors:
+            self.errors.append(ParsingFailure(ERR_MSG % error_line_num))
+            self.metrics.add_error(line_type)
+        self._parser.counts.update(counts)
+        self.metrics.lines += line_num - chunk[2] + 1
+        self.metrics.bytes += chunk[1] - chunk[0]
+        if not events or events[0][0]:
+            # the rows preceding the first event header of the chunk
+            events.insert(0, (0, chunk[2]))
+        ends = [start for start, _ in events[1:]] + [len(rows)]
+        last_lines = [header - 1 for _, header in events[1:]] + [line_num]
+        for (start, header), end, last_line in zip(events, ends,
+                                                   last_lines):
+            self._start_event(header)
+            try:
+                for row in rows[start:end]:
+                    self._writer.add(row)
+            except IntegrityError:
+                self._integrity_error(last_line)
+        try:
+            if self._writer.commit_due:
+                self._checkpoint(chunk[1], line_num, event_source)
+        except IntegrityError:
+            self._integrity_error(line_num)
+            self._checkpoint(chunk[1], line_num, event_source)
+        if on_line_read is not None:
+            on_line_read(self, line_num)
+        LOG.info('%dk lines processed' % (line_num / 1000))
+        return chunk[1], line_num
+
+    def _complete(self, offset, line_num):
+        """
+        Write the pending measures, mark the import as completed and
+        commit
+        """
+        try:
+            self._checkpoint(offset, line_num, self._parser.event_source,
+                             completed=True)
+        except IntegrityError:
+            self._integrity_error(line_num)
+            self._checkpoint(offset, line_num, self._parser.event_source,
+                             completed=True)
+
+    def _start_event(self, line_num):
+        """
+        Start the event block whose header is at `line_num`
+        """
+        self._writer.start_event(line_num)
+        self._event_line_num = line_num
 
+    def _next_event(self, offset, line_num):
+        """
+        Start the event block whose header, at byte `offset`, has been
+        parsed at `line_num`. The previous event is closed first, so
+        that if its measures violate a constraint only they are
+        discarded and the parser state is kept. Then, if a commit is
+        due, the measures of the previous events are committed and the
+        import can be resumed at the header.
+        """
+        self._start_event(line_num)
+        if self._writer.commit_due:
             try:
-                next_state = self._state.transition_rule(line_type)
-                self._transition(next_state)
-                next_state.process_line(line)
-                if line_num % 250000 == 0:
-                    LOG.info('%dk lines processed' % (line_num / 1000))
-                    self._catalogue.session.commit()
+                self._checkpoint(offset, line_num - 1,
+                                 self._parser.event_source)
             except IntegrityError:
-                # we can not skip an integrity error
-                LOG.warn('Measure already present. linenum %d' % line_num)
                 raise self._parsing_error(line_num)
-            except (UnexpectedLine, ValueError):
-                current = self._state
-                if current.is_start() and line_type == 'junk' and allow_junk:
-                    continue
-                else:
-                    LOG.warn('Unexpected line at linenum %d' % line_num)
-                    self.errors.append(self._parsing_error(line_num))
-                    self._state = self._initial
-        self._catalogue.session.commit()
+
+    def _event_discarded(self, line_num, _):
+        """
+        Record the integrity error of the closed event block whose
+        header is at `line_num`, whose measures have been discarded by
+        the writer
+        """
+        self.errors.append(ParsingFailure(ERR_MSG % line_num))
+        self.metrics.add_error('integrity')
+
+    def _discard_event(self, line_num):
+        """
+        Discard the measures of the event block being parsed at
+        `line_num`, keeping the uncommitted measures of the previous
+        events. Returns False if they can not be discarded alone.
+        """
+        if not self._writer.discard_event():
+            return False
+        LOG.warn('Discarded the measures of the event at lines %d-%d' % (
+            self._event_line_num, line_num))
+        return True
+
+    def _integrity_error(self, line_num):
+        """
+        Handle an integrity error raised while writing the measures
+        parsed up to `line_num`. If only the measures of the current
+        event are involved, they are discarded and the error is
+        recorded. Otherwise, as the measures of the previous events
+        can not be skipped, it issues a rollback and raises a
+        ParsingFailure.
+        """
+        LOG.warn('Measure already present. linenum %d' % line_num)
+        if not self._discard_event(line_num):
+            raise self._parsing_error(line_num)
+        self._parser.reset()
+        self.errors.append(ParsingFailure(ERR_MSG % line_num))
+        self.metrics.add_error('integrity')
+
+    def _add_error(self, line_num):
+        """
+        Record the parsing error found at `line_num` and discard the
+        measures of the event block holding it
+        """
+        self._discard_event(line_num)
+        self.errors.append(ParsingFailure(ERR_MSG % line_num))
+        self.metrics.add_error(self._parser.error_line_type)
 
     def _parsing_error(self, line_num):
         """
         Issue a rollback and return a parsing error exception
         """
-        self._catalogue.session.rollback()
+        self._writer.rollback()
         return ParsingFailure(ERR_MSG % line_num)
 
-    def _detect_line_type(self, line):
-        """
-        Given the current `line` detect and returns its line_type
-        """
-        origin_fields = ["Date", "Time", "Err", "RMS", "Latitude", "Longitude",
-                         "Smaj", "Smin", "Az", "Depth", "Err", "Ndef",
-                         "Nst[a]*", "Gap", "mdist", "Mdist", "Qual", "Author",
-                         "OrigID"]
-        origin_regexp = re.compile('^%s$' % r'\s+'.join(origin_fields))
-
-        measure_fields = ["Magnitude", "Err", "Nsta", "Author", "OrigID"]
-        measure_regexp = re.compile('^%s$' % r'\s+'.join(measure_fields))
-
-        comment_regexp = re.compile(r'^\([^\)].+\)')
-
-        if line == 'ISC Bulletin':
-            line_type = "catalogue_header"
-        elif line == 'STOP':
-            line_type = 'stop'
-        elif comment_regexp.match(line) or not line.strip():
-            line_type = "comment"
-        elif origin_regexp.match(line):
-            line_type = "origin_header"
-        elif measure_regexp.match(line):
-            line_type = "measure_header"
-        elif EventState.match(line):
-            line_type = "event_header"
-        elif len(line) == 136 and not self._state.is_start():
-            line_type = "origin_block"
-        elif len(line) == 38 and not self._state.is_start():
-            line_type = "measure_block"
-        elif MeasureUKScaleBlockState.match(line):
-            line_type = "measure_unknown_scale_block"
-        else:
-            line_type = "junk"
-
-        return line_type
-
-    def _transition(self, next_state):
+    @property
+    def line_counts(self):
         """
-        Perform the transition to `next_state` by saving it and
-        initializing the new state
+        Returns a dictionary with the number of lines read for each
+        line type
         """
-        self._state = next_state
-        if self._state.context is None:
-            self._state.context = dict(origins={},
-                                       current_event=None,
-                                       current_event_source=None)
-        self._state.setup(self._catalogue)
+        return dict(self._parser.counts)
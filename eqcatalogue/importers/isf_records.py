@@ -0,0 +1,427 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# eqcataloguetool is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EqCatalogueTool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with eqcataloguetool. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Module :mod:`eqcatalogue.importers.isf_records` reads the fixed-width
+origin and measure records of an ISF bulletin in bulk.
+
+The bulletin is memory-mapped and viewed as a NumPy byte array, read
+a window of whole lines at a time: line boundaries are found without
+creating a string object for each line, and the records are decoded
+a window at a time into NumPy structured arrays, so the memory used
+does not depend on the size of the bulletin. Records that do not
+strictly follow the fixed-width layout are not decoded here, so that
+the caller can parse them line by line.
+"""
+
+import os
+import mmap
+
+import numpy as np
+
+from eqcatalogue.importers.dates import compose_times
+from eqcatalogue.importers.writer import position_wkt
+
+
+ORIGIN_BLOCK_LENGTH = 136
+MEASURE_BLOCK_LENGTH = 38
+
+# record kinds of `BulletinRecords.kinds`
+OTHER_LINE, ORIGIN_RECORD, MEASURE_RECORD = 0, 1, 2
+
+# the byte layout of an origin record (a stripped origin block line)
+ORIGIN_RECORD_DTYPE = np.dtype({
+    'names': ['year', 'month', 'day', 'hour', 'minute', 'second',
+              'hundredths', 'time_fixed', 'time_error', 'time_rms',
+              'latitude', 'longitude', 'position_fixed',
+              'semi_major_90error', 'semi_minor_90error', 'depth',
+              'depth_fixed', 'depth_error', 'azimuth_error', 'key'],
+    'formats': ['S4', 'S2', 'S2', 'S2', 'S2', 'S2',
+                'S2', 'S1', 'S5', 'S5',
+                'S8', 'S9', 'S1',
+                'S5', 'S5', 'S5',
+                'S1', 'S4', 'S3', 'S8'],
+    'offsets': [0, 5, 8, 11, 14, 17,
+                20, 22, 24, 30,
+                36, 45, 54,
+                55, 61, 71,
+                76, 78, 93, 128],
+    'itemsize': ORIGIN_BLOCK_LENGTH})
+
+# the separators expected in the time fields of an origin record
+ORIGIN_SEPARATORS = ((4, '/'), (7, '/'), (13, ':'), (16, ':'))
+
+# the byte layout of a measure record (a stripped measure block line)
+MEASURE_RECORD_DTYPE = np.dtype({
+    'names': ['scale', 'minmax', 'value', 'standard_error',
+              'agency', 'key'],
+    'formats': ['S5', 'S1', 'S5', 'S3', 'S10', 'S8'],
+    'offsets': [0, 5, 6, 11, 19, 30],
+    'itemsize': MEASURE_BLOCK_LENGTH})
+
+# the prefixes of the lines (comments, headers and event lines) that
+# can not be recognized by their length
+AMBIGUOUS_PREFIXES = ('(', 'Date', 'Event', 'Magnitude')
+
+# bytes stripped by str.strip
+WHITESPACE = np.zeros(256, dtype=bool)
+WHITESPACE[[ord(c) for c in ' \t\n\r\x0b\x0c']] = True
+
+
+def line_bounds(buf):
+    """
+    Given a byte array `buf`, returns the arrays of the start and end
+    offsets of its lines (without the newline character)
+    """
+    newlines = np.flatnonzero(buf == ord('\n'))
+    starts = np.concatenate([[0], newlines + 1])
+    ends = np.concatenate([newlines, [len(buf)]])
+    if starts[-1] == len(buf):
+        # the file ends with a newline
+        starts, ends = starts[:-1], ends[:-1]
+    return starts, ends
+
+
+def strip_bounds(buf, starts, ends):
+    """
+    Returns the start and end offsets of the lines bounded by
+    `starts` and `ends` once stripped of leading and trailing
+    whitespace
+    """
+    first, last = starts.copy(), ends.copy()
+    pending = np.flatnonzero(first < last)
+    while len(pending):
+        pending = pending[WHITESPACE[buf[first[pending]]]]
+        first[pending] += 1
+        pending = pending[first[pending] < last[pending]]
+    pending = np.flatnonzero(first < last)
+    while len(pending):
+        pending = pending[WHITESPACE[buf[last[pending] - 1]]]
+        last[pending] -= 1
+        pending = pending[first[pending] < last[pending]]
+    return first, last
+
+
+def _bytes(field):
+    """
+    Returns the 2d byte array holding the string array `field`
+    """
+    field = np.ascontiguousarray(field)
+    return field.view(np.uint8).reshape(len(field), -1)
+
+
+def _blank(field):
+    """
+    Returns a boolean mask of the elements of the string array
+    `field` made only of whitespace
+    """
+    return WHITESPACE[_bytes(field)].all(axis=1)
+
+
+def _to_float(field, blank):
+    """
+    Convert the string array `field` to floats, with NaN where
+    `blank`. Returns the values and a mask of the invalid elements.
+    """
+    field = np.where(blank, 'nan', field)
+    try:
+        return field.astype(float), np.zeros(len(field), dtype=bool)
+    except ValueError:
+        values = np.empty(len(field))
+        invalid = np.zeros(len(field), dtype=bool)
+        for i, item in enumerate(field.tolist()):
+            try:
+                values[i] = float(item)
+            except ValueError:
+                invalid[i] = True
+        return values, invalid
+
+
+def _to_int(field):
+    """
+    Convert the string array `field` made of digits to integers.
+    Returns the values and a mask of the elements with non digit
+    characters.
+    """
+    digits = _bytes(field).astype(int) - 48
+    invalid = ((digits < 0) | (digits > 9)).any(axis=1)
+    powers = 10 ** np.arange(digits.shape[1] - 1, -1, -1)
+    return digits.dot(powers), invalid
+
+
+def _to_optional_int(field):
+    """
+    Convert the string array `field` to a list of integers, with None
+    where the field is blank. Returns the list and a mask of the
+    invalid elements.
+    """
+    values = []
+    invalid = np.zeros(len(field), dtype=bool)
+    for i, item in enumerate(field.tolist()):
+        if not item.strip():
+            values.append(None)
+            continue
+        try:
+            values.append(int(item))
+        except ValueError:
+            values.append(None)
+            invalid[i] = True
+    return values, invalid
+
+
+def _optional(values):
+    """
+    Returns the list of the python values of the array `values`, with
+    None in place of NaN
+    """
+    return [None if value != value else value for value in values.tolist()]
+
+
+def decode_times(records):
+    """
+    Decode the origin times of the origin `records`. Returns an array
+    of datetime64 and a mask of the records whose time can not be
+    decoded in bulk.
+
+    As in :meth:`OriginBlockState._process_time
+    <eqcatalogue.importers.isf_bulletin.OriginBlockState._process_time>`
+    the hundredths of second field is taken as a number of
+    microseconds.
+    """
+    raw = records.view(np.uint8).reshape(len(records), -1)
+    invalid = np.zeros(len(records), dtype=bool)
+    for offset, separator in ORIGIN_SEPARATORS:
+        invalid |= raw[:, offset] != ord(separator)
+
+    components = {}
+    for name in ('year', 'month', 'day', 'hour', 'minute', 'second'):
+        components[name], bad = _to_int(records[name])
+        invalid |= bad
+    hundredths = records['hundredths']
+    no_hundredths = _blank(hundredths)
+    components['hundredths'], bad = _to_int(
+        np.where(no_hundredths, '00', hundredths).astype('S2'))
+    invalid |= bad
+
+    invalid |= components['second'] > 59
+    times, bad = compose_times(
+        components['year'], components['month'], components['day'],
+        components['hour'], components['minute'],
+        components['second'] * 1000000 + components['hundredths'])
+    return times, invalid | bad
+
+
+def decode_origins(records):
+    """
+    Decode the origin `records` (a structured array with dtype
+    `ORIGIN_RECORD_DTYPE`). Returns a list holding, for each record,
+    a tuple (origin key, origin) where origin is ordered as
+    :data:`eqcatalogue.importers.writer.ORIGIN_FIELDS`, or None if the
+    record can not be decoded in bulk.
+    """
+    if not len(records):
+        return []
+    times, invalid = decode_times(records)
+
+    columns = {}
+    for name in ('time_error', 'time_rms', 'latitude', 'longitude',
+                 'semi_major_90error', 'semi_minor_90error',
+                 'depth', 'depth_error'):
+        blank = _blank(records[name])
+        if name in ('latitude', 'longitude'):
+            # a position is always required
+            invalid |= blank
+        columns[name], bad = _to_float(records[name], blank)
+        invalid |= bad
+
+    time_fixed = records['time_fixed'] == 'f'
+    position_fixed = records['position_fixed'] == 'f'
+    depth_fixed = records['depth_fixed'] == 'f'
+    columns['time_error'][time_fixed] = np.nan
+    columns['semi_major_90error'][position_fixed] = np.nan
+    columns['semi_minor_90error'][position_fixed] = np.nan
+    columns['depth_error'][depth_fixed] = np.nan
+    azimuth_errors, bad = _to_optional_int(records['azimuth_error'])
+    invalid |= bad
+
+    positions = [position_wkt(latitude, longitude) for latitude, longitude
+                 in zip(columns['latitude'].tolist(),
+                        columns['longitude'].tolist())]
+    origins = zip(times.astype(object).tolist(),
+                  _optional(columns['time_error']),
+                  _optional(columns['time_rms']),
+                  _optional(columns['semi_major_90error']),
+                  _optional(columns['semi_minor_90error']),
+                  positions,
+                  _optional(columns['depth']),
+                  _optional(columns['depth_error']),
+                  azimuth_errors)
+    keys = [key.strip() for key in records['key'].tolist()]
+    return [None if bad else (key, origin)
+            for bad, key, origin in zip(invalid.tolist(), keys, origins)]
+
+
+def decode_measures(records):
+    """
+    Decode the measure `records` (a structured array with dtype
+    `MEASURE_RECORD_DTYPE`). Returns a list holding, for each record,
+    a tuple (agency, scale, value, standard error, origin key), or
+    None if the record can not be decoded in bulk.
+    """
+    if not len(records):
+        return []
+    invalid = ~_blank(records['minmax'])
+    value_blank = _blank(records['value'])
+    invalid |= value_blank
+    values, bad = _to_float(records['value'], value_blank)
+    invalid |= bad
+    errors, bad = _to_float(records['standard_error'],
+                            _blank(records['standard_error']))
+    invalid |= bad
+
+    measures = zip([agency.strip()
+                    for agency in records['agency'].tolist()],
+                   [scale.strip() for scale in records['scale'].tolist()],
+                   values.tolist(),
+                   _optional(errors),
+                   [key.strip() for key in records['key'].tolist()])
+    return [None if bad else measure
+            for bad, measure in zip(invalid.tolist(), measures)]
+
+
+class RecordWindow(object):
+    """
+    A window of whole lines of a memory-mapped bulletin (s.
+    :meth:`BulletinRecords.windows`), between the byte offsets
+    `start` and `end`.
+
+    It exposes the offsets in the bulletin of its lines (`starts` and
+    `ends`), the offsets of the stripped lines (`first` and `last`)
+    and the kind of each line (`kinds`): origin and measure records
+    are recognized by their length; lines that may be headers or
+    comments are left to the line classifier.
+    """
+
+    def __init__(self, bulletin, start, end):
+        self._bulletin = bulletin
+        self.buffer = bulletin.buffer
+        starts, ends = line_bounds(self.buffer[start:end])
+        self.starts, self.ends = starts + start, ends + start
+        self.first, self.last = strip_bounds(
+            self.buffer, self.starts, self.ends)
+        self.kinds = self._detect_kinds()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _detect_kinds(self):
+        """
+        Returns the array with the kind of each line
+        """
+        lengths = self.last - self.first
+        kinds = np.zeros(len(lengths), dtype=np.int8)
+        kinds[lengths == ORIGIN_BLOCK_LENGTH] = ORIGIN_RECORD
+        kinds[lengths == MEASURE_BLOCK_LENGTH] = MEASURE_RECORD
+
+        # lines that may be comments, headers or event lines are
+        # classified line by line
+        candidates = np.flatnonzero(kinds)
+        for prefix in AMBIGUOUS_PREFIXES:
+            ambiguous = candidates[np.all([
+                self.buffer[self.first[candidates] + i] == ord(char)
+                for i, char in enumerate(prefix)], axis=0)]
+            kinds[ambiguous] = OTHER_LINE
+        return kinds
+
+    def line(self, index):
+        """
+        Returns the line at `index` (including its newline character)
+        """
+        return self._bulletin.text(self.starts[index], self.ends[index] + 1)
+
+    def records(self, indices, dtype):
+        """
+        Returns the structured array (of type `dtype`) of the
+        records stored in the lines at `indices`
+        """
+        offsets = (self.first[indices][:, None] +
+                   np.arange(dtype.itemsize)[None, :])
+        return self.buffer[offsets].view(dtype).reshape(len(indices))
+
+
+class BulletinRecords(object):
+    """
+    A memory-mapped ISF bulletin stored in `filename`, read a window
+    of about `WINDOW_SIZE` bytes at a time (s. :meth:`windows`)
+    """
+
+    WINDOW_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, filename):
+        self._file = open(filename, 'rb')
+        if os.path.getsize(filename):
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+            self.buffer = np.frombuffer(self._map, dtype=np.uint8)
+        else:
+            self._map = None
+            self.buffer = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def text(self, start, end):
+        """
+        Returns the bytes of the bulletin between the offsets `start`
+        and `end`
+        """
+        return self._map[start:end]
+
+    def windows(self, start=0, size=None):
+        """
+        Returns an iterator over the :class:`RecordWindow` objects of
+        the lines following the byte offset `start` (the beginning of
+        a line). A window holds about `size` bytes (`WINDOW_SIZE` by
+        default) and is cut at a newline, so it is longer only if a
+        line is.
+        """
+        size = size or self.WINDOW_SIZE
+        length = len(self.buffer)
+        while start < length:
+            end = start + size
+            if end < length:
+                cut = self._map.rfind('\n', start, end)
+                if cut < 0:
+                    cut = self._map.find('\n', end)
+                end = cut + 1 if cut >= 0 else length
+            else:
+                end = length
+            yield RecordWindow(self, start, end)
+            start = end
+
+    def close(self):
+        """
+        Release the memory map
+        """
+        self.buffer = None
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
@@ -0,0 +1,156 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# eqcataloguetool is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EqCatalogueTool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with eqcataloguetool. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Module :mod:`eqcatalogue.importers.journal` keeps track, in the
+catalogue db, of the progress of the import of a file, so that an
+interrupted import can be resumed from its last checkpoint.
+"""
+
+import os
+import hashlib
+from datetime import datetime
+
+from eqcatalogue.log import logger
+
+
+LOG = logger(__name__)
+
+# number of bytes read from the beginning of a file to compute its
+# fingerprint
+FINGERPRINT_SIZE = 1024 * 1024
+
+RUNNING = 'running'
+COMPLETED = 'completed'
+
+
+def fingerprint(filename):
+    """
+    Returns a fingerprint of the file `filename` built from its size
+    and the sha1 digest of its first `FINGERPRINT_SIZE` bytes
+    """
+    digest = hashlib.sha1(str(os.path.getsize(filename)))
+    with open(filename, 'rb') as stream:
+        digest.update(stream.read(FINGERPRINT_SIZE))
+    return digest.hexdigest()
+
+
+class ImportJournal(object):
+    """
+    The journal of the import of the file `filename` by `importer`.
+    The journal records the byte offset and the line number where the
+    import can be resumed, the event source in effect at that offset
+    and the number of measures written and errors found so far.
+
+    Checkpoints are written in the same transaction as the measures
+    they account for, so the journal is always consistent with the
+    data committed in the catalogue db.
+
+    :param cat: the catalogue database storing the journal
+    :param filename: the path of the imported file
+    :param importer: the name of the importer
+    """
+
+    def __init__(self, cat, filename, importer):
+        self._catalogue = cat
+        self.filename = filename
+        self.importer = importer
+        self.fingerprint = fingerprint(filename)
+        self.status = None
+        self.offset = 0
+        self.line_num = 0
+        self.event_source = None
+        self.measures = 0
+        self.errors = 0
+        # measures and errors accounted by the previous runs
+        self._base = (0, 0)
+
+    @property
+    def completed(self):
+        """
+        True if the import has been completed
+        """
+        return self.status == COMPLETED
+
+    def load(self):
+        """
+        Load the last checkpoint of the import. Returns False if the
+        file has never been imported by the importer.
+        """
+        row = self._catalogue.session.execute(
+            "SELECT status, byte_offset, line_num, event_source, "
+            "measures, errors FROM catalogue_importjournal "
+            "WHERE fingerprint = :fingerprint AND importer = :importer",
+            dict(fingerprint=self.fingerprint,
+                 importer=self.importer)).fetchone()
+        if row is None:
+            return False
+        (self.status, self.offset, self.line_num, self.event_source,
+         self.measures, self.errors) = row
+        self._base = (self.measures, self.errors)
+        LOG.info('Resuming import of %s at line %d (%d measures already '
+                 'imported)', self.filename, self.line_num, self.measures)
+        return True
+
+    def start(self):
+        """
+        Start a new journal for the import, discarding any previous
+        one, and commit it
+        """
+        session = self._catalogue.session
+        session.execute(
+            "DELETE FROM catalogue_importjournal "
+            "WHERE fingerprint = :fingerprint AND importer = :importer",
+            dict(fingerprint=self.fingerprint, importer=self.importer))
+        self.status = RUNNING
+        self.offset = self.line_num = self.measures = self.errors = 0
+        self.event_source = None
+        self._base = (0, 0)
+        session.execute(
+            "INSERT INTO catalogue_importjournal(fingerprint, importer, "
+            "filename, status, byte_offset, line_num, event_source, "
+            "measures, errors, updated_at) VALUES(:fingerprint, :importer, "
+            ":filename, :status, 0, 0, NULL, 0, 0, :updated_at)",
+            dict(fingerprint=self.fingerprint, importer=self.importer,
+                 filename=self.filename, status=self.status,
+                 updated_at=datetime.now()))
+        session.commit()
+
+    def checkpoint(self, offset, line_num, event_source, measures, errors,
+                   completed=False):
+        """
+        Record that the import can be resumed at byte `offset` (line
+        `line_num`) with `event_source` as the current event source,
+        and that `measures` measures have been written and `errors`
+        errors have been found by the current run of the import. The
+        caller is responsible for committing the transaction.
+        """
+        self.offset = offset
+        self.line_num = line_num
+        self.event_source = event_source
+        self.measures = self._base[0] + measures
+        self.errors = self._base[1] + errors
+        if completed:
+            self.status = COMPLETED
+        self._catalogue.session.execute(
+            "UPDATE catalogue_importjournal SET status = :status, "
+            "byte_offset = :offset, line_num = :line_num, "
+            "event_source = :event_source, measures = :measures, "
+            "errors = :errors, updated_at = :updated_at "
+            "WHERE fingerprint = :fingerprint AND importer = :importer",
+            dict(status=self.status, offset=offset, line_num=line_num,
+                 event_source=event_source, measures=self.measures,
+                 errors=self.errors, updated_at=datetime.now(),
+                 fingerprint=self.fingerprint, importer=self.importer))
@@ -0,0 +1,155 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# eqcataloguetool is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EqCatalogueTool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with eqcataloguetool. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Module :mod:`eqcatalogue.importers.metrics` defines the object used
+by the importers to measure their throughput.
+"""
+
+import time
+import collections
+
+
+class ImportMetrics(object):
+    """
+    Throughput metrics of an import. The importers update the number
+    of `lines`, `rows` and `bytes` processed while they run, so the
+    metrics can be read at any time (e.g. from the `on_line_read`
+    callback of the ISF importer).
+
+    The time spent by the import is split in phases: `classify`
+    (detection of the line types), `write` (insertion of the rows in
+    the catalogue db), `commit` and `parse` (everything else, i.e.
+    reading and decoding the input).
+
+    :param callback: a function called with the metrics at each
+      commit of the import and when the import ends
+    """
+
+    PHASES = ('parse', 'classify', 'write', 'commit')
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.lines = 0
+        self.rows = 0
+        self.bytes = 0
+        self.peak_batch = 0
+        self.errors = collections.Counter()
+        self.times = dict.fromkeys(self.PHASES[1:], 0.)
+        self.started = None
+        self.stopped = None
+
+    def start(self, callback=None):
+        """
+        Start measuring the import
+        """
+        if callback is not None:
+            self.callback = callback
+        self.started = time.time()
+        self.stopped = None
+
+    def stop(self):
+        """
+        Stop measuring the import and notify the final metrics
+        """
+        self.stopped = time.time()
+        self.notify()
+
+    def notify(self):
+        """
+        Call the callback (if any) with the current metrics
+        """
+        if self.callback is not None:
+            self.callback(self)
+
+    def add_time(self, phase, seconds):
+        """
+        Account `seconds` to `phase`
+        """
+        self.times[phase] += seconds
+
+    def add_batch(self, size):
+        """
+        Account a batch of `size` rows written
+        """
+        self.rows += size
+        self.peak_batch = max(self.peak_batch, size)
+
+    def add_error(self, line_type):
+        """
+        Account an error found on a line of type `line_type`
+        """
+        self.errors[line_type or 'unknown'] += 1
+
+    @property
+    def elapsed(self):
+        """
+        The seconds elapsed from the start of the import (to its end,
+        if it has ended)
+        """
+        if self.started is None:
+            return 0.
+        return (self.stopped or time.time()) - self.started
+
+    def phase_time(self, phase):
+        """
+        Returns the seconds spent in `phase`
+        """
+        if phase == 'parse':
+            return max(0., self.elapsed - sum(self.times.values()))
+        return self.times[phase]
+
+    def _rate(self, quantity):
+        elapsed = self.elapsed
+        return quantity / elapsed if elapsed else 0.
+
+    @property
+    def lines_per_second(self):
+        return self._rate(self.lines)
+
+    @property
+    def rows_per_second(self):
+        return self._rate(self.rows)
+
+    @property
+    def bytes_per_second(self):
+        return self._rate(self.bytes)
+
+    def report(self):
+        """
+        Returns a dictionary with the metrics of the import
+        """
+        return {'lines': self.lines,
+                'rows': self.rows,
+                'bytes': self.bytes,
+                'elapsed': self.elapsed,
+                'lines_per_second': self.lines_per_second,
+                'rows_per_second': self.rows_per_second,
+                'bytes_per_second': self.bytes_per_second,
+                'times': dict((phase, self.phase_time(phase))
+                              for phase in self.PHASES),
+                'errors': dict(self.errors),
+                'peak_batch': self.peak_batch}
+
+    def __str__(self):
+        return ('%d lines, %d rows, %d bytes in %.2fs '
+                '(%.0f lines/s, %.0f rows/s, %.0f bytes/s; %s; '
+                'peak batch %d; errors %s)' % (
+                    self.lines, self.rows, self.bytes, self.elapsed,
+                    self.lines_per_second, self.rows_per_second,
+                    self.bytes_per_second,
+                    ', '.join('%s %.2fs' % (phase, self.phase_time(phase))
+                              for phase in self.PHASES),
+                    self.peak_batch, dict(self.errors)))
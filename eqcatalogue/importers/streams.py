@@ -0,0 +1,213 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# eqcataloguetool is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EqCatalogueTool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with eqcataloguetool. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Module :mod:`eqcatalogue.importers.streams` opens the input files of
+the importers. Files compressed with gzip, bzip2 or xz are detected by
+their magic bytes and decompressed while they are read, optionally in
+a background thread pipelined with the parsing.
+"""
+
+import io
+import gzip
+import bz2
+import threading
+import Queue
+
+from eqcatalogue.log import logger
+
+
+LOG = logger(__name__)
+
+# size of the blocks read from a compressed file
+BLOCK_SIZE = 1024 * 1024
+
+# number of decompressed blocks a background reader can read ahead
+QUEUE_SIZE = 8
+
+GZIP = 'gzip'
+BZIP2 = 'bz2'
+XZ = 'xz'
+
+MAGIC_BYTES = ((GZIP, '\x1f\x8b'),
+               (BZIP2, 'BZh'),
+               (XZ, '\xfd7zXZ\x00'))
+
+
+def _lzma():
+    """
+    Returns the lzma module (the standard one on python 3, the one
+    provided by backports.lzma on python 2)
+    """
+    try:
+        import lzma
+    except ImportError:
+        try:
+            from backports import lzma
+        except ImportError:
+            raise RuntimeError(
+                'Reading xz compressed files requires backports.lzma')
+    return lzma
+
+
+def detect_codec(filename):
+    """
+    Returns the compression format of the file `filename` (one of
+    `GZIP`, `BZIP2`, `XZ`) detected by its magic bytes, or None if
+    the file is not compressed
+    """
+    with open(filename, 'rb') as stream:
+        head = stream.read(max(len(magic) for _, magic in MAGIC_BYTES))
+    for codec, magic in MAGIC_BYTES:
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def open_input(filename, threaded=None, block_size=BLOCK_SIZE):
+    """
+    Open the input file `filename` for reading. Compressed files are
+    transparently decompressed.
+
+    :param threaded: if True the file is read (and decompressed) by a
+      background thread, so that decompression overlaps with parsing.
+      If None, a thread is used for compressed files only
+    :param block_size: the size of the buffer used to read compressed
+      files
+
+    :returns: a file-like object that can be iterated over its lines
+      and has a `name` attribute holding `filename`
+    """
+    codec = detect_codec(filename)
+    if codec == GZIP:
+        stream = io.BufferedReader(gzip.GzipFile(filename), block_size)
+    elif codec == BZIP2:
+        stream = bz2.BZ2File(filename, buffering=block_size)
+    elif codec == XZ:
+        stream = io.BufferedReader(_lzma().LZMAFile(filename), block_size)
+    else:
+        stream = open(filename)
+    LOG.debug('opened %s (compression: %s)', filename, codec)
+
+    if threaded is None:
+        threaded = codec is not None
+    if threaded:
+        return ThreadedReader(stream, filename, block_size)
+    return stream
+
+
+class ThreadedReader(object):
+    """
+    A read-only file-like object that reads `stream` in blocks of
+    `block_size` bytes in a background thread. At most `queue_size`
+    blocks are read ahead, so memory usage is bounded.
+
+    Iterating over the reader yields the lines of the stream. The
+    reader can only be positioned (by `seek`) before reading starts.
+
+    :param stream: the (possibly decompressing) stream to be read
+    :param name: the name of the file underlying `stream`
+    """
+
+    def __init__(self, stream, name=None, block_size=BLOCK_SIZE,
+                 queue_size=QUEUE_SIZE):
+        self._stream = stream
+        self.name = name or getattr(stream, 'name', None)
+        self._block_size = block_size
+        self._blocks = Queue.Queue(queue_size)
+        self._thread = None
+        self._skip = 0
+        self._stopped = threading.Event()
+
+    def seek(self, offset):
+        """
+        Skip the first `offset` bytes of the stream. It can be called
+        only before reading starts.
+        """
+        if self._thread is not None:
+            raise IOError('ThreadedReader can not seek once started')
+        self._skip = offset
+
+    def _produce(self):
+        """
+        Read the stream, putting the blocks read into the queue. An
+        empty block marks the end of the stream, an exception is put
+        into the queue to be raised by the reader.
+        """
+        try:
+            while not self._stopped.is_set():
+                block = self._stream.read(self._block_size)
+                self._put(block)
+                if not block:
+                    break
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        """
+        Put `item` into the queue unless the reader has been closed
+        """
+        while not self._stopped.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+
+    def _iter_blocks(self):
+        """
+        Returns an iterator over the blocks read by the background
+        thread, started at the first call
+        """
+        self._thread = threading.Thread(target=self._produce)
+        self._thread.daemon = True
+        self._thread.start()
+        skip = self._skip
+        while True:
+            block = self._blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                return
+            if skip:
+                block, skip = block[skip:], max(0, skip - len(block))
+                if not block:
+                    continue
+            yield block
+
+    def __iter__(self):
+        tail = ''
+        for block in self._iter_blocks():
+            lines = (tail + block).split('\n')
+            tail = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if tail:
+            yield tail
+
+    def close(self):
+        """
+        Stop the background thread and close the stream
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
@@ -0,0 +1,114 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# eqcataloguetool is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EqCatalogueTool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with eqcataloguetool. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Module :mod:`eqcatalogue.importers.validation` defines the report of
+the validation of an input file, i.e. of a dry run of an importer
+that parses the file without a catalogue db (s.
+:meth:`~eqcatalogue.importers.base.BaseImporter.validate`).
+"""
+
+from eqcatalogue.exceptions import ParsingFailure
+from eqcatalogue.importers.writer import ROW_FIELDS
+
+
+# number of units parsed at once while validating (s. parse_stream)
+BATCH_SIZE = 10000
+
+_EVENT_SOURCE = ROW_FIELDS.index('event_source')
+_EVENT_KEY = ROW_FIELDS.index('event_key')
+_AGENCY = ROW_FIELDS.index('agency')
+_ORIGIN_KEY = ROW_FIELDS.index('origin_key')
+_SCALE = ROW_FIELDS.index('scale')
+
+
+class ValidationReport(object):
+    """
+    The outcome of the validation of the input file `filename`: the
+    `failures` found (a list of ParsingFailure), the number of
+    `lines` and `bytes` read, the number of `measures` parsed and the
+    distinct events, origins, agencies and scales of the measures (s.
+    :attr:`counts`).
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.failures = []
+        self.lines = 0
+        self.bytes = 0
+        self.measures = 0
+        self._events = set()
+        self._origins = set()
+        self._agencies = set()
+        self._scales = set()
+
+    def add_rows(self, rows):
+        """
+        Account the parsed measure `rows`
+        """
+        self.measures += len(rows)
+        for row in rows:
+            self._events.add((row[_EVENT_SOURCE], row[_EVENT_KEY]))
+            self._origins.add(row[_ORIGIN_KEY])
+            self._agencies.add(row[_AGENCY])
+            self._scales.add(row[_SCALE])
+
+    def merge(self, report):
+        """
+        Account the lines, measures and failures of another `report`,
+        e.g. of a part of the same file
+        """
+        self.failures.extend(report.failures)
+        self.lines += report.lines
+        self.bytes += report.bytes
+        self.measures += report.measures
+        self._events.update(report._events)
+        self._origins.update(report._origins)
+        self._agencies.update(report._agencies)
+        self._scales.update(report._scales)
+
+    def add_failure(self, message):
+        """
+        Record a failure described by `message`
+        """
+        self.failures.append(ParsingFailure(message))
+
+    @property
+    def valid(self):
+        """
+        True if no failure has been found
+        """
+        return not self.failures
+
+    @property
+    def counts(self):
+        """
+        A dictionary with the number of measures and of the distinct
+        events, origins, agencies and scales of the measures
+        """
+        return {'events': len(self._events),
+                'origins': len(self._origins),
+                'measures': self.measures,
+                'agencies': len(self._agencies),
+                'scales': len(self._scales)}
+
+    def __str__(self):
+        counts = self.counts
+        return ('%s: %d lines, %d events, %d origins, %d measures, '
+                '%d agencies, %d scales, %d failures' % (
+                    self.filename, self.lines, counts['events'],
+                    counts['origins'], counts['measures'],
+                    counts['agencies'], counts['scales'],
+                    len(self.failures)))
@@ -0,0 +1,819 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# eqcataloguetool is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EqCatalogueTool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with eqcataloguetool. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Module :mod:`eqcatalogue.importers.writer` defines a buffered writer
+used by the importers to bulk insert magnitude measures into the
+catalogue db.
+"""
+
+import time
+
+import numpy as np
+from sqlalchemy.exc import IntegrityError
+
+from eqcatalogue.log import logger
+from eqcatalogue.importers.dates import format_times
+
+
+LOG = logger(__name__)
+
+# The order of the fields of a measure row. The last ones (from
+# `time` on) describe the origin of the measure, so that importers
+# can build an origin tuple once and append it to every measure row.
+MEASURE_FIELDS = ('event_source', 'event_key', 'event_name',
+                  'agency', 'origin_key', 'scale', 'value', 'standard_error')
+
+ORIGIN_FIELDS = ('time', 'time_error', 'time_rms',
+                 'semi_major_90error', 'semi_minor_90error',
+                 'position', 'depth', 'depth_error', 'azimuth_error')
+
+ROW_FIELDS = MEASURE_FIELDS + ORIGIN_FIELDS
+
+# The fields whose distinct values are accounted in the import summary
+KEY_FIELDS = ('event_source', 'agency', 'origin_key')
+
+# The fields of the unique constraint of the measure table
+UNIQUE_FIELDS = ('event_source', 'event_key', 'origin_key', 'time',
+                 'agency', 'scale')
+
+# The fields compared to detect the changed measures (besides the
+# position, compared by its coordinates)
+VALUE_FIELDS = ('event_name', 'value', 'standard_error', 'time_error',
+                'time_rms', 'semi_major_90error', 'semi_minor_90error',
+                'depth', 'depth_error', 'azimuth_error')
+
+# The measures stored with an event source, the sql of the coordinates
+# of their position being given by the engine (s. `MeasureIndex`)
+STORED_MEASURES_QUERY = """
+SELECT %s, %s, %%s, %%s FROM catalogue_magnitudemeasure
+WHERE event_source = ?""" % (', '.join(UNIQUE_FIELDS),
+                             ', '.join(VALUE_FIELDS))
+
+
+def position_wkt(latitude, longitude):
+    """
+    Returns the WKT representation of a point, suitable to be passed
+    as the `position` field of a measure row
+    """
+    return 'POINT(%s %s)' % (longitude, latitude)
+
+
+def format_time(time):
+    """
+    Returns the string representation of the datetime `time` used in
+    the catalogue db (the same used by sqlalchemy for DateTime
+    columns), so that rows written by the importers compare correctly
+    with the times bound by the queries.
+    """
+    return '%04d-%02d-%02d %02d:%02d:%02d.%06d' % (
+        time.year, time.month, time.day,
+        time.hour, time.minute, time.second, time.microsecond)
+
+
+# The columns of the measures given to `measure_rows` (and to
+# CatalogueDatabase.bulk_insert), in the order of the measure tuples
+BULK_FIELDS = ('time', 'latitude', 'longitude', 'depth', 'agency', 'scale',
+               'value', 'standard_error', 'event_source', 'event_key',
+               'origin_key')
+
+REQUIRED_BULK_FIELDS = ('time', 'latitude', 'longitude', 'agency', 'scale',
+                        'value', 'event_source', 'event_key')
+
+ERR_BULK_FIELD = 'The measures have no %s'
+ERR_BULK_LENGTH = 'The columns of the measures have different lengths'
+
+
+def column_length(values):
+    """
+    Returns the length of the column `values`, None if it is a scalar
+    """
+    if isinstance(values, basestring) or np.ndim(values) == 0:
+        return None
+    return len(values)
+
+
+def _texts(values):
+    """
+    Returns the list of the strings of the column `values`
+    """
+    if isinstance(values, np.ndarray):
+        values = values.tolist()
+    return [value if value is None or isinstance(value, basestring)
+            else str(value) for value in values]
+
+
+def _floats(values):
+    """
+    Returns the list of the floats of the column `values`, where None
+    or NaN values are given as None
+    """
+    values = np.asarray(values, dtype=float)
+    return np.where(np.isnan(values), None, values).tolist()
+
+
+def _times(values):
+    """
+    Returns the list of the times of the column `values` (datetime64,
+    datetime or already formatted times) formatted as in the
+    catalogue db
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'M':
+        return format_times(values)
+    return [value if isinstance(value, basestring) else format_time(value)
+            for value in values.tolist()]
+
+
+def measure_rows(columns):
+    """
+    Returns the measure rows, ordered as `ROW_FIELDS`, of the measures
+    given by `columns`, a dictionary mapping the names in
+    `BULK_FIELDS` to a sequence (e.g. a numpy array) of the values of
+    the measures or to a single value shared by all of them. The
+    columns not in `REQUIRED_BULK_FIELDS` are optional; a missing
+    origin key defaults to the event key.
+
+    The columns are converted as a whole, e.g. the datetime64 times
+    are formatted at once.
+    """
+    lengths = set(column_length(values) for values in columns.values())
+    lengths.discard(None)
+    if len(lengths) > 1:
+        raise ValueError(ERR_BULK_LENGTH)
+    size = lengths.pop() if lengths else 1
+    for field in REQUIRED_BULK_FIELDS:
+        if columns.get(field) is None:
+            raise ValueError(ERR_BULK_FIELD % field)
+
+    def column(field):
+        values = columns.get(field)
+        if column_length(values) is None:
+            return [values] * size
+        return values
+
+    event_keys = _texts(column('event_key'))
+    origin_keys = [origin_key or event_key for origin_key, event_key in zip(
+        _texts(column('origin_key')), event_keys)]
+    latitudes = _floats(column('latitude'))
+    longitudes = _floats(column('longitude'))
+    positions = [position_wkt(latitude, longitude)
+                 for latitude, longitude in zip(latitudes, longitudes)]
+    nothing = [None] * size
+    return zip(_texts(column('event_source')), event_keys,
+               nothing, _texts(column('agency')),
+               origin_keys, _texts(column('scale')),
+               _floats(column('value')), _floats(column('standard_error')),
+               _times(column('time')), nothing, nothing, nothing, nothing,
+               positions, _floats(column('depth')), nothing, nothing)
+
+
+# sqlite temporary table and trigger counting the measures deleted
+# (i.e. replaced by INSERT OR REPLACE) on the writer connection
+REPLACED_COUNTER_DDL = (
+    "CREATE TEMP TABLE IF NOT EXISTS catalogue_replacedmeasures"
+    "(id INTEGER PRIMARY KEY, counter INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO catalogue_replacedmeasures VALUES(1, 0)",
+    "CREATE TEMP TRIGGER IF NOT EXISTS catalogue_count_replaced "
+    "AFTER DELETE ON main.catalogue_magnitudemeasure BEGIN "
+    "UPDATE catalogue_replacedmeasures SET counter = counter + 1; END",
+    # REPLACE fires delete triggers only if recursive triggers are on
+    "PRAGMA recursive_triggers = ON")
+
+# the statements dropping them when the writer is closed (the pragma
+# is restored to its previous value)
+REPLACED_COUNTER_CLEANUP = (
+    "DROP TRIGGER IF EXISTS temp.catalogue_count_replaced",
+    "DROP TABLE IF EXISTS temp.catalogue_replacedmeasures")
+
+
+def insert_statement(position_values, replace=True):
+    """
+    Returns the parameterised sql statement used to insert a measure
+    row. The statement text never changes, so sqlite can reuse the
+    prepared statement across the rows of an `executemany`.
+
+    :param position_values: the columns storing the position of the
+      measure, with the sql expressions of their values, where `%s`
+      stands for the parameter of the WKT of the position (s.
+      :attr:`~eqcatalogue.datastores.base.BaseEngine.POSITION_VALUES`)
+    """
+    # numbered parameters, as the position may be referenced more
+    # than once
+    parameters = ['?%d' % (i + 1) for i in range(len(ROW_FIELDS))]
+    position = parameters[ROW_FIELDS.index('position')]
+    columns, values = [], []
+    for field, parameter in zip(ROW_FIELDS, parameters):
+        if field == 'position':
+            for column, expression in position_values:
+                columns.append(column)
+                values.append(expression.replace('%s', position))
+        else:
+            columns.append(field)
+            values.append(parameter)
+    return """
+INSERT %sINTO catalogue_magnitudemeasure(created_at, %s)
+VALUES(datetime(), %s)""" % ('OR REPLACE ' if replace else '',
+                             ', '.join(columns), ', '.join(values))
+
+
+def _key_hash(key):
+    """
+    Returns the hash of the unique `key` of a measure, given as a
+    tuple ordered as `UNIQUE_FIELDS`. Times are hashed by their string
+    representation, the one they are stored with.
+    """
+    time = key[3]
+    if not isinstance(time, basestring):
+        key = key[:3] + (str(time),) + key[4:]
+    return hash(key)
+
+
+def _values_hash(values):
+    """
+    Returns the hash of the `values` of a measure, given as a tuple
+    ordered as `VALUE_FIELDS` followed by the longitude and the
+    latitude of its position
+    """
+    return hash((values[0],) + tuple(
+        None if value is None else float(value) for value in values[1:]))
+
+
+class MeasureIndex(object):
+    """
+    An in-memory index of the measures stored in the catalogue db,
+    used to append rows to it (s. :class:`MeasureWriter`). For each
+    measure it maps the hash of its unique key to the hash of its
+    other fields, so that a row can be told to be new, unchanged
+    (i.e. to be skipped) or changed without querying the db. The
+    measures of an event source are loaded the first time one of its
+    rows is seen.
+
+    The changes of the index are logged until :meth:`commit` is
+    called, so that they can be undone (s. :meth:`undo`) when the
+    rows are not written.
+
+    :param engine: the engine of the catalogue db, giving the sql of
+      the coordinates of the stored measures
+    """
+
+    NEW, SKIPPED, CHANGED = range(3)
+
+    _UNIQUE = [ROW_FIELDS.index(field) for field in UNIQUE_FIELDS]
+    _VALUES = [ROW_FIELDS.index(field) for field in VALUE_FIELDS]
+    _POSITION = ROW_FIELDS.index('position')
+
+    def __init__(self, engine):
+        self._query = STORED_MEASURES_QUERY % (engine.LONGITUDE_SQL,
+                                               engine.LATITUDE_SQL)
+        self._hashes = {}
+        self._event_sources = set()
+        self._log = []
+        self.counts = [0, 0, 0]
+
+    def load(self, connection, event_sources):
+        """
+        Load the measures stored with the `event_sources` not loaded
+        yet
+        """
+        unique_fields = len(UNIQUE_FIELDS)
+        for event_source in set(event_sources) - self._event_sources:
+            self._event_sources.add(event_source)
+            for measure in connection.execute(self._query,
+                                              (event_source,)):
+                measure = tuple(measure)
+                self._hashes[_key_hash(measure[:unique_fields])] = (
+                    _values_hash(measure[unique_fields:]))
+
+    def select(self, rows):
+        """
+        Returns the `rows` that are new or changed, adding them to the
+        index
+        """
+        selected = []
+        for row in rows:
+            key = _key_hash(tuple(row[i] for i in self._UNIQUE))
+            longitude, latitude = row[self._POSITION][6:-1].split()
+            values = _values_hash(tuple(row[i] for i in self._VALUES) +
+                                  (longitude, latitude))
+            stored = self._hashes.get(key)
+            if stored == values:
+                outcome = self.SKIPPED
+            else:
+                outcome = self.NEW if stored is None else self.CHANGED
+                self._hashes[key] = values
+                selected.append(row)
+            self.counts[outcome] += 1
+            self._log.append((outcome, key, stored))
+        return selected
+
+    @property
+    def mark(self):
+        """
+        The position in the log of the changes, to be passed to
+        :meth:`undo`
+        """
+        return len(self._log)
+
+    def undo(self, mark=0):
+        """
+        Undo the changes logged after `mark`
+        """
+        while len(self._log) > mark:
+            outcome, key, stored = self._log.pop()
+            self.counts[outcome] -= 1
+            if outcome == self.NEW:
+                del self._hashes[key]
+            elif outcome == self.CHANGED:
+                self._hashes[key] = stored
+
+    def commit(self):
+        """
+        Forget the logged changes
+        """
+        self._log = []
+
+
+class MeasureWriter(object):
+    """
+    Collects measure rows (tuples ordered as `ROW_FIELDS`) and writes
+    them to the catalogue db with a single `executemany` call each
+    time `flush_size` rows have been buffered. The importers commit
+    the transaction at the first event boundary after
+    `commit_interval` rows have been written (s. `commit_due`).
+
+    The rows added after :meth:`start_event` belong to the event
+    block being parsed and can be discarded alone (s.
+    :meth:`discard_event`): once some of them have been written, the
+    rest of the event is written under a SAVEPOINT, so the rows of
+    the previous events are kept in the transaction. The events
+    closed while their rows are still buffered are written at once
+    under a SAVEPOINT as well; if one of them violates a constraint,
+    they are written again one event at a time and only the failing
+    ones are discarded (s. `on_discarded`).
+
+    While writing, the writer keeps track of the event sources,
+    agencies and origins it creates and of the measures it replaces,
+    so that the import summary does not need to scan the whole
+    measure table (s. `created` and `replaced`).
+
+    In append mode the rows already stored are skipped: a
+    :class:`MeasureIndex` of the measures of the event sources being
+    written tells the new rows, which are inserted, the changed ones,
+    which replace the stored ones, and the unchanged ones (s. `new`,
+    `changed` and `skipped`).
+
+    :param cat: the catalogue database the rows are written into
+    :type cat: CatalogueDatabase
+
+    :param flush_size: number of rows buffered before a flush
+    :param commit_interval: number of rows written before a commit
+    :param replace: if True rows violating the unique constraint
+      replace the existing ones, otherwise an IntegrityError is raised
+    :param append: if True, skip the rows already stored (rows are
+      replaced, whatever the value of `replace`)
+    :param metrics: the
+      :class:`~eqcatalogue.importers.metrics.ImportMetrics` where the
+      rows written and the time spent writing and committing are
+      accounted
+    :param on_discarded: called with the label of a closed event (s.
+      :meth:`start_event`) and the IntegrityError when its rows are
+      discarded because they violate a constraint
+    """
+
+    DEFAULT_FLUSH_SIZE = 10000
+    DEFAULT_COMMIT_INTERVAL = 250000
+    EVENT_SAVEPOINT = 'catalogue_event'
+
+    def __init__(self, cat, flush_size=None, commit_interval=None,
+                 replace=True, metrics=None, append=False,
+                 on_discarded=None):
+        self._catalogue = cat
+        self._metrics = metrics
+        self._on_discarded = on_discarded
+        self.flush_size = flush_size or self.DEFAULT_FLUSH_SIZE
+        self.commit_interval = (commit_interval or
+                                self.DEFAULT_COMMIT_INTERVAL)
+        engine = cat.engine
+        self._index = MeasureIndex(engine) if append else None
+        replace = replace or append
+        self._replace = replace
+        self._statement = insert_statement(engine.POSITION_VALUES, replace)
+        self._rows = []
+        self._uncommitted = 0
+        self.written = 0
+        self.replaced = 0
+        self.created = dict((field, set()) for field in KEY_FIELDS)
+        # key values already looked up in the catalogue db
+        self._known = dict((field, set()) for field in KEY_FIELDS)
+        # key values stored before a bulk load (s. `_stored_keys`)
+        self._stored = None
+        self._uncommitted_replaced = 0
+        self._uncommitted_created = []
+        self._counting_replaced = False
+        # the value of the recursive_triggers pragma before the writer
+        # turned it on (s. `close`)
+        self._recursive_triggers = None
+        # the index in `_rows` of the first row of the current event
+        # (None if there is no event that can be discarded alone)
+        self._event_start = None
+        self._event_label = None
+        # the index in `_rows` of the first row and the label of the
+        # closed events whose rows are buffered
+        self._events = []
+        # the state of the writer before the rows of the current event
+        # were written (s. `_save`)
+        self._event_snapshot = None
+
+    def add(self, row):
+        """
+        Buffer a measure `row`, flushing the buffer when it is full
+        """
+        self._rows.append(row)
+        if len(self._rows) >= self.flush_size:
+            self.flush()
+
+    @property
+    def uncommitted(self):
+        """
+        The number of rows added since the last commit
+        """
+        return self._uncommitted + len(self._rows)
+
+    @property
+    def commit_due(self):
+        """
+        True if at least `commit_interval` rows have been added since
+        the last commit
+        """
+        return self.uncommitted >= self.commit_interval
+
+    def flush(self):
+        """
+        Write the buffered rows
+        """
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        events, self._events = self._events, []
+        started = time.time()
+        connection = self._catalogue.session.connection()
+        event_start = self._event_start
+        if event_start is None:
+            event_start = len(rows)
+        first = events[0][0] if events else event_start
+        try:
+            self._write(connection, rows[:first])
+        except:
+            # the rows preceding any event are involved
+            self._event_start = None
+            raise
+        if events:
+            ends = [start for start, _ in events[1:]] + [event_start]
+            self._write_events([(label, rows[start:end])
+                                for (start, label), end in zip(events, ends)])
+            # a discarded event may have ended the transaction
+            connection = self._catalogue.session.connection()
+        if event_start < len(rows):
+            if self._event_snapshot is None:
+                self._event_snapshot = self._save(connection)
+            self._write(connection, rows[event_start:])
+        if self._event_start is not None:
+            self._event_start = 0
+        if self._metrics is not None:
+            self._metrics.add_time('write', time.time() - started)
+
+    def _write_events(self, events):
+        """
+        Write the rows of the closed `events`, a list of tuples
+        (label, rows). They are written at once; if they violate a
+        constraint, they are written again one event at a time and
+        only the events violating it are discarded.
+        """
+        connection = self._catalogue.session.connection()
+        snapshot = self._save(connection)
+        try:
+            self._write(connection, [row for _, rows in events
+                                     for row in rows])
+        except IntegrityError:
+            self._restore(connection, snapshot)
+        else:
+            self._release(connection, snapshot)
+            return
+        for label, rows in events:
+            connection = self._catalogue.session.connection()
+            snapshot = self._save(connection)
+            try:
+                self._write(connection, rows)
+            except IntegrityError as e:
+                self._restore(connection, snapshot)
+                self._discarded(label, e)
+            else:
+                self._release(connection, snapshot)
+
+    def _discarded(self, label, error):
+        """
+        Report that the rows of the closed event `label` have been
+        discarded because of the IntegrityError `error`
+        """
+        LOG.warn('Discarded the measures of the event %s: %s',
+                 label, error)
+        if self._on_discarded is not None:
+            self._on_discarded(label, error)
+
+    def _write(self, connection, rows):
+        """
+        Execute the insert statement for `rows`
+        """
+        if self._index is not None:
+            self._index.load(connection, set(row[0] for row in rows))
+            rows = self._index.select(rows)
+        if not rows:
+            return
+        self._track_created(connection, rows)
+        if self._replace:
+            replaced = self._replaced_counter(connection)
+        connection.execute(self._statement, rows)
+        if self._replace:
+            replaced = self._replaced_counter(connection) - replaced
+            self.replaced += replaced
+            self._uncommitted_replaced += replaced
+        self.written += len(rows)
+        self._uncommitted += len(rows)
+        if self._metrics is not None:
+            self._metrics.add_batch(len(rows))
+
+    def start_event(self, label=None):
+        """
+        Mark the start of a new event block: the rows added from now
+        on can be discarded by :meth:`discard_event`. The current
+        event is closed: if some of its rows have already been
+        written, the buffered ones are written too, so that it can
+        still be discarded alone. `label` identifies the event when
+        its rows are discarded once closed (s. `on_discarded`).
+        """
+        if self._event_snapshot is not None:
+            self._close_event()
+        elif self._event_start is not None and (
+                self._event_start < len(self._rows)):
+            self._events.append((self._event_start, self._event_label))
+        self._event_start = len(self._rows)
+        self._event_label = label
+        self._event_snapshot = None
+
+    def _close_event(self):
+        """
+        Write the buffered rows of the current event, whose first rows
+        have already been written, and release its savepoint. If they
+        violate a constraint, the whole event is discarded.
+        """
+        rows, self._rows = self._rows, []
+        started = time.time()
+        connection = self._catalogue.session.connection()
+        try:
+            self._write(connection, rows)
+        except IntegrityError as e:
+            self._restore(connection, self._event_snapshot)
+            self._discarded(self._event_label, e)
+        else:
+            self._release(connection, self._event_snapshot)
+        if self._metrics is not None:
+            self._metrics.add_time('write', time.time() - started)
+
+    def _save(self, connection):
+        """
+        Returns the state of the writer before writing the rows of an
+        event. A SAVEPOINT is needed only if the transaction already
+        holds rows of the previous events, otherwise the event can be
+        discarded by a rollback.
+        """
+        savepoint = self._uncommitted > 0
+        if savepoint:
+            connection.execute("SAVEPOINT %s" % self.EVENT_SAVEPOINT)
+        return (
+            savepoint, self.written, self.replaced, self._uncommitted,
+            self._uncommitted_replaced, len(self._uncommitted_created),
+            self._counting_replaced,
+            self._metrics.rows if self._metrics is not None else 0,
+            self._index.mark if self._index is not None else 0)
+
+    def _release(self, connection, snapshot):
+        """
+        Keep the rows written since `snapshot` was saved
+        """
+        if snapshot[0]:
+            connection.execute(
+                "RELEASE SAVEPOINT %s" % self.EVENT_SAVEPOINT)
+
+    def _restore(self, connection, snapshot):
+        """
+        Discard the rows written since `snapshot` was saved and
+        restore the state of the writer
+        """
+        (savepoint, self.written, self.replaced, self._uncommitted,
+         self._uncommitted_replaced, created, self._counting_replaced,
+         rows, index_mark) = snapshot
+        if savepoint:
+            connection.execute(
+                "ROLLBACK TO SAVEPOINT %s" % self.EVENT_SAVEPOINT)
+            connection.execute(
+                "RELEASE SAVEPOINT %s" % self.EVENT_SAVEPOINT)
+        else:
+            self._catalogue.session.rollback()
+        if self._metrics is not None:
+            self._metrics.rows = rows
+        if self._index is not None:
+            self._index.undo(index_mark)
+        for field, value in self._uncommitted_created[created:]:
+            self.created[field].discard(value)
+            self._known[field].discard(value)
+        del self._uncommitted_created[created:]
+
+    def discard_event(self):
+        """
+        Discard the rows of the current event, keeping the ones of the
+        previous events. Returns False (and discards nothing) if there
+        is no current event or if its rows can not be discarded alone
+        (i.e. when writing the rows of the previous events failed).
+        """
+        if self._event_start is None:
+            return False
+        del self._rows[self._event_start:]
+        if self._event_snapshot is not None:
+            self._restore(self._catalogue.session.connection(),
+                          self._event_snapshot)
+        self._event_start = None
+        self._event_snapshot = None
+        return True
+
+    def _track_created(self, connection, rows):
+        """
+        Look up the key values of `rows` not seen before and record
+        the ones not yet stored in the catalogue db. Every key column
+        is indexed, so it costs a lookup per new value. During a bulk
+        load the indexes are not available, so the values are looked
+        up in the key values stored before the load.
+        """
+        stored = self._stored_keys(connection)
+        for field in KEY_FIELDS:
+            index = ROW_FIELDS.index(field)
+            known = self._known[field]
+            for value in set(row[index] for row in rows) - known:
+                known.add(value)
+                if stored is not None:
+                    is_new = value not in stored[field]
+                else:
+                    is_new = connection.execute(
+                        "SELECT 1 FROM catalogue_magnitudemeasure "
+                        "WHERE %s = ? LIMIT 1" % field,
+                        (value,)).first() is None
+                if is_new:
+                    self.created[field].add(value)
+                    self._uncommitted_created.append((field, value))
+
+    def _stored_keys(self, connection):
+        """
+        Returns a dictionary with the sets of key values stored in the
+        catalogue db if it is being bulk loaded (read once, with a
+        scan of the measure table per key field), None otherwise
+        """
+        if self._stored is None and self._catalogue.bulk_loading:
+            self._stored = dict(
+                (field, set(row[0] for row in connection.execute(
+                    "SELECT DISTINCT %s FROM catalogue_magnitudemeasure"
+                    % field)))
+                for field in KEY_FIELDS)
+        return self._stored
+
+    def _replaced_counter(self, connection):
+        """
+        Returns the number of measures replaced on `connection`
+        """
+        if not self._counting_replaced:
+            if self._recursive_triggers is None:
+                self._recursive_triggers = connection.execute(
+                    "PRAGMA recursive_triggers").scalar()
+            for statement in REPLACED_COUNTER_DDL:
+                connection.execute(statement)
+            self._counting_replaced = True
+        return connection.execute(
+            "SELECT counter FROM catalogue_replacedmeasures").scalar()
+
+    def commit(self):
+        """
+        Write the buffered rows and commit the transaction
+        """
+        self.flush()
+        LOG.debug('committing %d measures', self._uncommitted)
+        started = time.time()
+        self._catalogue.session.commit()
+        if self._metrics is not None:
+            self._metrics.add_time('commit', time.time() - started)
+        self._uncommitted = 0
+        self._uncommitted_replaced = 0
+        self._uncommitted_created = []
+        # the commit has released the savepoint of the current event
+        self._event_snapshot = None
+        if self._index is not None:
+            self._index.commit()
+
+    def rollback(self):
+        """
+        Discard the buffered rows and rollback the transaction
+        """
+        self._rows = []
+        self.written -= self._uncommitted
+        if self._metrics is not None:
+            self._metrics.rows -= self._uncommitted
+        self.replaced -= self._uncommitted_replaced
+        for field, value in self._uncommitted_created:
+            self.created[field].discard(value)
+            self._known[field].discard(value)
+        self._uncommitted = 0
+        self._uncommitted_replaced = 0
+        self._uncommitted_created = []
+        # the temporary counter may have been created in the
+        # discarded transaction
+        self._counting_replaced = False
+        self._event_start = None
+        self._events = []
+        self._event_snapshot = None
+        if self._index is not None:
+            self._index.undo()
+        self._catalogue.session.rollback()
+        self.close()
+
+    def close(self):
+        """
+        Drop the temporary table and trigger counting the replaced
+        measures and restore the recursive_triggers pragma, so that
+        the later statements on the catalogue connection are not
+        affected by the writer. Called once the rows have been
+        committed or rolled back.
+        """
+        if self._recursive_triggers is None:
+            return
+        connection = self._catalogue.session.connection()
+        for statement in REPLACED_COUNTER_CLEANUP:
+            connection.execute(statement)
+        connection.execute(
+            "PRAGMA recursive_triggers = %d" % self._recursive_triggers)
+        self._catalogue.session.commit()
+        self._recursive_triggers = None
+        self._counting_replaced = False
+
+    def _index_count(self, outcome):
+        if self._index is None:
+            return 0
+        return self._index.counts[outcome]
+
+    @property
+    def new(self):
+        """
+        The number of rows not stored before, in append mode
+        """
+        return self._index_count(MeasureIndex.NEW)
+
+    @property
+    def changed(self):
+        """
+        The number of rows that replaced a stored measure with
+        different values, in append mode
+        """
+        return self._index_count(MeasureIndex.CHANGED)
+
+    @property
+    def skipped(self):
+        """
+        The number of rows already stored, in append mode
+        """
+        return self._index_count(MeasureIndex.SKIPPED)
+
+    @property
+    def created_measures(self):
+        """
+        The number of measures written and not replaced by a later
+        row
+        """
+        return self.written - self.replaced
+
+
+class RowBuffer(list):
+    """
+    A list of measure rows that can be used in place of a
+    :class:`MeasureWriter` when the rows are not going to be written
+    by the current process (e.g. when parsing in a worker process)
+    """
+    add = list.append
@@ -23,6 +23,8 @@ measure metadata).
 """
 
 import collections
+import contextlib
+import itertools
 from shapely import wkb
 import numpy as np
 
@@ -32,8 +34,100 @@ from sqlalchemy import func
 
 DEFAULT_ENGINE = 'eqcatalogue.datastores.spatialite'
 
+# the radius of the earth in meters, used to compute the distances
+# between measures
+EARTH_RADIUS = 6371227.
 
-class MagnitudeMeasure(object):
+
+def position_coordinates(position):
+    """
+    Returns the longitude and the latitude of the geoalchemy point
+    `position`, (None, None) if it is None
+    """
+    if position is None:
+        return None, None
+    if hasattr(position, 'geom_wkb'):
+        geom = wkb.loads(str(position.geom_wkb))
+        return geom.x, geom.y
+    return tuple(position.coords(0))
+
+
+class BaseMeasure(object):
+    """
+    The behaviour shared by the measure classes (s.
+    :class:`MagnitudeMeasure`): representation, distances and
+    conversion. It adds no instance attribute, so that derived classes
+    can be slotted, as the measures hydrated by the columnar engine
+    are. MagnitudeMeasure itself keeps its `__dict__`: it is mapped by
+    the ORM, whose instrumentation stores the instance state and the
+    attribute values there.
+    """
+    __slots__ = ()
+
+    def __repr__(self):
+        if self.longitude is not None:
+            return "%s %s (sigma=%s) @ %s-%s" % (
+                self.value, self.scale, self.standard_error,
+                self.position_as_tuple(), self.time)
+        else:
+            return "%s %s (sigma=%s) at %s" % (
+                self.value, self.scale, self.standard_error, self.time)
+
+    def keys(self):
+        return ["id", "agency", "event", "origin",
+                "scale", "value", "standard_error"]
+
+    def values(self):
+        if self.standard_error:
+            stderr = "%.4f" % self.standard_error
+        else:
+            stderr = ""
+
+        return [self.id, self.agency,
+                self.event_key, self.origin_key,
+                self.scale, "%.4f" % self.value, stderr]
+
+    def time_distance(self, measure):
+        return abs(self.time - measure.time).total_seconds()
+
+    def magnitude_distance(self, measure):
+        return abs(self.value - measure.value)
+
+    def space_distance(self, measure):
+        """
+        calculate geographical distance using the haversine formula.
+        """
+
+        earth_rad = EARTH_RADIUS / 1000.
+        coords = self.position_as_tuple() + measure.position_as_tuple()
+
+        # convert to radians
+        lon1, lat1, lon2, lat2 = [c * np.pi / 180 for c in coords]
+
+        dlat, dlon = lat1 - lat2, lon1 - lon2
+        aval = (np.sin(dlat / 2.) ** 2. +
+                np.cos(lat1) * np.cos(lat2) * (np.sin(dlon / 2.) ** 2.))
+        distance = (2. * earth_rad *
+                    np.arctan2(np.sqrt(aval), np.sqrt(1 - aval)))
+
+        return distance
+
+    def position_as_tuple(self):
+        """
+        Returns the longitude and the latitude of the measure
+        """
+        return self.longitude, self.latitude
+
+    def convert(self, new_value, formula, standard_error):
+        """
+        Convert the measure to a ConvertedMeasure with `new_value`
+        through `formula`
+        """
+        return ConvertedMeasure(self, formula.target_scale, new_value,
+                                standard_error, formula)
+
+
+class MagnitudeMeasure(BaseMeasure):
     """
     Describes a single measure of the magnitude of an event
 
@@ -82,7 +176,16 @@ class MagnitudeMeasure(object):
     :attribute position:
       Point coordinate (latitude and longitude).
       You can create a point object by using the utility function
-      `eqcatalogue.models.CatalogueDatabase.position_from_latlng`
+      `eqcatalogue.models.CatalogueDatabase.position_from_latlng`.
+      In a catalogue db it is loaded only when accessed.
+
+    :attribute longitude:
+      The longitude of the position, stored next to it so that reading
+      the coordinates needs no geometry. It is given by `position`
+      when not passed to the constructor.
+
+    :attribute latitude:
+      The latitude of the position.
 
     :attribute semi_major_90error:
       Semi-Major axis of the 90th percentile confidence ellipsis of the
@@ -119,7 +222,9 @@ class MagnitudeMeasure(object):
                  time_rms=None,
                  azimuth_error=None,
                  time_error=None,
-                 depth=None):
+                 depth=None,
+                 latitude=None,
+                 longitude=None):
         self.id = None
         self.agency = agency
         self.event_source = event_source
@@ -138,54 +243,10 @@ class MagnitudeMeasure(object):
         self.depth = depth
         self.time = time
         self.position = position
-
-    def __repr__(self):
-        if self.position is not None:
-            return "%s %s (sigma=%s) @ %s-%s" % (
-                self.value, self.scale, self.standard_error,
-                self.position_as_tuple(), self.time)
-        else:
-            return "%s %s (sigma=%s) at %s" % (
-                self.value, self.scale, self.standard_error, self.time)
-
-    def keys(self):
-        return ["id", "agency", "event", "origin",
-                "scale", "value", "standard_error"]
-
-    def values(self):
-        if self.standard_error:
-            stderr = "%.4f" % self.standard_error
-        else:
-            stderr = ""
-
-        return [self.id, self.agency,
-                self.event_key, self.origin_key,
-                self.scale, "%.4f" % self.value, stderr]
-
-    def time_distance(self, measure):
-        return abs(self.time - measure.time).total_seconds()
-
-    def magnitude_distance(self, measure):
-        return abs(self.value - measure.value)
-
-    def space_distance(self, measure):
-        """
-        calculate geographical distance using the haversine formula.
-        """
-
-        earth_rad = 6371.227
-        coords = self.position_as_tuple() + measure.position_as_tuple()
-
-        # convert to radians
-        lon1, lat1, lon2, lat2 = [c * np.pi / 180 for c in coords]
-
-        dlat, dlon = lat1 - lat2, lon1 - lon2
-        aval = (np.sin(dlat / 2.) ** 2. +
-                np.cos(lat1) * np.cos(lat2) * (np.sin(dlon / 2.) ** 2.))
-        distance = (2. * earth_rad *
-                    np.arctan2(np.sqrt(aval), np.sqrt(1 - aval)))
-
-        return distance
+        if longitude is None:
+            longitude, latitude = position_coordinates(position)
+        self.longitude = longitude
+        self.latitude = latitude
 
     @classmethod
     def make_from_lists(cls, scale, values, sigmas):
@@ -197,88 +258,80 @@ class MagnitudeMeasure(object):
                     scale=scale, value=v[0], standard_error=v[1])
                 for v in zip(values, sigmas)]
 
-    def position_as_tuple(self):
-        if hasattr(self.position, 'geom_wkb'):
-            geom = wkb.loads(str(self.position.geom_wkb))
-            return geom.x, geom.y
-        else:
-            return self.position.coords(0)
 
-    def convert(self, new_value, formula, standard_error):
-        """
-        Convert the measure to a ConvertedMeasure with `new_value`
-        through `formula`
-        """
-        return ConvertedMeasure(
-            event_source=self.event_source,
-            event_key=self.event_key,
-            agency=self.agency,
-            origin_key=self.origin_key,
-            time=self.time,
-            position=self.position,
-            scale=formula.target_scale,
-            value=new_value,
-            event_name=self.event_name,
-            standard_error=standard_error,
-            semi_minor_90error=self.semi_minor_90error,
-            semi_major_90error=self.semi_major_90error,
-            depth_error=self.depth_error,
-            time_rms=self.time_rms,
-            azimuth_error=self.azimuth_error,
-            time_error=self.time_error,
-            depth=self.depth,
-            original_measure=self,
-            formulas=[formula])
+# the attributes a converted measure reads from its original measure
+ORIGINAL_ATTRIBUTES = ('event_source', 'event_key', 'agency', 'origin_key',
+                       'event_name', 'time', 'depth', 'depth_error',
+                       'time_rms', 'time_error', 'azimuth_error',
+                       'semi_minor_90error', 'semi_major_90error',
+                       'position', 'longitude', 'latitude')
+
+
+def _original_attribute(name):
+    """
+    Returns a property reading the attribute `name` of the original
+    measure of a converted measure
+    """
+    def getter(measure):
+        return getattr(measure.original_measure, name)
+    return property(getter, doc="The %s of the original measure" % name)
 
 
 class ConvertedMeasure(object):
     """
-    A converted measure is measure that is the result of a conversion
+    A converted measure is measure that is the result of a conversion.
+
+    Only the scale, the value and the standard error are stored: the
+    event and origin data (agency, time, position...) are read from
+    the original measure, and the formulas applied are given by the
+    chain of the converted measures it was converted from. Slots keep
+    the instances small when millions of measures are harmonised.
+
+    :param original_measure:
+      the :class:`MagnitudeMeasure` converted
+    :param formula:
+      the formula of the last conversion
+    :param previous:
+      the converted measure `formula` was applied to, if any
     """
-    def __init__(self,
-                 time,
-                 position,
-                 scale,
-                 value,
-                 original_measure,
-                 formulas,
-                 event_source=None,
-                 event_key=None,
-                 agency=None,
-                 origin_key=None,
-                 event_name=None,
-                 standard_error=None,
-                 semi_minor_90error=None,
-                 semi_major_90error=None,
-                 depth_error=None,
-                 time_rms=None,
-                 azimuth_error=None,
-                 time_error=None,
-                 depth=None):
+    __slots__ = ('original_measure', 'scale', 'value', 'standard_error',
+                 'formula', 'previous')
+
+    # converted measures are not stored
+    id = None
+
+    def __init__(self, original_measure, scale, value, standard_error=None,
+                 formula=None, previous=None):
         # we do not inherit by MagnitudeMeasure because it could be
         # sqlalchemizable, and, consenquently it may have some magic
         # in the constructor that we don't want here
-
-        self.id = None
-        self.agency = agency
-        self.event_source = event_source
-        self.event_key = event_key
-        self.origin_key = origin_key
-        self.event_name = event_name
+        self.original_measure = original_measure
         self.scale = scale
         self.value = value
         self.standard_error = standard_error
-        self.semi_minor_90error = semi_minor_90error
-        self.semi_major_90error = semi_major_90error
-        self.depth_error = depth_error
-        self.time_rms = time_rms
-        self.azimuth_error = azimuth_error
-        self.time_error = time_error
-        self.depth = depth
-        self.time = time
-        self.position = position
-        self.original_measure = original_measure
-        self.formulas = formulas or []
+        self.formula = formula
+        self.previous = previous
+
+    @property
+    def formulas(self):
+        """
+        The list of the formulas applied to the original measure, in
+        order
+        """
+        formulas = []
+        measure = self
+        while measure is not None:
+            if measure.formula is not None:
+                formulas.append(measure.formula)
+            measure = measure.previous
+        formulas.reverse()
+        return formulas
+
+    def position_as_tuple(self):
+        """
+        Returns the longitude and the latitude of the measure
+        """
+        return self.original_measure.position_as_tuple()
 
     def __repr__(self):
         return "%s %s (sigma=%s) converted by %s" % (
@@ -305,26 +358,13 @@ class ConvertedMeasure(object):
         Convert the measure to a ConvertedMeasure with `new_value`
         and `standard_error` through `formula`.
         """
-        return self.__class__(
-            event_source=self.event_source,
-            event_key=self.event_key,
-            agency=self.agency,
-            origin_key=self.origin_key,
-            time=self.time,
-            position=self.position,
-            scale=formula.target_scale,
-            value=new_value,
-            event_name=self.event_name,
-            standard_error=standard_error,
-            semi_minor_90error=self.semi_minor_90error,
-            semi_major_90error=self.semi_major_90error,
-            depth_error=self.depth_error,
-            time_rms=self.time_rms,
-            azimuth_error=self.azimuth_error,
-            time_error=self.time_error,
-            depth=self.depth,
-            original_measure=self.original_measure,
-            formulas=self.formulas[:] + [formula])
+        return self.__class__(self.original_measure, formula.target_scale,
+                              new_value, standard_error, formula, self)
+
+
+for _name in ORIGINAL_ATTRIBUTES:
+    setattr(ConvertedMeasure, _name, _original_attribute(_name))
+del _name
 
 
 class Workspace(type):
@@ -354,7 +394,8 @@ class CatalogueDatabase(object):
 
     :param engine_class_module:
       A module that implements an engine protocol.
-      If not provided, the default is eqcatalogue.datastores.spatialite
+      If not provided, the default is eqcatalogue.datastores.spatialite;
+      eqcatalogue.datastores.sqlite needs no spatial extension
 
     Any other params is passed to the engine constructor.
     For spatialite, you have the following keyword arguments:
@@ -366,6 +407,11 @@ class CatalogueDatabase(object):
       Open a file database located at path `filename`. If not given, the
       default is `eqcatalogue.db`
     :type filename: string
+    :keyword readers:
+      The number of read-only connections used by the threads other
+      than the one opening the database, which can query the
+      catalogue while it is written (s. :mod:`eqcatalogue.datastores.base`)
+    :type readers: int
 
     e.g.::
       cat = CatalogueDatabase(filename="my-catalogue.db")
@@ -375,6 +421,9 @@ class CatalogueDatabase(object):
     MEASURE_AGENCIES = 'available_measure_agencies'
     MEASURE_SCALES = 'available_measure_scales'
 
+    # number of measures converted at once by bulk_insert
+    BULK_INSERT_BATCH_SIZE = 65536
+
     def __init__(self, engine=DEFAULT_ENGINE, **engine_params):
         log.logger(__name__).info(
             "initializing Catalogue Database (engine=%s, params %s)",
@@ -384,6 +433,7 @@ class CatalogueDatabase(object):
         if 'drop' in engine_params or 'memory' in engine_params:
             log.logger(__name__).info("reset catalogue data")
         self._cache = collections.defaultdict(dict)
+        self._bulk_loading = False
 
     def recreate(self):
         """
@@ -406,26 +456,197 @@ class CatalogueDatabase(object):
         module = __import__(module_name, fromlist=['Engine'])
         return module.Engine
 
+    @property
+    def engine(self):
+        """
+        Return the engine storing the catalogue (s.
+        :mod:`eqcatalogue.datastores`)
+        """
+        return self._engine
+
     @property
     def session(self):
         """
-        Return the current CatalogueDatabase session
+        Return the current CatalogueDatabase session, i.e. the session
+        of the current thread
         """
         return self._engine.session
 
-    def load_file(self, filename, importer_module_name, **kwargs):
+    @property
+    def columnar(self):
+        """
+        True if the measures are kept in memory as numpy columns (s.
+        :mod:`eqcatalogue.datastores.columnar`) instead of a sql
+        database
+        """
+        return getattr(self._engine, 'columnar', False)
+
+    @property
+    def bulk_loading(self):
+        """
+        True while the measures are being bulk loaded (s.
+        :meth:`bulk_load`), i.e. when the secondary indexes of the
+        measure table are not available
+        """
+        return self._bulk_loading
+
+    @contextlib.contextmanager
+    def bulk_load(self):
+        """
+        Context manager used to load many measures at once. The
+        secondary indexes of the measure table are dropped on enter,
+        so that they are not maintained row by row while the measures
+        are inserted. On exit they are rebuilt, one index at a time,
+        and the table statistics are refreshed by ANALYZE.
+
+        If the block raises, the uncommitted changes are rolled back
+        before the indexes are rebuilt. Nested blocks are part of the
+        outermost one.
+
+        e.g.::
+          with cat.bulk_load():
+              cat.load_file("isc.txt", "isf_bulletin")
+              cat.load_file("iaspei.csv", "iaspei")
+        """
+        if self._bulk_loading:
+            yield self
+            return
+        log.logger(__name__).info("bulk load started")
+        self._engine.drop_indexes()
+        self._bulk_loading = True
+        try:
+            yield self
+        except:
+            self.session.rollback()
+            raise
+        finally:
+            self._bulk_loading = False
+            self._engine.create_indexes()
+            log.logger(__name__).info("bulk load completed")
+
+    def load_file(self, filename, importer_module_name, resume=False,
+                  bulk=False, **kwargs):
         """
         Load filename by using an Importer defined in
-        `importer_module_name`. Other kwargs are passed to the store
-        method of the importer
+        `importer_module_name`. Files compressed with gzip, bzip2 or
+        xz are decompressed while they are parsed. If `resume` is True
+        and the file has already been partially loaded, the import
+        continues from its last checkpoint. If `bulk` is True the file
+        is loaded in a :meth:`bulk_load` block. Other kwargs are
+        passed to the store method of the importer, or to its
+        parse_stream method in a :attr:`columnar` catalogue, which
+        can not resume an import (a NotImplementedError is raised).
+
+        :returns: the
+          :class:`~eqcatalogue.importers.metrics.ImportMetrics` of the
+          import
         """
+        from eqcatalogue.importers.streams import open_input
+
         if not '.' in importer_module_name:
             importer_module_name = (
                 'eqcatalogue.importers.' + importer_module_name)
         module = __import__(importer_module_name, fromlist=['Importer'])
-        importer = module.Importer(file(filename), self)
-        summary = importer.store(**kwargs)
+        with open_input(filename) as stream:
+            if self.columnar:
+                summary, metrics = self._engine.load_stream(
+                    module.Importer, stream, resume=resume, **kwargs)
+                log.logger(__name__).info(summary)
+                return metrics
+            importer = module.Importer(stream, self)
+            if bulk:
+                with self.bulk_load():
+                    summary = importer.store(resume=resume, **kwargs)
+            else:
+                summary = importer.store(resume=resume, **kwargs)
+        log.logger(__name__).info(summary)
+        log.logger(__name__).info('import metrics: %s', importer.metrics)
+        return importer.metrics
+
+    def bulk_insert(self, measures=None, batch_size=None, flush_size=None,
+                    commit_interval=None, append=False, bulk=False,
+                    **columns):
+        """
+        Insert many measures at once, without building
+        :class:`MagnitudeMeasure` objects. The measures are converted
+        `batch_size` at a time and written by a
+        :class:`~eqcatalogue.importers.writer.MeasureWriter`, i.e. in
+        batches of `flush_size` rows committed every
+        `commit_interval` rows. Measures violating the unique
+        constraint replace the existing ones; if `append` is True the
+        measures already stored are skipped. If `bulk` is True the
+        measures are inserted in a :meth:`bulk_load` block. In a
+        :attr:`columnar` catalogue the batches are inserted into the
+        columns as they are converted and only `batch_size` is used.
+
+        The measures are given either as `measures`, an iterable of
+        tuples ordered as
+        :data:`~eqcatalogue.importers.writer.BULK_FIELDS`, or as
+        keyword arguments named after them, holding the columns of
+        the measures (e.g. numpy arrays) or values shared by all of
+        them (s. :func:`~eqcatalogue.importers.writer.measure_rows`).
+
+        e.g.::
+          cat.bulk_insert(time=times, latitude=lats, longitude=lons,
+                          agency='SIM', scale='Mw', value=magnitudes,
+                          event_source='simulation', event_key=keys)
+
+        :returns: the summary of the inserted catalogue data (s.
+          :attr:`~eqcatalogue.importers.base.BaseImporter.summary`)
+        """
+        from eqcatalogue.importers.base import prepare_session, writer_summary
+        from eqcatalogue.importers.writer import (
+            BULK_FIELDS, MeasureWriter, column_length, measure_rows)
+
+        batch_size = batch_size or self.BULK_INSERT_BATCH_SIZE
+        if measures is not None:
+            measures = iter(measures)
+            # the last fields of the tuples can be omitted
+            batches = (dict(zip(BULK_FIELDS, itertools.izip_longest(*batch)))
+                       for batch in iter(lambda: list(
+                           itertools.islice(measures, batch_size)), []))
+        else:
+            size = max([column_length(values) or 1
+                        for values in columns.values()] or [1])
+            batches = (dict((field, values[start:start + batch_size]
+                             if column_length(values) is not None
+                             else values)
+                            for field, values in columns.items())
+                       for start in xrange(0, size, batch_size))
+
+        if self.columnar:
+            load = self._engine.loader()
+            for batch in batches:
+                load.insert(measure_rows(batch))
+            return writer_summary(load)
+
+        prepare_session(self)
+        writer = MeasureWriter(self, flush_size, commit_interval,
+                               append=append)
+
+        def insert():
+            try:
+                for batch in batches:
+                    for row in measure_rows(batch):
+                        writer.add(row)
+                    if writer.commit_due:
+                        writer.flush()
+                        writer.commit()
+                writer.flush()
+                writer.commit()
+                writer.close()
+            except:
+                writer.rollback()
+                raise
+
+        if bulk:
+            with self.bulk_load():
+                insert()
+        else:
+            insert()
+        summary = writer_summary(writer)
         log.logger(__name__).info(summary)
+        return summary
 
     def position_from_latlng(self, latitude, longitude):
         """
@@ -456,6 +677,8 @@ class CatalogueDatabase(object):
         """
         Returns a tuple with minimum and maximum date
         """
+        if self.columnar:
+            return self._engine.columns.time_bounds()
 
         date_min = self.session.query(
             func.min(MagnitudeMeasure.time)).first()[0]
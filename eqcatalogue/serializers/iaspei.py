@@ -0,0 +1,84 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# eqcatalogueTool is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# eqcatalogueTool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with eqcatalogueTool. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module exports measures to an IASPEI csv file, in the format read
+by :mod:`eqcatalogue.importers.iaspei`
+"""
+
+from eqcatalogue import log
+from eqcatalogue.serializers.streams import (
+    CHUNK_SIZE, open_output, measure_rows, events, origins)
+
+
+HEADER = ('  EVENTID,AUTHOR   ,DATE      ,TIME       ,LAT     ,LON      ,'
+          'DEPTH,DEPFIX,AUTHOR   ,TYPE  ,MAG ')
+
+
+def _clock_time(time):
+    """
+    Returns the time of the day of `time` as HH:MM:SS.ff, or with all
+    the digits of the microseconds if the hundredths are not enough
+    """
+    if time.microsecond % 10000:
+        fraction = '%06d' % time.microsecond
+    else:
+        fraction = '%02d' % (time.microsecond // 10000)
+    return '%02d:%02d:%02d.%s' % (time.hour, time.minute, time.second,
+                                  fraction)
+
+
+def origin_line(origin_rows):
+    """
+    Returns the line of an origin, given the measure rows of the
+    origin. The author of the line is the event source of the
+    measures.
+    """
+    first = origin_rows[0]
+    time = first.time
+    parts = ['%9s,%-9s,%04d-%02d-%02d,%s,%8.4f,%9.4f,%5s,%6s' % (
+        first.event_key, first.event_source, time.year, time.month,
+        time.day, _clock_time(time), first.latitude, first.longitude,
+        '' if first.depth is None else '%5.1f' % first.depth, '')]
+    for row in origin_rows:
+        parts.append('%-9s,%-6s,%4.1f' % (row.agency, row.scale, row.value))
+    return ','.join(parts)
+
+
+def export_measures(criteria, filename, header=True, chunk_size=CHUNK_SIZE,
+                    compression=None):
+    """
+    Export the measures satisfying `criteria` to the IASPEI csv file
+    `filename`, with a line for each origin of each event. If `header`
+    is true the first line of the file is the header. The measures
+    are read `chunk_size` at a time and the file is compressed as
+    `compression` (s.
+    :func:`~eqcatalogue.serializers.streams.open_output`).
+
+    :returns: the number of measures exported
+    """
+    measures = 0
+    with open_output(filename, compression) as output:
+        if header:
+            output.write(HEADER + '\n')
+        for event_rows in events(measure_rows(criteria, chunk_size)):
+            text = ''.join(origin_line(origin_rows) + '\n'
+                           for origin_rows in origins(event_rows))
+            output.write(text.encode('utf-8'))
+            measures += len(event_rows)
+
+    log.logger(__name__).info(
+        "Exported %d measures to %s" % (measures, filename))
+    return measures
@@ -0,0 +1,169 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# eqcatalogueTool is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# eqcatalogueTool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with eqcatalogueTool. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module exports measures to an ISF bulletin, in the format read
+by :mod:`eqcatalogue.importers.isf_bulletin`
+"""
+
+from eqcatalogue import log
+from eqcatalogue.importers.isf_bulletin import (ORIGIN_BLOCK_LENGTH,
+                                                MEASURE_BLOCK_LENGTH,
+                                                EVENT_REGEXP)
+from eqcatalogue.serializers.streams import (
+    CHUNK_SIZE, open_output, measure_rows, events, origins)
+
+
+HEADER = ['DATA_TYPE BULLETIN IMS1.0:short', 'ISC Bulletin']
+
+ORIGIN_HEADER = ('   Date       Time        Err   RMS Latitude Longitude  '
+                 'Smaj  Smin  Az Depth   Err Ndef Nsta Gap  mdist  Mdist '
+                 'Qual   Author      OrigID')
+
+MEASURE_HEADER = 'Magnitude  Err Nsta Author      OrigID'
+
+ERR_WIDTH = 'The line "%s" of event %s does not fit the ISF format'
+
+
+def _field(value, width):
+    """
+    Returns `value` formatted in a field of `width` characters with as
+    many decimals as fit, or a blank field if `value` is None
+    """
+    if value is None:
+        return ' ' * width
+    for decimals in xrange(width - 2, 0, -1):
+        text = '%*.*f' % (width, decimals, value)
+        if len(text) == width:
+            return text
+    return '%*d' % (width, round(value))
+
+
+def _azimuth(value):
+    """
+    Returns the azimuth field (an integer) of `value`
+    """
+    if value is None:
+        return '   '
+    return '%3d' % value
+
+
+def _hundredths(time):
+    """
+    Returns the hundredths of second field of `time`. The importer
+    reads the field as a number of microseconds (s.
+    :meth:`OriginBlockState._process_time
+    <eqcatalogue.importers.isf_bulletin.OriginBlockState._process_time>`),
+    so times imported from an ISF bulletin are written as read.
+    """
+    if time.microsecond < 100:
+        return time.microsecond
+    return time.microsecond // 10000
+
+
+def origin_line(row):
+    """
+    Returns the origin block line of the origin of the measure `row`.
+    The author of the origin is the agency of the measure. The
+    azimuth error is written at the columns read by the importer.
+    """
+    time = row.time
+    return ''.join([
+        '%04d/%02d/%02d %02d:%02d:%02d.%02d' % (
+            time.year, time.month, time.day, time.hour, time.minute,
+            time.second, _hundredths(time)),
+        '  ', _field(row.time_error, 5),
+        ' ', _field(row.time_rms, 5),
+        ' ', _field(row.latitude, 8),
+        ' ', _field(row.longitude, 9),
+        ' ', _field(row.semi_major_90error, 5),
+        ' ', _field(row.semi_minor_90error, 5),
+        ' ' * 5, _field(row.depth, 5),
+        '  ', _field(row.depth_error, 4),
+        ' ' * 11, _azimuth(row.azimuth_error),
+        ' ' * 22, '%-9s %8s' % (row.agency, row.origin_key)])
+
+
+def measure_line(row):
+    """
+    Returns the measure block line of the measure `row`
+    """
+    return '%-5s %s %s      %-9s %8s' % (
+        row.scale, _field(row.value, 4), _field(row.standard_error, 3),
+        row.agency, row.origin_key)
+
+
+def _checked(line, length, event_key):
+    """
+    Returns the block `line`, checking that it is `length` characters
+    long, i.e. that every value fits its field
+    """
+    if len(line) != length:
+        raise ValueError(ERR_WIDTH % (line, event_key))
+    return line
+
+
+def event_lines(event_rows):
+    """
+    Returns the lines of the block of an event, given the rows of its
+    measures (s. :func:`~eqcatalogue.serializers.streams.events`)
+
+    :raises ValueError: if a value does not fit its field, e.g. if the
+      event key is longer than 9 word characters
+    """
+    first = event_rows[0]
+    event_key = first.event_key
+    event_line = 'Event %9s %s' % (event_key, (first.event_name or '')[:65])
+    match = EVENT_REGEXP.match(event_line)
+    if match is None or match.group('source_event_id') != event_key:
+        raise ValueError(ERR_WIDTH % (event_line, event_key))
+    lines = [event_line, ORIGIN_HEADER]
+    for origin_rows in origins(event_rows):
+        lines.append(_checked(origin_line(origin_rows[0]),
+                              ORIGIN_BLOCK_LENGTH, event_key))
+    lines.extend(['', MEASURE_HEADER])
+    for row in event_rows:
+        lines.append(_checked(measure_line(row),
+                              MEASURE_BLOCK_LENGTH, event_key))
+    lines.append('')
+    return lines
+
+
+def export_measures(criteria, filename, chunk_size=CHUNK_SIZE,
+                    compression=None):
+    """
+    Export the measures satisfying `criteria` to the ISF bulletin
+    `filename`, one event at a time. The measures are read
+    `chunk_size` at a time and the file is compressed as
+    `compression` (s.
+    :func:`~eqcatalogue.serializers.streams.open_output`).
+
+    As the importer reads a single catalogue header, the event source
+    of the measures is not exported.
+
+    :returns: the number of measures exported
+    """
+    measures = 0
+    with open_output(filename, compression) as output:
+        output.write('\n'.join(HEADER) + '\n')
+        for event_rows in events(measure_rows(criteria, chunk_size)):
+            text = '\n'.join(event_lines(event_rows)) + '\n'
+            output.write(text.encode('utf-8'))
+            measures += len(event_rows)
+        output.write('STOP\n')
+
+    log.logger(__name__).info(
+        "Exported %d measures to %s" % (measures, filename))
+    return measures
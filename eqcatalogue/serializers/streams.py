@@ -0,0 +1,120 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# eqcatalogueTool is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# eqcatalogueTool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with eqcatalogueTool. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module defines the helpers shared by the streaming serializers:
+the measures of a criteria are read from the catalogue db in chunks,
+grouped by event on the fly and written to a buffered, optionally
+compressed, output file, so that the exported catalogue is never held
+in memory.
+"""
+
+import io
+import gzip
+import bz2
+import itertools
+import operator
+
+import sqlalchemy
+
+import eqcatalogue.models as db
+from eqcatalogue.importers.streams import GZIP, BZIP2
+
+
+# number of measures fetched from the catalogue db at once
+CHUNK_SIZE = 10000
+
+# size of the buffer of the output files
+BUFFER_SIZE = 1024 * 1024
+
+EXTENSIONS = {'.gz': GZIP, '.bz2': BZIP2}
+
+ERR_COMPRESSION = 'Unknown compression format %s'
+
+# the columns of the measure rows read by `measure_rows`, besides the
+# coordinates of the position
+EXPORT_FIELDS = ('event_source', 'event_key', 'event_name', 'agency',
+                 'origin_key', 'scale', 'value', 'standard_error', 'time',
+                 'time_error', 'time_rms', 'semi_major_90error',
+                 'semi_minor_90error', 'depth', 'depth_error',
+                 'azimuth_error')
+
+# the order of the measure rows, so that the measures of an event
+# (and of an origin) are contiguous
+EXPORT_ORDER = ('event_source', 'event_key', 'origin_key', 'time',
+                'agency', 'scale')
+
+_EVENT = operator.attrgetter('event_source', 'event_key')
+
+
+def open_output(filename, compression=None, buffer_size=BUFFER_SIZE):
+    """
+    Open the output file `filename` for writing through a buffer of
+    `buffer_size` bytes.
+
+    :param compression: the compression format of the file (`GZIP` or
+      `BZIP2`). If None, it is guessed by the extension of `filename`
+      (.gz or .bz2), otherwise the file is not compressed
+    """
+    if compression is None:
+        for extension, codec in EXTENSIONS.items():
+            if filename.endswith(extension):
+                compression = codec
+    if compression == GZIP:
+        return io.BufferedWriter(gzip.GzipFile(filename, 'wb'), buffer_size)
+    elif compression == BZIP2:
+        return bz2.BZ2File(filename, 'w', buffering=buffer_size)
+    elif compression:
+        raise ValueError(ERR_COMPRESSION % compression)
+    return io.open(filename, 'wb', buffering=buffer_size)
+
+
+def measure_rows(criteria, chunk_size=CHUNK_SIZE):
+    """
+    Returns an iterator over the measures satisfying `criteria` (a
+    :class:`~eqcatalogue.filtering.Criteria`), as rows holding the
+    `EXPORT_FIELDS` and the `latitude` and `longitude` of the position,
+    ordered as `EXPORT_ORDER`. The rows are fetched `chunk_size` at a
+    time and no measure object is built.
+    """
+    columns = [getattr(db.MagnitudeMeasure, field)
+               for field in EXPORT_FIELDS]
+    engine = db.CatalogueDatabase().engine
+    columns.append(sqlalchemy.literal_column(
+        engine.LATITUDE_SQL).label('latitude'))
+    columns.append(sqlalchemy.literal_column(
+        engine.LONGITUDE_SQL).label('longitude'))
+    queryset = criteria.filter().order_by(
+        *[getattr(db.MagnitudeMeasure, field) for field in EXPORT_ORDER])
+    return queryset.yield_per(chunk_size).values(*columns)
+
+
+def events(rows):
+    """
+    Group the measure `rows` (s. :func:`measure_rows`) by event.
+    Returns an iterator over the lists of the rows of each event.
+    """
+    for _, event_rows in itertools.groupby(rows, _EVENT):
+        yield list(event_rows)
+
+
+def origins(event_rows):
+    """
+    Group the rows of an event by origin. Returns an iterator over
+    the lists of the rows of each origin.
+    """
+    for _, origin_rows in itertools.groupby(
+            event_rows, operator.attrgetter('origin_key')):
+        yield list(origin_rows)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# eqcataloguetool is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EqCatalogueTool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with eqcataloguetool. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Micro-benchmark of the decoding of the dates and times of the
+importers: `datetime.strptime` called for each entry against the bulk
+decoding of :mod:`eqcatalogue.importers.dates`.
+"""
+
+import argparse
+import random
+import timeit
+from datetime import datetime, timedelta
+
+from eqcatalogue.importers.dates import decode_times, format_times
+from eqcatalogue.importers.writer import format_time
+
+
+def build_entries(size, seed=42):
+    """
+    Returns two lists of `size` random dates and times, formatted as
+    in the IASPEI catalogues
+    """
+    rnd = random.Random(seed)
+    start = datetime(1900, 1, 1)
+    dates, times = [], []
+    for _ in xrange(size):
+        time = start + timedelta(seconds=rnd.randint(0, 3600 * 24 * 40000),
+                                 microseconds=rnd.randint(0, 99) * 10000)
+        dates.append(time.strftime('%Y-%m-%d'))
+        times.append(time.strftime('%H:%M:%S.') + '%02d' % (
+            time.microsecond / 10000))
+    return dates, times
+
+
+def with_strptime(dates, times):
+    return [format_time(datetime.strptime('%s/%s' % (date, time),
+                                          '%Y-%m-%d/%H:%M:%S.%f'))
+            for date, time in zip(dates, times)]
+
+
+def in_bulk(dates, times):
+    return format_times(decode_times(dates, times)[0])
+
+
+def build_cmd_parser():
+    """Create a parser for cmdline arguments"""
+
+    p = argparse.ArgumentParser(prog='BenchmarkDates')
+    p.add_argument('-n', '--entries', type=int, default=100000,
+                   help='Number of dates decoded by each run',
+                   dest='entries')
+    p.add_argument('-r', '--repeat', type=int, default=3,
+                   help='Number of runs (the best one is reported)',
+                   dest='repeat')
+    return p
+
+
+if __name__ == '__main__':
+    args = build_cmd_parser().parse_args()
+    dates, times = build_entries(args.entries)
+    assert with_strptime(dates, times) == in_bulk(dates, times)
+    for decoder in (with_strptime, in_bulk):
+        best = min(timeit.repeat(lambda: decoder(dates, times),
+                                 repeat=args.repeat, number=1))
+        print '%-14s %8.3fs %12.0f dates/s' % (
+            decoder.__name__, best, args.entries / best)
@@ -21,9 +21,11 @@ import os
 import argparse
 
 from eqcatalogue import CatalogueDatabase
-from eqcatalogue.importers import V1, Iaspei, store_events
+from eqcatalogue.importers import (
+    V1, IscHtml, Iaspei, Csv1, store_events, open_input)
+from eqcatalogue.importers.batch import BatchLoader, expand_inputs
 
-fmt_map = {'isf': V1, 'iaspei': Iaspei}
+fmt_map = {'isf': V1, 'html': IscHtml, 'iaspei': Iaspei, 'csv1': Csv1}
 
 
 def build_cmd_parser():
@@ -32,21 +34,43 @@ def build_cmd_parser():
     p = argparse.ArgumentParser(prog='LoadCatalogueDB')
 
     p.add_argument('-i', '--input-file',
-                   nargs=1,
+                   nargs='+',
                    type=str,
                    metavar='input catalogue file',
                    dest='input_file',
-                   help=('Specify the input file containing earthquake'
-                         'events supported formats are ISF and IASPEI'))
+                   help=('Specify the input files (or glob patterns) '
+                         'containing earthquake events, supported formats '
+                         'are ISF, ISC web query pages (HTML), IASPEI and '
+                         'csv1, optionally compressed '
+                         'with gzip, bzip2 or xz. The format of a file can '
+                         'be given as a prefix, e.g. iaspei:events.csv'))
 
     p.add_argument('-f', '--format-type',
                    nargs=1,
                    type=str,
-                   help=('Specify the earthquake catalogue format,'
-                         'valid formats are: isf, iaspei'),
+                   help=('Specify the earthquake catalogue format of the '
+                         'input files without a format prefix, '
+                         'valid formats are: isf, html, iaspei, csv1'),
                    metavar='format type',
                    dest='format_type')
 
+    p.add_argument('-p', '--processes',
+                   type=int,
+                   default=None,
+                   help=('Number of worker processes parsing the input '
+                         'files (the default is the number of cpus). Many '
+                         'input files are always parsed by workers'),
+                   metavar='processes',
+                   dest='processes')
+
+    p.add_argument('-q', '--queue-size',
+                   type=int,
+                   default=None,
+                   help=('Maximum number of parsed batches waiting to be '
+                         'written into the database'),
+                   metavar='queue size',
+                   dest='queue_size')
+
     p.add_argument('-d', '--drop-database',
                    action='store_true',
                    help=('Drop the database if present'),
@@ -59,24 +83,89 @@ def build_cmd_parser():
                    help='Specify db filename',
                    metavar='db filename',
                    dest='db_filename')
+
+    p.add_argument('-r', '--resume',
+                   action='store_true',
+                   help=('Resume the import of a partially loaded input '
+                         'file from its last checkpoint'),
+                   dest='resume')
+
+    p.add_argument('-b', '--bulk',
+                   action='store_true',
+                   help=('Build the indexes of the database once, after '
+                         'the input file has been loaded (faster for '
+                         'large files)'),
+                   dest='bulk')
+
+    p.add_argument('-a', '--append',
+                   action='store_true',
+                   help=('Skip the measures already stored in the database '
+                         'and replace the changed ones'),
+                   dest='append')
+
+    p.add_argument('-n', '--validate',
+                   action='store_true',
+                   help=('Only parse the input files and report the '
+                         'parsing failures, without opening the database'),
+                   dest='validate')
     return p
 
 
+def split_format(pattern, default_fmt):
+    """
+    Returns the input file pattern and the format given by its prefix
+    (e.g. iaspei:events.csv), or `default_fmt` if it has none
+    """
+    fmt, sep, rest = pattern.partition(':')
+    if sep and fmt.lower() in fmt_map:
+        return rest, fmt.lower()
+    return pattern, default_fmt
+
+
 def check_args(arguments):
-    input_file = arguments.input_file[0]
-    fmt_file = arguments.format_type[0]
-    fname = (os.path.abspath(input_file)
-             if os.path.exists(input_file) else None)
-    cat_fmt = (fmt_file.lower()
-               if fmt_file.lower() in ['isf', 'iaspei']
-               else None)
-    if fname is None:
-        print 'Can\'t find the provided input file'
-        sys.exit(-1)
-    if cat_fmt is None:
+    """
+    Returns the list of the input files, each with its format
+    """
+    fmt_file = arguments.format_type[0] if arguments.format_type else None
+    if fmt_file is not None and fmt_file.lower() not in fmt_map:
         print 'Format %s is not supported' % fmt_file
         sys.exit(-1)
-    return fname, cat_fmt
+    default_fmt = fmt_file.lower() if fmt_file is not None else None
+
+    inputs = []
+    for pattern in arguments.input_file:
+        pattern, cat_fmt = split_format(pattern, default_fmt)
+        if cat_fmt is None:
+            print 'The format of %s is not specified' % pattern
+            sys.exit(-1)
+        for input_file in expand_inputs([pattern]):
+            if not os.path.exists(input_file):
+                print 'Can\'t find the provided input file %s' % input_file
+                sys.exit(-1)
+            inputs.append((os.path.abspath(input_file), cat_fmt))
+    if not inputs:
+        print 'No input file provided'
+        sys.exit(-1)
+    return inputs
+
+
+def validate(inputs, processes):
+    """
+    Validate the `inputs`, printing the report of each one. Returns
+    the exit status: -1 if any failure has been found, 0 otherwise.
+    """
+    status = 0
+    for filename, cat_format in inputs:
+        with open_input(filename) as cat_file:
+            report = fmt_map[cat_format].validate(cat_file,
+                                                  processes=processes)
+        report.filename = filename
+        print report
+        for failure in report.failures:
+            print '  %s' % failure
+        if not report.valid:
+            status = -1
+    return status
 
 
 if __name__ == '__main__':
@@ -85,11 +174,32 @@ if __name__ == '__main__':
         parser.print_help()
     else:
         args = parser.parse_args()
-        filename, cat_format = check_args(args)
+        inputs = check_args(args)
+        if args.validate:
+            sys.exit(validate(inputs, args.processes))
         cat_dbname = (args.db_filename[0] if isinstance(args.db_filename, list)
                       else args.db_filename)
-        with open(filename, 'r') as cat_file:
-            cat_db = CatalogueDatabase(filename=cat_dbname,
-                                       drop=args.drop_database)
-            store_events(fmt_map[cat_format], cat_file, cat_db)
+        cat_db = CatalogueDatabase(filename=cat_dbname,
+                                   drop=args.drop_database)
+        if len(inputs) == 1 and args.processes is None:
+            filename, cat_format = inputs[0]
+            with open_input(filename) as cat_file:
+                store_events(fmt_map[cat_format], cat_file, cat_db,
+                             resume=args.resume, bulk=args.bulk,
+                             append=args.append)
+        else:
+            if args.resume:
+                parser.error('--resume requires a single input file')
+            loader = BatchLoader(cat_db, processes=args.processes,
+                                 queue_size=args.queue_size,
+                                 append=args.append)
+            inputs = [(filename, fmt_map[cat_format])
+                      for filename, cat_format in inputs]
+            if args.bulk:
+                with cat_db.bulk_load():
+                    loader.load(inputs)
+            else:
+                loader.load(inputs)
+            for line in loader.report():
+                print line
         sys.exit(0)
@@ -13,9 +13,16 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with eqcatalogueTool. If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import shutil
+import tempfile
+import threading
 from datetime import datetime
 import unittest
+import sqlalchemy
+import numpy as np
 from eqcatalogue import models as catalogue
+from eqcatalogue import filtering
 import geoalchemy
 from tests.test_utils import in_data_dir
 
@@ -96,3 +103,168 @@ class ShouldCreateAlchemyTestCase(unittest.TestCase):
             catalogue.CatalogueDatabase.MEASURE_SCALES:
             set([u'mL', u'mb'])},
             self.catalogue.get_summary())
+
+    def test_bulk_insert_columns(self):
+        summary = self.catalogue.bulk_insert(
+            time=np.array(['2001-05-02T03:07:11.88', '2001-05-03T00:00:00',
+                           '2001-05-04T12:30:00'], dtype='M8[us]'),
+            latitude=np.array([32.6, 33.1, -12.5]),
+            longitude=np.array([85.4, 86.2, 120.0]),
+            depth=np.array([10.0, np.nan, 35.0]),
+            agency='SIM', scale=np.array(['Mw', 'Mw', 'mb']),
+            value=np.array([4.5, 5.1, 6.2]), event_source='synthetic',
+            event_key=np.arange(3), batch_size=2)
+
+        self.assertEqual({'EventSources_Created': 1, 'Agencies_Created': 1,
+                          'Origins_Created': 3, 'Measures_Created': 3},
+                         summary)
+        measure = self.session.query(catalogue.MagnitudeMeasure).filter_by(
+            event_key='1').one()
+        self.assertEqual(
+            ('synthetic', '1', 'SIM', 'Mw', 5.1, None, None,
+             datetime(2001, 5, 3)),
+            (measure.event_source, measure.origin_key, measure.agency,
+             measure.scale, measure.value, measure.standard_error,
+             measure.depth, measure.time))
+
+    def test_coordinates(self):
+        self.create_test_fixture()
+        self.session.commit()
+        self.session.expunge_all()
+
+        measure = self.session.query(catalogue.MagnitudeMeasure).filter_by(
+            event_key='1st').one()
+        self.assertEqual((-81.40, 38.08), measure.position_as_tuple())
+        # the geometry is not loaded to read the coordinates
+        self.assertFalse('position' in measure.__dict__)
+
+    def test_bulk_insert_tuples(self):
+        measures = [(datetime(1950, 2, 19, 23, 14, 5), 10.0, 20.0, 5.0,
+                     'Tatooine', 'mL', 4.0, 0.1, 'AnEventSource', 'first'),
+                    (datetime(1987, 2, 6, 9, 14, 15), 11.0, 21.0, None,
+                     'Alderaan', 'mb', 5.5, None, 'AnEventSource', 'second',
+                     'an origin')]
+        self.catalogue.bulk_insert(iter(measures))
+        summary = self.catalogue.bulk_insert(measures, append=True)
+
+        self.assertEqual({'Measures_Skipped': 2}, summary)
+        self.assertEqual(set(['Tatooine', 'Alderaan']),
+                         self.catalogue.get_agencies())
+        self.assertEqual(['first', 'an origin'],
+                         [measure.origin_key for measure in self.session.query(
+                             catalogue.MagnitudeMeasure).order_by('time')])
+
+    def test_bulk_insert_requires_the_keys(self):
+        with self.assertRaises(ValueError):
+            self.catalogue.bulk_insert(time=[datetime(2000, 1, 1)],
+                                       latitude=[1], longitude=[2],
+                                       agency=['A'], scale=['M'], value=[3],
+                                       event_key=['1'])
+
+
+class ShouldUseAPlainSqliteDatabase(ShouldCreateAlchemyTestCase):
+    """
+    Run the catalogue tests against the engine without spatialite
+    """
+
+    def setUp(self):
+        self.catalogue = catalogue.CatalogueDatabase(
+            engine='eqcatalogue.datastores.sqlite', memory=True)
+        self.session = self.catalogue.session
+
+    def tearDown(self):
+        self.session.commit()
+        catalogue.CatalogueDatabase(memory=True, drop=True)
+
+    def bulk_insert(self, latitude=(10., 12., 12.5, 40.)):
+        return self.catalogue.bulk_insert(
+            latitude=latitude, longitude=[90., 93., 94., 93.],
+            time=[datetime(2001, 1, day) for day in range(1, 5)],
+            agency='SIM', scale='Mw', value=[4., 5., 6., 7.],
+            event_source='synthetic', event_key=np.arange(4))
+
+    def test_position(self):
+        self.create_test_fixture()
+        measure = self.session.query(catalogue.MagnitudeMeasure).first()
+
+        self.assertEqual((-81.4, 38.08), measure.position_as_tuple())
+        self.assertEqual((-81.4, 38.08),
+                         (measure.longitude, measure.latitude))
+
+    def test_spatial_filters(self):
+        polygon = 'POLYGON((92 15, 95 15, 95 10, 92 10, 92 15))'
+        with self.catalogue.bulk_load():
+            self.bulk_insert()
+        self.assertEqual(
+            ['1', '2'], sorted(m.event_key for m in filtering.C(
+                within_polygon=polygon)))
+        self.assertEqual(
+            ['0', '1'], sorted(m.event_key for m in filtering.C(
+                within_distance_from_point=('POINT(91 11)', 250000))))
+
+        # replaced measures are indexed by their new position
+        self.bulk_insert(latitude=[10., 12., 30., 14.])
+        self.assertEqual(
+            ['1', '3'], sorted(m.event_key for m in filtering.C(
+                within_polygon=polygon)))
+        self.assertEqual(4, self.session.execute(
+            "SELECT count(*) FROM catalogue_measureposition").scalar())
+
+
+class ShouldReadWhileWriting(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.catalogue = catalogue.CatalogueDatabase(
+            filename=os.path.join(self.directory, 'catalogue.db'),
+            drop=True, readers=2)
+
+    def tearDown(self):
+        catalogue.CatalogueDatabase(memory=True, drop=True)
+        shutil.rmtree(self.directory)
+
+    def add_measures(self, event_source):
+        session = self.catalogue.session
+        for day in range(1, 4):
+            session.add(catalogue.MagnitudeMeasure(
+                time=datetime(2001, 1, day), agency='SIM', scale='Mw',
+                value=4., event_source=event_source, event_key=str(day),
+                origin_key=str(day),
+                position=geoalchemy.WKTSpatialElement('POINT(90 10)')))
+        session.flush()
+
+    def read(self, results):
+        session = self.catalogue.session
+        results.append((session is self.catalogue.session,
+                        len(filtering.C())))
+        try:
+            session.execute("DELETE FROM catalogue_magnitudemeasure")
+        except sqlalchemy.exc.OperationalError:
+            results.append('read-only')
+        session.rollback()
+        session.close()
+
+    def test_concurrent_readers(self):
+        self.assertEqual('wal', self.catalogue.session.execute(
+            "PRAGMA journal_mode").scalar())
+        self.add_measures('committed')
+        self.catalogue.session.commit()
+        self.add_measures('pending')
+
+        results = []
+        readers = [threading.Thread(target=self.read, args=(results,))
+                   for _ in range(3)]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+
+        # the readers append their results in any order
+        self.assertEqual(6, len(results))
+        self.assertEqual(3, results.count((True, 3)))
+        self.assertEqual(3, results.count('read-only'))
+        self.assertEqual(6, len(filtering.C()))
+
+    def test_no_readers_in_memory(self):
+        with self.assertRaises(ValueError):
+            catalogue.CatalogueDatabase(memory=True, readers=2)
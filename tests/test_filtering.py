@@ -26,6 +26,7 @@ from eqcatalogue.importers.csv1 import CsvEqCatalogueReader, Converter
 from eqcatalogue import models
 from eqcatalogue import exceptions
 from eqcatalogue import filtering
+from eqcatalogue import grouping
 
 
 #FIX ME: Must be removed and replaced!
@@ -265,3 +266,70 @@ class TestCriteriaFactory(unittest.TestCase):
 
         self.assertRaises(exceptions.InvalidCriteria,
                           filtering.C, kwargs={'wtf': 3})
+
+
+class AColumnarCriteriaShould(ACriteriaShould):
+    """
+    Run the criteria tests against the columnar engine
+    """
+
+    def setUp(self):
+        self.cat_db = models.CatalogueDatabase(
+            engine='eqcatalogue.datastores.columnar')
+        self.session = self.cat_db.session
+        load_fixtures(self.session)
+
+    def tearDown(self):
+        models.CatalogueDatabase(memory=True, drop=True)
+
+    def test_replaces_measures_imported_twice(self):
+        self.assertEqual(30, len(filtering.C()))
+        load_fixtures(self.session)
+        self.assertEqual(30, len(filtering.C()))
+        self.assertEqual(30, len(set(m.id for m in filtering.C())))
+
+    def test_returns_the_same_measure_objects(self):
+        criteria = filtering.C(scale='mb')
+        self.assertEqual(list(criteria), criteria.all())
+        self.assertTrue(criteria[0] is list(criteria)[0])
+
+    def test_returns_slotted_measures(self):
+        self.cat_db.bulk_insert(
+            time=[datetime(2001, 1, 1)], latitude=[12.], longitude=[93.],
+            agency='SIM', scale='Mw', value=[9.1], event_source='simulation',
+            event_key=['1'])
+        measure = filtering.WithAgencies(['SIM'])[0]
+
+        self.assertFalse(hasattr(measure, '__dict__'))
+        self.assertEqual((93., 12.), measure.position_as_tuple())
+        converted = measure.convert(9.2, mock.Mock(target_scale='Ms'), 0.1)
+        self.assertTrue(converted.original_measure is measure)
+        self.assertEqual('Ms', converted.scale)
+
+    def test_allows_grouping_by_sequential_clustering(self):
+        groups = grouping.GroupMeasuresBySequentialClustering(
+            time_window=10, space_window=200).group_measures(filtering.C())
+        by_key = grouping.GroupMeasuresByEventSourceKey().group_measures(
+            filtering.C())
+
+        self.assertEqual(
+            sorted(sorted(m.id for m in group) for group in by_key.values()),
+            sorted(sorted(m.id for m in group) for group in groups.values()))
+
+    def test_refuses_to_resume_an_import(self):
+        with self.assertRaises(NotImplementedError):
+            self.cat_db.load_file(in_data_dir('isf_two_events.txt'),
+                                  'isf_bulletin', resume=True)
+
+    def test_allows_bulk_insert(self):
+        summary = self.cat_db.bulk_insert(
+            time=[datetime(2001, 1, 1), datetime(2001, 1, 2)],
+            latitude=[12., 20.], longitude=[93., 92.], agency='SIM',
+            scale='Mw', value=[9.1, 9.2], event_source='simulation',
+            event_key=['1', '2'])
+        self.assertEqual(2, summary['Measures_Created'])
+        self.assertEqual(32, len(filtering.C()))
+        self.assertEqual(2, len(filtering.WithMagnitudeGreater(9)))
+        self.assertEqual(1, len(filtering.WithinPolygon(
+            'POLYGON((92 15, 95 15, 95 10, 92 10, 92 15))') &
+            filtering.WithAgencies(['SIM'])))
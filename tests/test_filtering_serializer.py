@@ -13,10 +13,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with eqcatalogueTool. If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import shutil
 import tempfile
 import unittest
 from eqcatalogue import filtering
-from eqcatalogue.serializers import csv_
+from eqcatalogue.models import CatalogueDatabase
+from eqcatalogue.serializers import csv_, isf, iaspei
 
 from tests import test_utils
 
@@ -43,3 +46,70 @@ class ShouldExportMeasures(unittest.TestCase):
 
         csv_.export_measures(measures, filename=csv_file.name)
         self.assertEqual(self.EXPECTED_CSV_1, csv_file.read())
+
+
+class ShouldExportBulletins(unittest.TestCase):
+
+    FIELDS = ['event_key', 'agency', 'scale', 'value', 'time', 'depth']
+
+    ISF_FIELDS = FIELDS + [
+        'event_source', 'event_name', 'origin_key', 'standard_error',
+        'time_error', 'time_rms', 'semi_major_90error',
+        'semi_minor_90error', 'depth_error', 'azimuth_error']
+
+    def setUp(self):
+        test_utils.load_catalog()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _measures(self, criteria, fields):
+        return sorted(
+            tuple(getattr(measure, field) for field in fields) +
+            measure.position_as_tuple() for measure in criteria)
+
+    def _reload(self, filename, importer):
+        CatalogueDatabase(memory=True, drop=True).load_file(
+            filename, importer)
+
+    def test_isf_round_trip(self):
+        criteria = filtering.C(agency__in=['ISC', 'NEIC'])
+        exported = self._measures(criteria, self.ISF_FIELDS)
+        filename = os.path.join(self.tmpdir, 'bulletin.txt.gz')
+
+        self.assertEqual(len(exported),
+                         isf.export_measures(criteria, filename,
+                                             chunk_size=7))
+        self._reload(filename, 'isf_bulletin')
+        self.assertEqual(exported,
+                         self._measures(filtering.C(), self.ISF_FIELDS))
+
+    def test_iaspei_round_trip(self):
+        criteria = filtering.C(scale='mb')
+        exported = self._measures(criteria, self.FIELDS)
+        filename = os.path.join(self.tmpdir, 'catalogue.csv')
+
+        self.assertEqual(len(exported),
+                         iaspei.export_measures(criteria, filename,
+                                                compression='bz2'))
+        self._reload(filename, 'iaspei')
+        self.assertEqual(exported,
+                         self._measures(filtering.C(), self.FIELDS))
+        self.assertEqual(set(['IASPEI']), set(
+            measure.event_source for measure in filtering.C()))
+
+    def test_check_the_width_of_isf_fields(self):
+        measure = filtering.C(agency='ISC')[0]
+        measure.agency = 'LONGAGENCY'
+        CatalogueDatabase().session.flush()
+        self.assertRaises(ValueError, isf.export_measures,
+                          filtering.C(), os.path.join(self.tmpdir, 'isf'))
+
+    def test_check_the_isf_event_keys(self):
+        for event_key in ('1234567890', 'key-1'):
+            measure = filtering.C(agency='ISC')[0]
+            measure.event_key = event_key
+            CatalogueDatabase().session.flush()
+            self.assertRaises(ValueError, isf.export_measures,
+                              filtering.C(), os.path.join(self.tmpdir, 'isf'))
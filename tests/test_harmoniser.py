@@ -387,3 +387,16 @@ class ConversionFormulaTestCase(unittest.TestCase):
             measure_uncertainty=0.4)
         self.assertAlmostEqual(0.44721, fst_converted_measure.standard_error,
             places=5)
+
+    def test_converted_measures_share_the_original_data(self):
+        measure = self.measures[0]
+        converted = measure.convert(4., self.conv_l_formula, 0.2).convert(
+            19., self.conv_p_formula, 0.3)
+
+        self.assertTrue(converted.original_measure is measure)
+        self.assertTrue(converted.time is measure.time)
+        self.assertEqual(measure.position_as_tuple(),
+                         converted.position_as_tuple())
+        self.assertEqual([self.conv_l_formula, self.conv_p_formula],
+                         converted.formulas)
+        self.assertFalse(hasattr(converted, '__dict__'))
@@ -13,16 +13,35 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with eqcatalogueTool. If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import re
+import bz2
+import gzip
+import shutil
+import tempfile
 import unittest
+from datetime import datetime
 from StringIO import StringIO
 
 
 from eqcatalogue.importers import (
-    CsvEqCatalogueReader, Converter, BaseImporter, Iaspei, V1)
+    CsvEqCatalogueReader, Converter, BaseImporter, Csv1, Iaspei, IscHtml,
+    V1)
 
+from eqcatalogue.importers.batch import BatchLoader
+from eqcatalogue.importers.streams import open_input, detect_codec
+from eqcatalogue.importers.isc_html import PreformattedText
+from eqcatalogue.importers.isf_bulletin import BulletinParser
+from eqcatalogue.importers.dates import decode_times, format_times
+from eqcatalogue.importers.writer import (
+    MeasureWriter, RowBuffer, format_time, position_wkt)
+from eqcatalogue.importers.isf_records import (
+    BulletinRecords, ORIGIN_RECORD, MEASURE_RECORD, ORIGIN_RECORD_DTYPE,
+    MEASURE_RECORD_DTYPE, decode_origins, decode_measures)
 from eqcatalogue.importers.reader_utils import (STR_TRANSF, INT_TRANSF,
                                                 FLOAT_TRANSF)
 from eqcatalogue.exceptions import InvalidMagnitudeSeq
+from sqlalchemy.exc import IntegrityError
 
 from eqcatalogue import models as catalogue
 
@@ -32,7 +51,10 @@ from tests.test_utils import in_data_dir
 DATAFILE_ISC = in_data_dir('isc-query-small.html')
 BROKEN_ISC = in_data_dir('broken_isc.txt')
 UK_SCALE_ISC = in_data_dir('isc_with_uk_scale.txt')
+TWO_EVENTS_ISC = in_data_dir('isf_two_events.txt')
+THREE_EVENTS_ISC = in_data_dir('isf_three_events.txt')
 DATAFILE_IASPEI = in_data_dir('iaspei.csv')
+DATAFILE_CSV1 = in_data_dir('query_catalogue.csv')
 
 
 class ShouldImportFromISFBulletinV1(unittest.TestCase):
@@ -76,11 +98,288 @@ class ShouldImportFromISFBulletinV1(unittest.TestCase):
 
         self.assertEqual(measures.count(),  334)
 
+    def test_store_with_small_batches(self):
+        v1_importer = V1(self.f, self.cat)
+        v1_importer.store(flush_size=7, commit_interval=50)
+
+        self.assertEqual(v1_importer.summary, {
+            BaseImporter.EVENT_SOURCE: 1,
+            BaseImporter.AGENCY: 16,
+            BaseImporter.ORIGIN: 126,
+            BaseImporter.MEASURE:  334})
+
+    def test_summary_of_an_append(self):
+        V1(self.f, self.cat).store()
+
+        with open(DATAFILE_ISC) as stream:
+            importer = V1(stream, self.cat)
+            importer.store()
+        self.assertEqual({}, importer.summary)
+
+        importer = V1(self.uk_scale_isc, self.cat)
+        importer.store()
+        self.assertEqual(importer.summary, {
+            BaseImporter.AGENCY: 2,
+            BaseImporter.ORIGIN: 4,
+            BaseImporter.MEASURE:  4})
+
+    def test_skip_the_measures_already_stored(self):
+        V1(self.f, self.cat).store()
+
+        with open(DATAFILE_ISC) as stream:
+            importer = V1(stream, self.cat)
+            importer.store(flush_size=10, append=True)
+        self.assertEqual({BaseImporter.SKIPPED: 335}, importer.summary)
+
+        importer = V1(self.uk_scale_isc, self.cat)
+        importer.store(append=True)
+        self.assertEqual(importer.summary, {
+            BaseImporter.AGENCY: 2,
+            BaseImporter.ORIGIN: 4,
+            BaseImporter.MEASURE:  4})
+
     def test_raises_parsing_failure(self):
         importer = V1(self.broken_isc, self.cat)
         importer.store()
         self.assertEqual(1, len(importer.errors))
 
+    def test_parallel_store(self):
+        v1_importer = V1(self.f, self.cat)
+        v1_importer.store(processes=2, chunk_size=4096)
+
+        self.assertEqual(v1_importer.summary, {
+            BaseImporter.EVENT_SOURCE: 1,
+            BaseImporter.AGENCY: 16,
+            BaseImporter.ORIGIN: 126,
+            BaseImporter.MEASURE:  334})
+        self.assertEqual([], v1_importer.errors)
+
+    def test_parallel_store_reports_parsing_failure(self):
+        importer = V1(self.broken_isc, self.cat)
+        importer.store(processes=2, chunk_size=1)
+
+        self.assertEqual(1, len(importer.errors))
+        self.assertIn('The line 18 violates', str(importer.errors[0]))
+
+    def _store_with_a_broken_event(self, **kwargs):
+        with open(TWO_EVENTS_ISC) as bulletin:
+            lines = bulletin.readlines()
+        lines.insert(lines.index('mL     4.0          ARO        2199503\n'),
+                     'just a line that make the importer fail\n')
+        importer = V1(StringIO(''.join(lines)), self.cat)
+        importer.store(**kwargs)
+
+        # the lines following the failure up to the next event are
+        # rejected too
+        self.assertEqual(['The line 27 violates', 'The line 28 violates'],
+                         [str(error)[:20] for error in importer.errors])
+        self.assertEqual(importer.summary, {
+            BaseImporter.EVENT_SOURCE: 1,
+            BaseImporter.AGENCY: 2,
+            BaseImporter.ORIGIN: 4,
+            BaseImporter.MEASURE: 4})
+        self.assertEqual(
+            ['894327'] * 4,
+            [measure.event_key for measure in self.cat.session.query(
+                catalogue.MagnitudeMeasure)])
+
+    def test_discard_only_the_event_with_a_parsing_failure(self):
+        self._store_with_a_broken_event(flush_size=1)
+
+    def test_discard_a_broken_event_after_a_commit(self):
+        self._store_with_a_broken_event(flush_size=1, commit_interval=1)
+
+    def test_discard_only_the_event_violating_a_constraint(self):
+        self.cat.session.execute(
+            "CREATE TRIGGER reject_event BEFORE INSERT ON "
+            "catalogue_magnitudemeasure WHEN NEW.event_key = '1015294' "
+            "BEGIN SELECT RAISE(ABORT, 'rejected'); END")
+        for kwargs in ({'flush_size': 1},
+                       {'processes': 2, 'chunk_size': 1, 'flush_size': 1},
+                       {'processes': 2, 'chunk_size': 4096}):
+            self.cat.session.execute(
+                "DELETE FROM catalogue_magnitudemeasure")
+            with open(TWO_EVENTS_ISC) as bulletin:
+                importer = V1(bulletin, self.cat)
+                importer.store(**kwargs)
+
+            self.assertTrue(importer.errors)
+            self.assertEqual(
+                ['894327'] * 4,
+                [measure.event_key for measure in self.cat.session.query(
+                    catalogue.MagnitudeMeasure)])
+
+    def _store_rejecting(self, event_key, lines):
+        """
+        Store the three events bulletin in every mode, with a trigger
+        rejecting the measures of `event_key`, whose event block spans
+        `lines`, and check that only its measures are discarded
+        """
+        self.cat.session.execute(
+            "CREATE TRIGGER reject_event BEFORE INSERT ON "
+            "catalogue_magnitudemeasure WHEN NEW.event_key = '%s' "
+            "BEGIN SELECT RAISE(ABORT, 'rejected'); END" % event_key)
+        stored = ['894327'] * 4 + ['1015294'] * 2 + ['1015301'] * 2
+        stored = sorted(key for key in stored if key != event_key)
+        for kwargs in ({}, {'flush_size': 1}, {'commit_interval': 1},
+                       {'memory_map': True, 'commit_interval': 1},
+                       {'processes': 2, 'chunk_size': 1, 'flush_size': 1},
+                       {'processes': 2, 'chunk_size': 4096},
+                       {'processes': 2, 'chunk_size': 1,
+                        'commit_interval': 1}):
+            self.cat.session.execute(
+                "DELETE FROM catalogue_magnitudemeasure")
+            with open(THREE_EVENTS_ISC) as bulletin:
+                importer = V1(bulletin, self.cat)
+                importer.store(**kwargs)
+
+            self.assertTrue(importer.errors)
+            for error in importer.errors:
+                line_num = int(re.search(r'\d+', str(error)).group())
+                self.assertTrue(line_num in lines, (kwargs, line_num))
+            self.assertEqual(
+                stored,
+                sorted(measure.event_key for measure in
+                       self.cat.session.query(catalogue.MagnitudeMeasure)))
+
+    def test_discard_only_the_first_event_violating_a_constraint(self):
+        self._store_rejecting('894327', range(3, 18))
+
+    def test_discard_only_the_middle_event_violating_a_constraint(self):
+        self._store_rejecting('1015294', range(18, 29))
+
+    def test_discard_only_the_last_event_violating_a_constraint(self):
+        self._store_rejecting('1015301', range(29, 42))
+
+    def test_release_the_origins_of_the_previous_events(self):
+        rows = RowBuffer()
+        parser = BulletinParser(rows)
+        with open(TWO_EVENTS_ISC) as bulletin:
+            for line_num, line in enumerate(bulletin, 1):
+                parser.feed(line_num, line)
+
+        self.assertEqual(6, len(rows))
+        self.assertEqual(['2199502', '2199503', '2199504'],
+                         sorted(parser.context['origins']))
+
+    def _measure_indexes(self):
+        return set(
+            row[1] for row in self.cat.session.execute(
+                "PRAGMA index_list(catalogue_magnitudemeasure)")
+            if row[1].startswith('ix_'))
+
+    def test_bulk_store(self):
+        indexes = self._measure_indexes()
+        indexes_while_loading = []
+
+        V1(self.uk_scale_isc, self.cat).store()
+        importer = V1(self.f, self.cat)
+        with self.cat.bulk_load():
+            importer.store(
+                commit_interval=50,
+                on_metrics=lambda _: indexes_while_loading.append(
+                    self._measure_indexes()))
+
+        self.assertEqual(importer.summary, {
+            BaseImporter.AGENCY: 16,
+            BaseImporter.ORIGIN: 126,
+            BaseImporter.MEASURE:  334})
+        self.assertEqual(9, len(indexes))
+        self.assertTrue(indexes_while_loading)
+        self.assertEqual(set(), set.union(*indexes_while_loading))
+        self.assertEqual(indexes, self._measure_indexes())
+        self.assertFalse(self.cat.bulk_loading)
+        self.assertEqual(1, self.cat.session.execute(
+            "SELECT count(*) FROM sqlite_stat1 "
+            "WHERE idx = 'ix_catalogue_magnitudemeasure_agency'").scalar())
+
+    def test_rebuild_indexes_after_a_failed_bulk_load(self):
+        indexes = self._measure_indexes()
+
+        def interrupt(metrics):
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            with self.cat.bulk_load():
+                V1(self.f, self.cat).store(commit_interval=50,
+                                           on_metrics=interrupt)
+
+        self.assertEqual(indexes, self._measure_indexes())
+        self.assertTrue(self.cat.session.query(
+            catalogue.MagnitudeMeasure).count() >= 50)
+
+    def test_import_metrics(self):
+        reports = []
+        v1_importer = V1(self.broken_isc, self.cat)
+        v1_importer.store(flush_size=2, commit_interval=2,
+                          on_metrics=lambda m: reports.append(m.report()))
+
+        report = reports[-1]
+        self.assertEqual(v1_importer.metrics.report(), report)
+        self.assertEqual(18, report['lines'])
+        self.assertEqual(os.path.getsize(BROKEN_ISC), report['bytes'])
+        self.assertEqual({'junk': 1}, report['errors'])
+        self.assertEqual(2, report['peak_batch'])
+        self.assertEqual(['classify', 'commit', 'parse', 'write'],
+                         sorted(report['times']))
+        self.assertTrue(report['lines_per_second'] > 0)
+
+    def test_parallel_import_metrics(self):
+        v1_importer = V1(self.broken_isc, self.cat)
+        v1_importer.store(processes=2, chunk_size=1)
+
+        self.assertEqual(18, v1_importer.metrics.lines)
+        self.assertEqual({'junk': 1}, v1_importer.metrics.errors)
+
+    def test_memory_mapped_store(self):
+        v1_importer = V1(self.f, self.cat)
+        v1_importer.RECORDS_WINDOW_SIZE = 4096
+        v1_importer.store(memory_map=True)
+
+        self.assertEqual(v1_importer.summary, {
+            BaseImporter.EVENT_SOURCE: 1,
+            BaseImporter.AGENCY: 16,
+            BaseImporter.ORIGIN: 126,
+            BaseImporter.MEASURE:  334})
+
+        importer = V1(self.broken_isc, self.cat)
+        importer.store(memory_map=True)
+        self.assertEqual(1, len(importer.errors))
+        self.assertIn('The line 18 violates', str(importer.errors[0]))
+
+    def test_resume_interrupted_store(self):
+        def interrupt(importer, line_num):
+            if line_num == 400:
+                raise KeyboardInterrupt
+
+        importer = V1(self.f, self.cat)
+        with self.assertRaises(KeyboardInterrupt):
+            importer.store(commit_interval=50, on_line_read=interrupt)
+        self.cat.session.rollback()
+        measures = self.cat.session.query(catalogue.MagnitudeMeasure)
+        self.assertTrue(0 < measures.count() < 334)
+
+        with open(DATAFILE_ISC) as stream:
+            importer = V1(stream, self.cat)
+            importer.store(commit_interval=50, resume=True)
+
+        self.assertEqual(measures.count(), 334)
+        self.assertEqual(126, importer.counter('origin_key'))
+        self.assertTrue(importer._journal.completed)
+        # the journal counts the written rows, one measure of the file
+        # is repeated
+        self.assertEqual(335, importer._journal.measures)
+
+    def test_resume_completed_store(self):
+        V1(self.f, self.cat).store()
+
+        with open(DATAFILE_ISC) as stream:
+            importer = V1(stream, self.cat)
+            importer.store(resume=True)
+
+        self.assertEqual({}, importer.summary)
+        self.assertEqual(0, importer.line_counts.get('measure_block', 0))
+
     def test_import_with_uk_scale(self):
         importer = V1(self.uk_scale_isc, self.cat)
         importer.store()
@@ -92,6 +391,36 @@ class ShouldImportFromISFBulletinV1(unittest.TestCase):
             BaseImporter.MEASURE:  4})
         self.assertEqual(importer.errors, [])
 
+    def test_line_counts(self):
+        importer = V1(self.uk_scale_isc, self.cat)
+        importer.store()
+
+        self.assertEqual({'junk': 1,
+                          'catalogue_header': 1,
+                          'event_header': 1,
+                          'origin_header': 1,
+                          'origin_block': 5,
+                          'comment': 3,
+                          'measure_header': 1,
+                          'measure_block': 1,
+                          'measure_unknown_scale_block': 3,
+                          'stop': 1}, importer.line_counts)
+
+
+class ShouldImportIntoAPlainSqliteDatabase(ShouldImportFromISFBulletinV1):
+    """
+    Run the ISF importer tests against the engine without spatialite
+    """
+
+    def setUp(self):
+        super(ShouldImportIntoAPlainSqliteDatabase, self).setUp()
+        self.cat = catalogue.CatalogueDatabase(
+            engine='eqcatalogue.datastores.sqlite', memory=True)
+
+    def tearDown(self):
+        super(ShouldImportIntoAPlainSqliteDatabase, self).tearDown()
+        catalogue.CatalogueDatabase(memory=True, drop=True)
+
 
 class AIaspeiImporterShould(unittest.TestCase):
 
@@ -120,7 +449,30 @@ class AIaspeiImporterShould(unittest.TestCase):
         importer = Iaspei(csv_file, self.cat)
         exp_num_entries = 2
         self.assertEqual(exp_num_entries, len(
-            importer._parse_csv(header=False)))
+            list(importer._parse_csv(header=False))))
+
+    def test_report_the_line_of_an_invalid_entry(self):
+        with open(DATAFILE_IASPEI) as csv_file:
+            lines = csv_file.readlines()
+        lines[1] = lines[1].replace('07:12:06.43', '07:72:06.43')
+        for check in (
+                lambda stream: Iaspei(stream, self.cat).store(),
+                lambda stream: list(Iaspei.parse_stream(stream, 10))):
+            with self.assertRaises(ValueError) as context:
+                check(StringIO(''.join(lines)))
+            self.assertIn('at line 2:', str(context.exception))
+
+    def test_import_a_leap_second(self):
+        with open(DATAFILE_IASPEI) as csv_file:
+            lines = csv_file.readlines()
+        lines[1] = lines[1].replace('07:12:06.43', '07:12:60.00')
+        Iaspei(StringIO(''.join(lines)), self.cat).store()
+
+        self.assertEqual(61, self.cat.session.query(
+            catalogue.MagnitudeMeasure).count())
+        self.assertEqual(2, self.cat.session.query(
+            catalogue.MagnitudeMeasure).filter_by(
+                time=datetime(2008, 2, 9, 7, 13)).count())
 
     def test_import_csv_iaspei(self):
         self.csv_importer.store()
@@ -136,6 +488,16 @@ class AIaspeiImporterShould(unittest.TestCase):
         importer = Iaspei(self.file, self.cat)
         importer.store()
 
+    def test_import_csv_iaspei_in_small_batches(self):
+        summary = self.csv_importer.store(flush_size=5, commit_interval=10)
+
+        self.assertEqual(summary, {
+            BaseImporter.EVENT_SOURCE: 1,
+            BaseImporter.AGENCY: 1,
+            BaseImporter.ORIGIN: 46,
+            BaseImporter.MEASURE:  61
+        })
+
     def test_importing_once_the_same_csv(self):
 
         first_importer = Iaspei(self.file, self.cat)
@@ -148,6 +510,463 @@ class AIaspeiImporterShould(unittest.TestCase):
         self.assertEqual(measures.count(),  61)
 
 
+class AnIscHtmlImporterShould(unittest.TestCase):
+
+    def setUp(self):
+        self.cat = catalogue.CatalogueDatabase(memory=True, drop=True)
+
+    def test_import_a_web_query_page(self):
+        with open(DATAFILE_ISC) as page:
+            importer = IscHtml(page, self.cat)
+            importer.store()
+
+        self.assertEqual(importer.summary, {
+            BaseImporter.EVENT_SOURCE: 1,
+            BaseImporter.AGENCY: 16,
+            BaseImporter.ORIGIN: 126,
+            BaseImporter.MEASURE: 334})
+        self.assertEqual([], importer.errors)
+
+    def test_remove_the_markup_of_the_bulletin(self):
+        with open(TWO_EVENTS_ISC) as bulletin:
+            lines = bulletin.read().replace(
+                'Event   894327 Mozambique',
+                'Event   <a href="/cgi-bin/event?id=894327">894327</a> '
+                'Mozambique &amp; Malawi').replace(
+                    'PAS        1932415',
+                    'PAS        <a href="/cgi-bin/origin">1932415</a>'
+                ).splitlines(True)
+        page = ('<html><body>\n<p>Events found: 2</p><pre>' +
+                ''.join(lines).replace('STOP\n', 'STOP\n</pre>\n') +
+                '</body></html>\n')
+
+        text = list(PreformattedText(StringIO(page)))
+        self.assertEqual(page.count('\n'), len(text))
+        self.assertEqual(['\n', 'DATA_TYPE EVENT IMS1.0\n', 'ISC Bulletin\n'],
+                         text[:3])
+
+        importer = IscHtml(StringIO(page), self.cat)
+        importer.store()
+        self.assertEqual([], importer.errors)
+        measure = self.cat.session.query(
+            catalogue.MagnitudeMeasure).filter_by(agency='PAS').one()
+        self.assertEqual(('894327', '1932415', 'Mozambique & Malawi'),
+                         (measure.event_key, measure.origin_key,
+                          measure.event_name))
+
+
+class ACsv1ImporterShould(unittest.TestCase):
+
+    def setUp(self):
+        self.file = file(DATAFILE_CSV1)
+        self.cat = catalogue.CatalogueDatabase(memory=True, drop=True)
+
+    def tearDown(self):
+        self.file.close()
+
+    def test_import_csv1(self):
+        importer = Csv1(self.file, self.cat)
+        summary = importer.store(block_size=7)
+
+        self.assertEqual(summary, {
+            BaseImporter.EVENT_SOURCE: 1,
+            BaseImporter.AGENCY: 9,
+            BaseImporter.ORIGIN: 21,
+            BaseImporter.MEASURE: 30})
+        self.assertEqual([], importer.errors)
+
+        measure = self.cat.session.query(catalogue.MagnitudeMeasure).filter_by(
+            agency='NEIC').first()
+        self.assertEqual('CSV1', measure.event_source)
+        self.assertEqual('1008566', measure.event_key)
+        self.assertEqual('4132169', measure.origin_key)
+        self.assertEqual('mb', measure.scale)
+        self.assertEqual(4.0, measure.value)
+        self.assertEqual(None, measure.standard_error)
+        self.assertEqual(datetime(2001, 5, 2, 3, 7, 15, 730000),
+                         measure.time)
+        self.assertEqual(33.0, measure.depth)
+        self.assertEqual(None, measure.depth_error)
+
+    def test_match_the_entries_read_by_the_converter(self):
+        Csv1(self.file, self.cat).store()
+
+        with open(DATAFILE_CSV1) as stream:
+            entries = list(CsvEqCatalogueReader(stream).read(Converter()))
+        measures = self.cat.session.query(catalogue.MagnitudeMeasure)
+        self.assertEqual(
+            sorted((entry['originID'] or entry['solutionKey'],
+                    entry['mag_type'], entry['magnitude'],
+                    entry['Latitude'], entry['Longitude'])
+                   for entry in entries),
+            sorted((measure.origin_key, measure.scale, measure.value)
+                   + measure.position_as_tuple()[::-1]
+                   for measure in measures))
+
+    def test_read_quoted_fields(self):
+        entries = self.file.readlines()[:2]
+        entries[0] = entries[0].replace(',1_IDC_MS   ,', ',"IDC, MS",')
+        importer = Csv1(StringIO(''.join(entries)), self.cat)
+        importer.store()
+
+        self.assertEqual([], importer.errors)
+        self.assertEqual(2, self.cat.session.query(
+            catalogue.MagnitudeMeasure).count())
+        entry = next(CsvEqCatalogueReader(
+            StringIO(entries[0])).read(Converter()))
+        self.assertEqual('IDC, MS', entry['solutionDesc'])
+
+    def test_skip_invalid_entries(self):
+        entries = self.file.readlines()[:3]
+        entries[0] = entries[0].replace(',2001,5,2,', ',2001,13,2,')
+        entries[1] = entries[1].replace(',3.7,', ',big,')
+        entries.insert(2, '1008566,2\n')
+        importer = Csv1(StringIO(''.join(entries)), self.cat)
+        importer.store()
+
+        self.assertEqual(
+            ['The line %d violates the csv1 format' % line_num
+             for line_num in (3, 1, 2)],
+            [str(error) for error in importer.errors])
+        self.assertEqual(1, self.cat.session.query(
+            catalogue.MagnitudeMeasure).count())
+        self.assertEqual({'entry': 3}, importer.metrics.errors)
+
+    def test_load_file(self):
+        self.cat.load_file(DATAFILE_CSV1, 'csv1')
+
+        self.assertEqual(30, self.cat.session.query(
+            catalogue.MagnitudeMeasure).count())
+
+
+class AMeasureWriterShould(unittest.TestCase):
+
+    def setUp(self):
+        self.cat = catalogue.CatalogueDatabase(memory=True, drop=True)
+        self.writer = MeasureWriter(self.cat, flush_size=1, replace=False)
+
+    def _row(self, event_key, agency):
+        return ('source', event_key, None, agency, 'origin', 'mb', 4.0,
+                None, '2001-05-02 03:07:11.880000', None, None, None, None,
+                position_wkt(32.6, 85.4), 10.0, None, None)
+
+    def test_discard_the_event_violating_a_constraint(self):
+        self.writer.add(self._row('1', 'ISC'))
+        self.writer.start_event()
+        self.writer.add(self._row('2', 'ISC'))
+        self.writer.add(self._row('2', 'NEIC'))
+        with self.assertRaises(IntegrityError):
+            self.writer.add(self._row('2', 'NEIC'))
+
+        self.assertTrue(self.writer.discard_event())
+        self.writer.start_event()
+        self.writer.add(self._row('3', 'IDC'))
+        self.writer.commit()
+
+        self.assertEqual(
+            [('1', 'ISC'), ('3', 'IDC')],
+            sorted((measure.event_key, measure.agency) for measure in
+                   self.cat.session.query(catalogue.MagnitudeMeasure)))
+        self.assertEqual(2, self.writer.created_measures)
+        self.assertEqual(set(['ISC', 'IDC']), self.writer.created['agency'])
+
+    def test_discard_only_the_buffered_event_violating_a_constraint(self):
+        discarded = []
+        writer = MeasureWriter(
+            self.cat, replace=False,
+            on_discarded=lambda label, _: discarded.append(label))
+        writer.add(self._row('1', 'ISC'))
+        writer.commit()
+        for label, rows in (('a', [self._row('2', 'ISC')]),
+                            ('b', [self._row('3', 'ISC'),
+                                   self._row('1', 'ISC')]),
+                            ('c', [self._row('4', 'ISC')])):
+            writer.start_event(label)
+            for row in rows:
+                writer.add(row)
+        writer.start_event('d')
+        writer.commit()
+
+        self.assertEqual(['b'], discarded)
+        self.assertEqual(
+            ['1', '2', '4'],
+            sorted(measure.event_key for measure in
+                   self.cat.session.query(catalogue.MagnitudeMeasure)))
+        self.assertEqual(3, writer.created_measures)
+
+    def test_not_discard_the_previous_events(self):
+        self.writer.flush_size = 3
+        self.writer.add(self._row('1', 'ISC'))
+        self.writer.add(self._row('1', 'ISC'))
+        self.writer.start_event()
+        with self.assertRaises(IntegrityError):
+            self.writer.add(self._row('2', 'ISC'))
+
+        self.assertFalse(self.writer.discard_event())
+
+
+    def test_restore_the_connection_when_closed(self):
+        writer = MeasureWriter(self.cat)
+        writer.add(self._row('1', 'ISC'))
+        writer.add(self._row('1', 'ISC'))
+        writer.commit()
+        writer.close()
+
+        self.assertEqual(1, writer.replaced)
+        self.assertEqual(0, self.cat.session.execute(
+            "PRAGMA recursive_triggers").scalar())
+        self.assertEqual(0, self.cat.session.execute(
+            "SELECT COUNT(*) FROM sqlite_temp_master").scalar())
+
+    def test_append_only_the_new_and_changed_rows(self):
+        self.writer.add(self._row('1', 'ISC'))
+        self.writer.add(self._row('2', 'ISC'))
+        self.writer.commit()
+
+        writer = MeasureWriter(self.cat, flush_size=2, append=True)
+        changed = self._row('2', 'ISC')[:6] + (4.5,) + self._row(
+            '2', 'ISC')[7:]
+        for row in (self._row('1', 'ISC'), changed, self._row('3', 'ISC')):
+            writer.add(row)
+        writer.commit()
+
+        self.assertEqual((1, 1, 1),
+                         (writer.skipped, writer.changed, writer.new))
+        self.assertEqual(1, writer.created_measures)
+        self.assertEqual(
+            [('1', 4.0), ('2', 4.5), ('3', 4.0)],
+            sorted((measure.event_key, measure.value) for measure in
+                   self.cat.session.query(catalogue.MagnitudeMeasure)))
+
+    def test_forget_the_rows_of_a_discarded_event(self):
+        writer = MeasureWriter(self.cat, flush_size=1, append=True)
+        writer.add(self._row('1', 'ISC'))
+        writer.start_event()
+        writer.add(self._row('2', 'ISC'))
+        self.assertTrue(writer.discard_event())
+        writer.start_event()
+        writer.add(self._row('2', 'ISC'))
+        writer.commit()
+
+        self.assertEqual((0, 0, 2),
+                         (writer.skipped, writer.changed, writer.new))
+        self.assertEqual(2, self.cat.session.query(
+            catalogue.MagnitudeMeasure).count())
+
+
+class ABatchLoaderShould(unittest.TestCase):
+
+    def setUp(self):
+        self.cat = catalogue.CatalogueDatabase(memory=True, drop=True)
+        self.loader = BatchLoader(self.cat, processes=2, batch_size=50,
+                                  queue_size=1)
+
+    def test_load_files_of_mixed_formats(self):
+        summary = self.loader.load([(DATAFILE_ISC, V1),
+                                    (UK_SCALE_ISC, V1),
+                                    (DATAFILE_IASPEI, Iaspei),
+                                    (DATAFILE_CSV1, Csv1),
+                                    (BROKEN_ISC, V1)])
+
+        self.assertEqual(summary, {
+            BaseImporter.EVENT_SOURCE: 3,
+            BaseImporter.AGENCY: 23,
+            BaseImporter.ORIGIN: 197,
+            BaseImporter.MEASURE: 429})
+        self.assertEqual(429, self.cat.session.query(
+            catalogue.MagnitudeMeasure).count())
+        self.assertEqual(
+            ['The line 18 of %s can not be imported' % BROKEN_ISC],
+            [str(error) for error in self.loader.errors])
+        self.assertEqual(
+            [335, 4, 61, 30, 0],
+            [metrics.rows for metrics in self.loader.file_metrics])
+        self.assertEqual(6, len(self.loader.report()))
+
+    def test_report_the_files_that_can_not_be_parsed(self):
+        filename = os.path.join(tempfile.mkdtemp(), 'bad.csv')
+        try:
+            with open(filename, 'w') as stream:
+                stream.write('eventID,Author,Date,Time,Lat,Lon,Depth,Fix\n'
+                             '10525612,IASPEI,2008-02-09,07:12:06.43,'
+                             '32.4850,-115.2935,20.6,,IASPEI,MS\n')
+            self.loader.load([(filename, Iaspei)])
+        finally:
+            shutil.rmtree(os.path.dirname(filename))
+
+        self.assertEqual(1, len(self.loader.errors))
+        self.assertIn('InvalidMagnitudeSeq', str(self.loader.errors[0]))
+
+    def test_report_the_files_that_can_not_be_read(self):
+        missing = in_data_dir('missing.txt')
+        summary = self.loader.load([(missing, V1), (UK_SCALE_ISC, V1)])
+
+        self.assertEqual(4, summary[BaseImporter.MEASURE])
+        self.assertEqual(1, len(self.loader.errors))
+        self.assertIn('The import of %s failed' % missing,
+                      str(self.loader.errors[0]))
+
+
+class AnImporterValidationShould(unittest.TestCase):
+
+    def test_count_the_parsed_entities(self):
+        for kwargs in ({}, {'processes': 2, 'chunk_size': 4096}):
+            with open(DATAFILE_ISC) as bulletin:
+                report = V1.validate(bulletin, **kwargs)
+
+            self.assertTrue(report.valid)
+            self.assertEqual({'events': 18, 'origins': 126,
+                              'measures': 335, 'agencies': 16,
+                              'scales': 19}, report.counts)
+            self.assertEqual(603, report.lines)
+
+    def test_report_the_parsing_failures(self):
+        for kwargs in ({}, {'processes': 2, 'chunk_size': 1}):
+            with open(BROKEN_ISC) as bulletin:
+                report = V1.validate(bulletin, **kwargs)
+
+            self.assertFalse(report.valid)
+            self.assertEqual(['The line 18 violates'],
+                             [str(failure)[:20]
+                              for failure in report.failures])
+
+    def test_report_the_invalid_entries(self):
+        report = Iaspei.validate(StringIO(
+            'eventID,Author,Date,Time,Lat,Lon,Depth,Fix\n'
+            '10525612,IASPEI,2008-02-09,07:12:06.43,32.4850,-115.2935,'
+            '20.6,,IASPEI,MS,4.7\n'
+            '10525613,IASPEI,2008-02-09,07:12:06.43,32.4850,-115.2935,'
+            '20.6,,IASPEI,MS\n'))
+
+        self.assertEqual([Iaspei.ERR_MAG_GROUP_LINE % 3],
+                         [str(failure) for failure in report.failures])
+
+
+class ADateDecoderShould(unittest.TestCase):
+
+    def test_decode_times(self):
+        times, invalid = decode_times(
+            ['2008-02-09', '2008/02/29', '1951-05-10', '2008-07-26'],
+            ['07:12:06.43', '23:59:59', '09:18:25.123456', '20:15:11.04'])
+
+        self.assertEqual([False] * 4, invalid.tolist())
+        self.assertEqual([datetime(2008, 2, 9, 7, 12, 6, 430000),
+                          datetime(2008, 2, 29, 23, 59, 59),
+                          datetime(1951, 5, 10, 9, 18, 25, 123456),
+                          datetime(2008, 7, 26, 20, 15, 11, 40000)],
+                         times.astype(object).tolist())
+        self.assertEqual([format_time(time)
+                          for time in times.astype(object).tolist()],
+                         format_times(times))
+
+    def test_detect_invalid_times(self):
+        _, invalid = decode_times(
+            ['2007-02-29', '2008-13-01', '2008-02-09', '2008-02-09',
+             '2008-02-09', '08-02-09', '2008-02-09'],
+            ['07:12:06.43', '07:12:06.43', '24:00:00', '07:12:6.4',
+             '07:12:06.1234567', '07:12:06', '07:12:06,43'])
+
+        self.assertEqual([True] * 7, invalid.tolist())
+
+    def test_carry_a_leap_second_into_the_next_minute(self):
+        times, invalid = decode_times(
+            ['2008-12-31', '2005-06-30', '2005-06-30'],
+            ['23:59:60.00', '12:30:60.25', '12:30:61'])
+
+        self.assertEqual([False, False, True], invalid.tolist())
+        self.assertEqual([datetime(2009, 1, 1), datetime(2005, 6, 30, 12, 31,
+                                                         0, 250000)],
+                         times[:2].astype(object).tolist())
+
+
+class BulletinRecordsShould(unittest.TestCase):
+
+    def setUp(self):
+        self.bulletin = BulletinRecords(DATAFILE_ISC)
+        self.window = next(self.bulletin.windows())
+
+    def tearDown(self):
+        self.bulletin.close()
+
+    def test_detect_record_kinds(self):
+        # line 27 holds the first origin, line 37 the first measure
+        self.assertEqual(ORIGIN_RECORD, self.window.kinds[26])
+        self.assertEqual(MEASURE_RECORD, self.window.kinds[36])
+        self.assertEqual(128, (self.window.kinds == ORIGIN_RECORD).sum())
+        self.assertEqual(331, (self.window.kinds == MEASURE_RECORD).sum())
+
+    def test_cut_the_windows_at_newlines(self):
+        windows = list(self.bulletin.windows(size=1000))
+
+        self.assertTrue(len(windows) > 1)
+        with open(DATAFILE_ISC) as bulletin:
+            self.assertEqual(
+                bulletin.readlines(),
+                [window.line(index) for window in windows
+                 for index in xrange(len(window))])
+        self.assertEqual(
+            self.window.kinds.tolist(),
+            [kind for window in windows for kind in window.kinds.tolist()])
+
+    def test_decode_origins(self):
+        key, origin = decode_origins(
+            self.window.records([26], ORIGIN_RECORD_DTYPE))[0]
+
+        self.assertEqual('16660453', key)
+        self.assertEqual(
+            (datetime(2010, 2, 28, 0, 0, 43, 12), 0.49, 0.77, 16.6, 10.6,
+             'POINT(-73.4847 -36.6671)', 0.0, None, 116), origin)
+
+    def test_decode_measures(self):
+        measure = decode_measures(
+            self.window.records([36], MEASURE_RECORD_DTYPE))[0]
+
+        self.assertEqual(('IDC', 'MS', 4.8, 0.2, '16660453'), measure)
+
+
+class CompressedInputShould(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        with open(DATAFILE_ISC) as stream:
+            self.content = stream.read()
+        self.gz_file = os.path.join(self.tmp_dir, 'isc.gz')
+        self.bz2_file = os.path.join(self.tmp_dir, 'isc.bz2')
+        with gzip.open(self.gz_file, 'wb') as stream:
+            stream.write(self.content)
+        stream = bz2.BZ2File(self.bz2_file, 'w')
+        stream.write(self.content)
+        stream.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_detect_codec(self):
+        self.assertEqual('gzip', detect_codec(self.gz_file))
+        self.assertEqual('bz2', detect_codec(self.bz2_file))
+        self.assertEqual(None, detect_codec(DATAFILE_ISC))
+
+    def test_read_lines(self):
+        lines = self.content.splitlines(True)
+        for filename in (self.gz_file, self.bz2_file):
+            for threaded in (False, True):
+                with open_input(filename, threaded, block_size=100) as s:
+                    self.assertEqual(lines, list(s))
+                    self.assertEqual(filename, s.name)
+
+    def test_seek_before_reading(self):
+        with open_input(self.gz_file, threaded=True, block_size=100) as s:
+            s.seek(250)
+            self.assertEqual(self.content[250:], ''.join(s))
+
+    def test_load_compressed_file(self):
+        cat = catalogue.CatalogueDatabase(memory=True, drop=True)
+        cat.load_file(self.gz_file, 'isf_bulletin')
+
+        measures = cat.session.query(catalogue.MagnitudeMeasure)
+        self.assertEqual(measures.count(), 334)
+
+
 class EqCatalogueReaderTestCase(unittest.TestCase):
 
     def setUp(self):